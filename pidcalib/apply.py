@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  apply.py
+#  Vectorized application of the efficiency maps to (MC) trees
+#
+#  For each track the axis expressions are read in batches (columnar reads),
+#  the efficiencies are obtained with vectorized bin lookup, and the
+#  per-event efficiency is the product of the per-track efficiencies.
+#  The results are written as new branches or as friend trees.
+#  For multi-file chains the parallel processing is split by file
+#
+#  @code
+#  apply = ApplyEff ( { 'pi1' : ( eff_pi , ( 'log10(pi1_P/1000)' , 'pi1_ETA' ) ) ,
+#                       'pi2' : ( eff_pi , ( 'log10(pi2_P/1000)' , 'pi2_ETA' ) ) ,
+#                       'k'   : ( eff_k  , ( 'log10(k_P/1000)'   , 'k_ETA'   ) ) } ,
+#                     event = 'pid_eff' )
+#  chain = apply.process ( chain , parallel = True )
+#  @endcode
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Vectorized application of the efficiency maps to (MC) trees
+
+For each track the axis expressions are read in batches (columnar reads),
+the efficiencies are obtained with vectorized bin lookup, and the
+per-event efficiency is the product of the per-track efficiencies.
+The results are written as new branches or as friend trees.
+For multi-file chains the parallel processing is split by file
+
+>>> apply = ApplyEff ( { 'pi1' : ( eff_pi , ( 'log10(pi1_P/1000)' , 'pi1_ETA' ) ) ,
+...                      'pi2' : ( eff_pi , ( 'log10(pi2_P/1000)' , 'pi2_ETA' ) ) ,
+...                      'k'   : ( eff_k  , ( 'log10(k_P/1000)'   , 'k_ETA'   ) ) } ,
+...                    event = 'pid_eff' )
+>>> chain = apply.process ( chain , parallel = True )
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'EffMap'    , ## vectorized lookup in the efficiency histogram
+    'ApplyEff'  , ## apply efficiency maps to (MC) trees
+    'ApplyTask' , ## task for the parallel application of efficiency maps
+)
+# =============================================================================
+from   ostap.utils.basic        import typename
+from   ostap.utils.progress_bar import progress_bar
+from   ostap.parallel.task      import Task
+from   pidcalib.fill            import axis_edges
+from   pidcalib.utils           import read_range
+import ostap.trees.trees
+import numpy, os, ROOT
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.apply')
+# =============================================================================
+## @class EffMap
+#  Vectorized lookup in the efficiency histogram (TH1, TH2 or TH3)
+#  - values outside the histogram range are taken from the edge bins
+#    or set to the `default` value
+#  - NaN values get NaN efficiency (or the `default` value)
+#  @code
+#  emap = EffMap ( eff2D )
+#  eff  = emap ( [ p_array , eta_array ] )
+#  @endcode
+class EffMap(object) :
+    """ Vectorized lookup in the efficiency histogram (TH1, TH2 or TH3)
+    - values outside the histogram range are taken from the edge bins
+      or set to the `default` value
+    - NaN values get NaN efficiency (or the `default` value)
+    >>> emap = EffMap ( eff2D )
+    >>> eff  = emap ( [ p_array , eta_array ] )
+    """
+    def __init__ ( self , histo , default = None ) :
+
+        assert isinstance ( histo , ROOT.TH1 ) and 1 <= histo.GetDimension () <= 3 , \
+            "EffMap: invalid histogram type %s" % typename ( histo )
+
+        dim   = histo.GetDimension ()
+        axes  = ( histo.GetXaxis () , histo.GetYaxis () , histo.GetZaxis () ) [ : dim ]
+        self.__edges   = tuple ( numpy.asarray ( axis_edges ( a ) ) for a in axes )
+        shape          = tuple ( len ( e ) - 1 for e in self.__edges )
+        values         = numpy.zeros ( shape , dtype = numpy.float64 )
+        for index in numpy.ndindex ( *shape ) :
+            values [ index ] = histo.GetBinContent ( *[ i + 1 for i in index ] )
+        self.__values  = values
+        self.__default = default
+
+    @property
+    def ndim ( self ) :
+        """`ndim` : number of dimensions"""
+        return len ( self.__edges )
+
+    @property
+    def values ( self ) :
+        """`values` : the array of bin contents"""
+        return self.__values
+
+    # =========================================================================
+    ## Vectorized lookup
+    #  @param values list of arrays, one per axis
+    #  @return array of efficiencies
+    def __call__ ( self , values ) :
+        """ Vectorized lookup
+        - values : list of arrays, one per axis
+        - return array of efficiencies
+        """
+        assert len ( values ) == self.ndim , "EffMap: invalid number of axes %d" % len ( values )
+        bins    = []
+        outside = None
+        invalid = None 
+        for v , e in zip ( values , self.__edges ) :
+            v  = numpy.asarray ( v , dtype = numpy.float64 )
+            b  = numpy.searchsorted ( e , v , side = 'right' ) - 1
+            n  = numpy.isnan ( v ) 
+            o  = ( b < 0 ) | ( len ( e ) - 1 <= b ) | n
+            outside = o if outside is None else outside | o
+            invalid = n if invalid is None else invalid | n
+            bins.append ( numpy.clip ( b , 0 , len ( e ) - 2 ) )
+        result = self.__values [ tuple ( bins ) ]
+        if not self.__default is None : result = numpy.where ( outside , self.__default , result )
+        elif numpy.any ( invalid )    : result = numpy.where ( invalid , numpy.nan      , result )
+        return result
+
+# =============================================================================
+## @class ApplyEff
+#  Apply efficiency maps to (MC) trees: per-track and per-event efficiencies
+#  @code
+#  apply = ApplyEff ( { 'pi1' : ( eff_pi , ( 'log10(pi1_P/1000)' , 'pi1_ETA' ) ) ,
+#                       'pi2' : ( eff_pi , ( 'log10(pi2_P/1000)' , 'pi2_ETA' ) ) } ,
+#                     event = 'pid_eff' )
+#  chain = apply.process ( chain , parallel = True )
+#  @endcode
+class ApplyEff(object) :
+    """ Apply efficiency maps to (MC) trees: per-track and per-event efficiencies
+    >>> apply = ApplyEff ( { 'pi1' : ( eff_pi , ( 'log10(pi1_P/1000)' , 'pi1_ETA' ) ) ,
+    ...                      'pi2' : ( eff_pi , ( 'log10(pi2_P/1000)' , 'pi2_ETA' ) ) } ,
+    ...                    event = 'pid_eff' )
+    >>> chain = apply.process ( chain , parallel = True )
+    """
+    def __init__ ( self                  ,
+                   tracks                ,   ## { track : ( histo , expressions ) }
+                   event   = 'pid_eff'   ,   ## name of per-event efficiency
+                   suffix  = '_pid_eff'  ,   ## suffix for per-track efficiencies
+                   default = None        ) : ## efficiency outside the map range (`None`: edge bins)
+
+        assert tracks , "ApplyEff: no tracks are specified!"
+
+        self.__tracks = []
+        maps          = {}
+        for track , ( histo , expressions ) in tracks.items () :
+            expressions = ( expressions , ) if isinstance ( expressions , str ) else tuple ( expressions )
+            ## the same histogram is converted only once
+            if not id ( histo ) in maps : maps [ id ( histo ) ] = EffMap ( histo , default = default )
+            emap = maps [ id ( histo ) ]
+            assert emap.ndim == len ( expressions ) , \
+                "ApplyEff: invalid number of expressions %d for track `%s`" % ( len ( expressions ) , track )
+            self.__tracks.append ( ( track , emap , expressions ) )
+
+        self.__event  = event
+        self.__suffix = suffix
+
+        ## unique expressions to read
+        expressions = []
+        for _ , _ , exprs in self.__tracks :
+            for e in exprs :
+                if not e in expressions : expressions.append ( e )
+        self.__expressions = tuple ( expressions )
+
+    @property
+    def expressions ( self ) :
+        """`expressions` : all (unique) expressions to be read"""
+        return self.__expressions
+
+    ## names of the output branches
+    def outputs ( self ) :
+        """ Names of the output branches
+        """
+        names = tuple ( '%s%s' % ( track , self.__suffix ) for track , _ , _ in self.__tracks )
+        return names + ( self.__event , ) if self.__event else names
+
+    # =========================================================================
+    ## Evaluate per-track and per-event efficiencies for the columns
+    #  @param data array of shape (N, number of expressions)
+    #  @return dictionary { branch : array }
+    def evaluate ( self , data ) :
+        """ Evaluate per-track and per-event efficiencies for the columns
+        - data : array of shape (N, number of expressions)
+        - return dictionary { branch : array }
+        """
+        column  = { e : data [ : , i ] for i , e in enumerate ( self.__expressions ) }
+        results = {}
+        product = None
+        for track , emap , exprs in self.__tracks :
+            eff = emap ( [ column [ e ] for e in exprs ] )
+            results [ '%s%s' % ( track , self.__suffix ) ] = eff
+            product = eff.copy () if product is None else product * eff
+        if self.__event : results [ self.__event ] = product
+        return results
+
+    # =========================================================================
+    ## Evaluate efficiencies for the tree, reading columns in batches
+    #  @return dictionary { branch : array }
+    def arrays ( self , tree , chunk_size = -1 , progress = False ) :
+        """ Evaluate efficiencies for the tree, reading columns in batches
+        - return dictionary { branch : array }
+        """
+        N      = len ( tree )
+        ranges = [ ( 0 , N ) ] if chunk_size <= 0 or N <= chunk_size else \
+                 [ ( first , min ( first + chunk_size , N ) ) for first in range ( 0 , N , chunk_size ) ]
+        parts  = []
+        for first , last in progress_bar ( ranges , silent = not progress or len ( ranges ) < 2 ) :
+            if 0 == first and N <= last :
+                data , _ = tree.slice ( list ( self.__expressions ) , '' , structured = False , transpose = True )
+            else :
+                ## only the entries in the range are read 
+                data = read_range ( tree , self.__expressions , first , last )
+            parts.append ( self.evaluate ( data ) )
+        return { k : numpy.concatenate ( [ p [ k ] for p in parts ] ) for k in self.outputs () }
+
+    # =========================================================================
+    ## Process a single tree: add new branches or write the friend tree
+    #  @param tree       the input tree
+    #  @param friend     the file name for the friend tree (if specified)
+    #  @param chunk_size the batch size for the columnar reads
+    #  @return the updated tree or the friend tree name
+    def run ( self , tree , friend = '' , chunk_size = -1 , progress = False , report = False ) :
+        """ Process a single tree: add new branches or write the friend tree
+        - friend     : the file name for the friend tree (if specified)
+        - chunk_size : the batch size for the columnar reads
+        """
+        assert isinstance ( tree , ROOT.TTree ) , "ApplyEff: invalid type of `tree`: %s" % typename ( tree )
+        results = self.arrays ( tree , chunk_size = chunk_size , progress = progress )
+        if friend :
+            make  = getattr ( ROOT.RDF , 'FromNumpy' , None ) or ROOT.RDF.MakeNumpyDataFrame
+            frame = make ( results )
+            frame.Snapshot ( tree.GetName () , friend )
+            return friend
+        return tree.add_new_buffer ( results , report = report , progress = progress )
+
+    # =========================================================================
+    ## The name of the friend file for the input file
+    def friend_name ( self , fname , suffix = '_pideff' ) :
+        """ The name of the friend file for the input file
+        """
+        base , ext = os.path.splitext ( fname )
+        return '%s%s%s' % ( base , suffix , ext if ext else '.root' )
+
+    # =========================================================================
+    ## Process the (multi-file) chain
+    #  - the parallel processing is split by file
+    #  - with `friend=True` the results are written into the friend files, one per input file,
+    #    and the friend chain is attached to the returned chain
+    #  @return the updated chain
+    def process ( self              ,
+                  chain             ,
+                  parallel   = False ,
+                  friend     = False ,
+                  chunk_size = -1    ,
+                  progress   = True  ,
+                  silent     = False ,
+                  **kwargs           ) :
+        """ Process the (multi-file) chain
+        - the parallel processing is split by file
+        - with `friend=True` the results are written into the friend files, one per input file,
+          and the friend chain is attached to the returned chain
+        - return the updated chain
+        """
+        assert isinstance ( chain , ROOT.TTree ) , "ApplyEff: invalid type of `chain`: %s" % typename ( chain )
+
+        for name in self.outputs () :
+            if name in chain :
+                logger.error ( 'Variable %s already in the TTree, skip processing!' % name )
+                return chain
+
+        if not isinstance ( chain , ROOT.TChain ) :
+            assert not friend , "ApplyEff: friend mode requires TChain"
+            return self.run ( chain , chunk_size = chunk_size , progress = progress )
+
+        cname = chain.fullpath
+        files = chain.files
+
+        if parallel and 1 < len ( files ) :
+            from ostap.trees.utils       import Chain
+            from ostap.parallel.parallel import WorkManager
+            trees = Chain ( chain ).split ( chunk_size = -1 , max_files = 1 )
+            task  = ApplyTask ( self , friend = friend , chunk_size = chunk_size )
+            wmgr  = WorkManager ( silent = silent , progress = progress , **kwargs )
+            wmgr.process ( task , trees )
+        else :
+            for fname in progress_bar ( files , silent = not progress or len ( files ) < 2 ) :
+                tree = ROOT.TChain ( cname )
+                tree.Add ( fname )
+                self.run ( tree , friend = self.friend_name ( fname ) if friend else '' , chunk_size = chunk_size )
+
+        ## reconstruct the resulting chain
+        chain = ROOT.TChain ( cname )
+        for fname in files : chain.Add ( fname )
+        if friend :
+            fchain = ROOT.TChain ( chain.GetName () )
+            for fname in files : fchain.Add ( self.friend_name ( fname ) )
+            chain.AddFriend ( fchain )
+            self.__friend = fchain ## keep it alive
+        return chain
+
+# =============================================================================
+## @class ApplyTask
+#  Task for the parallel application of efficiency maps, one file per job
+class ApplyTask(Task) :
+    """ Task for the parallel application of efficiency maps, one file per job
+    """
+    def __init__ ( self , apply , friend = False , chunk_size = -1 ) :
+        self.__apply      = apply
+        self.__friend     = friend
+        self.__chunk_size = chunk_size
+
+    ## local initialization (executed once in parent process)
+    def initialize_local ( self ) : pass
+
+    # =========================================================================
+    ## the actual processing
+    def process ( self , jobid , item ) :
+        """ The actual processing
+        """
+        chain  = item.chain
+        files  = chain.files
+        friend = self.__apply.friend_name ( files [ 0 ] ) if self.__friend and files else ''
+        self.__apply.run ( chain , friend = friend , chunk_size = self.__chunk_size )
+
+    ## merge results
+    def merge_results ( self , result , jobid = -1 ) : pass
+    ## get the results
+    def results       ( self ) : pass
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  bootstrap.py
+#  Single-pass bootstrap replicas for the PIDCalib efficiencies
+#
+#  The nominal accepted/rejected histograms and K replicas with
+#  Poisson(1) event weights are filled in the same pass over the data.
+#  The Poisson weights are drawn vectorized, with deterministic
+#  per-file seeds, so the results do not depend on the processing order
+#  or on the parallelization. The replicas give the bin-to-bin
+#  covariance of the efficiency map
+#
+#  @code
+#  boot = Bootstrap ( histo , 100 , seed = 12345 )
+#  boot.fill ( values , accept , weights , key = ( tree_path , fname ) )
+#  efficiency , accepted , rejected = boot.nominal ()
+#  replicas   = boot.replicas   ()  ## replica efficiency histograms
+#  cov        = boot.covariance ()  ## covariance matrix of efficiencies
+#  @endcode
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Single-pass bootstrap replicas for the PIDCalib efficiencies
+
+The nominal accepted/rejected histograms and K replicas with
+Poisson(1) event weights are filled in the same pass over the data.
+The Poisson weights are drawn vectorized, with deterministic
+per-file seeds, so the results do not depend on the processing order
+or on the parallelization. The replicas give the bin-to-bin
+covariance of the efficiency map
+
+>>> boot = Bootstrap ( histo , 100 , seed = 12345 )
+>>> boot.fill ( values , accept , weights , key = ( tree_path , fname ) )
+>>> efficiency , accepted , rejected = boot.nominal ()
+>>> replicas   = boot.replicas   ()  ## replica efficiency histograms
+>>> cov        = boot.covariance ()  ## covariance matrix of efficiencies
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'Bootstrap'     , ## nominal & bootstrap replica histograms
+    'BootstrapTask' , ## task for the parallel filling of bootstrap replicas
+)
+# =============================================================================
+from   ostap.utils.basic   import typename
+from   ostap.parallel.task import Task
+from   pidcalib.fill       import axis_edges, read_columns, efficiency
+from   pidcalib.sweights   import calibration_chain
+import hashlib, numpy, ROOT
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.bootstrap')
+# =============================================================================
+## number of events per chunk of Poisson draws
+CHUNK = 100000
+# =============================================================================
+## @class Bootstrap
+#  Nominal and bootstrap replica accepted/rejected histograms
+#  - underflows & overflows are ignored
+class Bootstrap(object) :
+    """ Nominal and bootstrap replica accepted/rejected histograms
+    - underflows & overflows are ignored
+    """
+    def __init__ ( self , histo , replicas , seed = 0 ) :
+
+        assert isinstance ( histo , ROOT.TH1 ) and 1 <= histo.GetDimension () <= 3 , \
+            "Bootstrap: invalid histogram type %s" % typename ( histo )
+        assert isinstance ( replicas , int ) and 1 <= replicas , \
+            "Bootstrap: invalid number of replicas %s" % replicas
+
+        dim   = histo.GetDimension ()
+        axes  = ( histo.GetXaxis () , histo.GetYaxis () , histo.GetZaxis () ) [ : dim ]
+        self.__histo    = histo
+        self.__edges    = tuple ( numpy.asarray ( axis_edges ( a ) ) for a in axes )
+        self.__shape    = tuple ( len ( e ) - 1 for e in self.__edges )
+        self.__replicas = replicas
+        self.__seed     = seed
+        nbins           = int ( numpy.prod ( self.__shape ) )
+        ## [0] : sum of weights, [1] : sum of squared weights
+        self.__accepted = numpy.zeros ( ( 2 , nbins ) )
+        self.__rejected = numpy.zeros ( ( 2 , nbins ) )
+        ## replicas: sum of weights
+        self.__acc_reps = numpy.zeros ( ( replicas , nbins ) )
+        self.__rej_reps = numpy.zeros ( ( replicas , nbins ) )
+
+    @property
+    def nreplicas ( self ) :
+        """`nreplicas` : number of bootstrap replicas"""
+        return self.__replicas
+
+    @property
+    def seed ( self ) :
+        """`seed` : the global seed"""
+        return self.__seed
+
+    # =========================================================================
+    ## deterministic seed for the given key, e.g. (tree_path, file)
+    def file_seed ( self , key ) :
+        """ Deterministic seed for the given key, e.g. (tree_path, file)
+        """
+        return int ( hashlib.sha1 ( repr ( ( self.__seed , key ) ).encode () ).hexdigest () [ : 16 ] , 16 )
+
+    # =========================================================================
+    ## Fill the nominal and replica histograms
+    #  @param values  list of axis arrays
+    #  @param accept  boolean array for the criterion
+    #  @param weights array of weights (or `None`)
+    #  @param key     the key for the deterministic seed, e.g. (tree_path, file)
+    def fill ( self , values , accept , weights = None , key = () ) :
+        """ Fill the nominal and replica histograms
+        - values  : list of axis arrays
+        - accept  : boolean array for the criterion
+        - weights : array of weights (or `None`)
+        - key     : the key for the deterministic seed, e.g. (tree_path, file)
+        """
+        n    = len ( accept )
+        good = numpy.ones ( n , dtype = bool )
+        bins = []
+        for v , e in zip ( values , self.__edges ) :
+            b     = numpy.searchsorted ( e , numpy.asarray ( v , dtype = numpy.float64 ) , side = 'right' ) - 1
+            good &= ( 0 <= b ) & ( b < len ( e ) - 1 )
+            bins.append ( b )
+
+        nbins  = self.__accepted.shape [ 1 ]
+        w      = numpy.ones ( n ) if weights is None else numpy.asarray ( weights , dtype = numpy.float64 )
+        rng    = numpy.random.default_rng ( self.file_seed ( key ) )
+
+        for first in range ( 0 , n , CHUNK ) :
+            last  = min ( first + CHUNK , n )
+            ## draws for all events (also outside the range) keep the sequence reproducible
+            pois  = rng.poisson ( 1.0 , size = ( self.__replicas , last - first ) )
+            g     = good [ first : last ]
+            if not numpy.any ( g ) : continue
+            index = numpy.ravel_multi_index ( [ b [ first : last ] [ g ] for b in bins ] , self.__shape )
+            ww    = w      [ first : last ] [ g ]
+            acc   = accept [ first : last ] [ g ]
+            pp    = pois [ : , g ]
+            for mask , nominal , reps in ( (  acc , self.__accepted , self.__acc_reps ) ,
+                                           ( ~acc , self.__rejected , self.__rej_reps ) ) :
+                if not numpy.any ( mask ) : continue
+                i , x = index [ mask ] , ww [ mask ]
+                nominal [ 0 ] += numpy.bincount ( i , weights = x     , minlength = nbins )
+                nominal [ 1 ] += numpy.bincount ( i , weights = x * x , minlength = nbins )
+                for k in range ( self.__replicas ) :
+                    reps [ k ] += numpy.bincount ( i , weights = x * pp [ k ] [ mask ] , minlength = nbins )
+        return self
+
+    # =========================================================================
+    ## merge with another object
+    def __iadd__ ( self , other ) :
+        if not isinstance ( other , Bootstrap ) : return NotImplemented
+        assert self.__replicas == other.nreplicas and self.__shape == other._Bootstrap__shape , \
+            "Bootstrap: cannot merge different objects!"
+        self.__accepted += other._Bootstrap__accepted
+        self.__rejected += other._Bootstrap__rejected
+        self.__acc_reps += other._Bootstrap__acc_reps
+        self.__rej_reps += other._Bootstrap__rej_reps
+        return self
+
+    # =========================================================================
+    ## efficiency from accepted & rejected arrays
+    @staticmethod
+    def __efficiency ( a , r ) :
+        total = a + r
+        return numpy.divide ( a , total , out = numpy.zeros_like ( total ) , where = total != 0 )
+
+    ## create the histogram from the arrays
+    def __histo ( self , contents , variances = None ) :
+        h = self.__histo.clone ()
+        h.Reset ()
+        if not h.GetSumw2N () : h.Sumw2 ()
+        for k , index in enumerate ( numpy.ndindex ( *self.__shape ) ) :
+            b = h.GetBin ( *[ i + 1 for i in index ] )
+            h.SetBinContent ( b , float ( contents [ k ] ) )
+            if not variances is None : h.SetBinError ( b , float ( variances [ k ] ) ** 0.5 )
+        return h
+
+    # =========================================================================
+    ## Nominal (efficiency, accepted, rejected) triplet
+    def nominal ( self ) :
+        """ Nominal (efficiency, accepted, rejected) triplet
+        """
+        accepted = self.__histo ( self.__accepted [ 0 ] , self.__accepted [ 1 ] )
+        rejected = self.__histo ( self.__rejected [ 0 ] , self.__rejected [ 1 ] )
+        return efficiency ( accepted , rejected ) , accepted , rejected
+
+    # =========================================================================
+    ## Replica efficiencies: array of shape (K, number of bins)
+    def replica_arrays ( self ) :
+        """ Replica efficiencies: array of shape (K, number of bins)
+        """
+        return self.__efficiency ( self.__acc_reps , self.__rej_reps )
+
+    ## Replica efficiency histograms
+    def replicas ( self ) :
+        """ Replica efficiency histograms
+        """
+        return [ self.__histo ( e ) for e in self.replica_arrays () ]
+
+    # =========================================================================
+    ## Covariance matrix of the efficiencies: array of shape (number of bins, number of bins)
+    #  - the bins are in C-order of (x, y, z) bin indices
+    def covariance ( self ) :
+        """ Covariance matrix of the efficiencies: array of shape (number of bins, number of bins)
+        - the bins are in C-order of (x, y, z) bin indices
+        """
+        reps = self.replica_arrays ()
+        if 2 > len ( reps ) : return numpy.zeros ( ( reps.shape [ 1 ] , reps.shape [ 1 ] ) )
+        return numpy.cov ( reps , rowvar = False )
+
+    ## Bootstrap uncertainties of the efficiencies as the histogram
+    def errors ( self ) :
+        """ Bootstrap uncertainties of the efficiencies as the histogram
+        """
+        return self.__histo ( numpy.sqrt ( numpy.clip ( numpy.diag ( self.covariance () ) , 0 , None ) ) )
+
+    def __repr__ ( self ) : return 'Bootstrap(%s,%d replicas)' % ( 'x'.join ( '%d' % n for n in self.__shape ) , self.__replicas )
+
+# =============================================================================
+## @class BootstrapTask
+#  Task for the parallel filling of bootstrap replicas
+#  - each item is (tree_path, file) unit, the seeds are per-file
+#  - the partials are merged into the running <code>Bootstrap</code> object 
+class BootstrapTask(Task) :
+    """ Task for the parallel filling of bootstrap replicas
+    - each item is (tree_path, file) unit, the seeds are per-file
+    - the partials are merged into the running `Bootstrap` object 
+    """
+    def __init__ ( self , histo , variables , criterion , cuts = '' , weight = '' , replicas = 100 , seed = 0 , friends = None ) :
+
+        self.__histo     = histo
+        self.__variables = tuple ( variables )
+        self.__criterion = criterion
+        self.__cuts      = str ( cuts )
+        self.__weight    = weight
+        self.__replicas  = replicas
+        self.__seed      = seed
+        self.__friends   = friends
+        self.__result    = None 
+
+    ## local initialization (executed once in parent process)
+    def initialize_local ( self ) :
+        self.__result = None
+
+    # =========================================================================
+    ## the actual processing of (tree_path, files) unit
+    def process ( self , jobid , item ) :
+        """ The actual processing of (tree_path, files) unit
+        """
+        tree_path , files = item
+        boot = Bootstrap ( self.__histo , self.__replicas , seed = self.__seed )
+        for fname in files :
+            chain = calibration_chain ( tree_path , [ fname ] , self.__friends )
+            values , accept , weights = read_columns ( chain , self.__variables , self.__criterion , self.__cuts , self.__weight )
+            boot.fill ( values , accept , weights , key = ( tree_path , fname ) )
+        return boot
+
+    ## merge results: add the partial into the running object 
+    def merge_results ( self , result , jobid = -1 ) :
+        if   not result           : return 
+        elif self.__result is None : self.__result  = result
+        else                       : self.__result += result
+
+    ## get the results: the merged `Bootstrap` object (or `None`)
+    def results ( self ) : return self.__result
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  chains.py
+#  Configurable I/O layer for the calibration chains
+#
+#  - the tree cache is restricted to the branches actually used by
+#    the criterion, cuts, axes and sWeight
+#  - the cache size is configurable
+#  - the next file is opened asynchronously (<code>TFile::AsyncOpen</code>),
+#    while the current file is processed
+#  - the bytes read and the achieved MB/s are reported
+#
+#  @code
+#  io = ChainIO ( cache_size = 200 * MB , prefetch = True )
+#  for tree in io.trees ( tree_path , files , criterion , cuts , 'probe_P' , 'probe_ETA' , sweight ) :
+#      ... process the tree
+#  logger.info ( io.summary () )
+#  @endcode
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Configurable I/O layer for the calibration chains
+
+- the tree cache is restricted to the branches actually used by
+  the criterion, cuts, axes and sWeight
+- the cache size is configurable
+- the next file is opened asynchronously (`TFile::AsyncOpen`),
+  while the current file is processed
+- the bytes read and the achieved MB/s are reported
+
+>>> io = ChainIO ( cache_size = 200 * MB , prefetch = True )
+>>> for tree in io.trees ( tree_path , files , criterion , cuts , 'probe_P' , 'probe_ETA' , sweight ) :
+...     ## process the tree
+>>> logger.info ( io.summary () )
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'ChainIO' , ## configurable I/O layer for the calibration chains
+)
+# =============================================================================
+from   pidcalib.utils     import MB, used_branches
+import os, time
+import ROOT
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.chains')
+# =============================================================================
+## the default size of the tree cache: `$PIDCALIB_CACHE_SIZE` megabytes (100MB)
+def _default_cache_size ( default = 100 ) :
+    value = os.environ.get ( 'PIDCALIB_CACHE_SIZE' , '' )
+    try :
+        return int ( float ( value ) * MB ) if value else default * MB
+    except ValueError :
+        logger.warning ( "Invalid $PIDCALIB_CACHE_SIZE=`%s`, use %dMB" % ( value , default ) )
+        return default * MB
+DEFAULT_CACHE_SIZE = _default_cache_size ()
+# =============================================================================
+## @class ChainIO
+#  Configurable I/O layer for the calibration chains
+#  @code
+#  io = ChainIO ( cache_size = 200 * MB , prefetch = True )
+#  for tree in io.trees ( tree_path , files , criterion , cuts , 'probe_P' , 'probe_ETA' , sweight ) :
+#      ... process the tree
+#  logger.info ( io.summary () )
+#  @endcode
+class ChainIO(object) :
+    """ Configurable I/O layer for the calibration chains
+    >>> io = ChainIO ( cache_size = 200 * MB , prefetch = True )
+    >>> for tree in io.trees ( tree_path , files , criterion , cuts , 'probe_P' , 'probe_ETA' , sweight ) :
+    ...     ## process the tree
+    >>> logger.info ( io.summary () )
+    """
+    def __init__ ( self , cache_size = DEFAULT_CACHE_SIZE , prefetch = True ) :
+
+        assert isinstance ( cache_size , int ) and 0 <= cache_size , \
+            "ChainIO: invalid `cache_size` %s" % cache_size
+        self.__cache_size = cache_size
+        self.__prefetch   = True if prefetch else False
+        self.__nbytes     = 0
+        self.__seconds    = 0.0
+        self.__nfiles     = 0
+
+    @property
+    def cache_size ( self ) :
+        """`cache_size` : the size of the tree cache (0: no cache)"""
+        return self.__cache_size
+
+    @property
+    def prefetch ( self ) :
+        """`prefetch` : open the next file asynchronously?"""
+        return self.__prefetch
+
+    @property
+    def nbytes ( self ) :
+        """`nbytes` : total number of bytes read"""
+        return self.__nbytes
+
+    @property
+    def seconds ( self ) :
+        """`seconds` : total wall time of processing"""
+        return self.__seconds
+
+    @property
+    def rate ( self ) :
+        """`rate` : achieved throughput in MB/s"""
+        return float ( self.__nbytes ) / MB / self.__seconds if 0 < self.__seconds else 0.0
+
+    # =========================================================================
+    ## Configure the cache for the tree, restricted to the used branches
+    #  @return list of cached branches
+    def configure ( self , tree , *expressions ) :
+        """ Configure the cache for the tree, restricted to the used branches
+        - return list of cached branches
+        """
+        names    = set ( b.GetName () for b in tree.GetListOfBranches () ) | \
+                   set ( l.GetName () for l in tree.GetListOfLeaves   () )
+        branches = [ b for b in used_branches ( names , *expressions ) if tree.GetBranch ( b ) ]
+        if self.__cache_size :
+            tree.SetCacheSize ( self.__cache_size )
+            for b in branches : tree.AddBranchToCache ( b , True )
+            tree.StopCacheLearningPhase ()
+        return branches
+
+    # =========================================================================
+    ## Open the file (or the handle from <code>TFile::AsyncOpen</code>), configure the tree
+    #  @return (file, tree) pair, (None, None) for invalid file
+    def open ( self , fname , tree_path , *expressions , handle = None ) :
+        """ Open the file (or the handle from `TFile::AsyncOpen`), configure the tree
+        - return (file, tree) pair, (None, None) for invalid file
+        """
+        rfile = ROOT.TFile.Open ( handle ) if handle else ROOT.TFile.Open ( fname , 'READ' )
+        if not rfile or rfile.IsZombie () :
+            logger.warning ( "Cannot open file %s" % fname )
+            return None , None
+        tree = rfile.Get ( tree_path )
+        if not tree :
+            logger.warning ( "No tree %s in file %s" % ( tree_path , fname ) )
+            rfile.Close ()
+            return None , None
+        self.configure ( tree , *expressions )
+        return rfile , tree
+
+    # =========================================================================
+    ## Iterate over the configured trees, file-by-file
+    #  - the next file is opened asynchronously (<code>TFile::AsyncOpen</code>):
+    #    for remote files the open is handled by the I/O plugin without the python thread
+    #  - the bytes read and the wall time are accumulated
+    def trees ( self , tree_path , files , *expressions ) :
+        """ Iterate over the configured trees, file-by-file
+        - the next file is opened asynchronously (`TFile::AsyncOpen`):
+          for remote files the open is handled by the I/O plugin without the python thread
+        - the bytes read and the wall time are accumulated
+        """
+        files = tuple ( files )
+        if not files : return
+
+        start  = time.time ()
+        handle = ROOT.TFile.AsyncOpen ( files [ 0 ] ) if self.__prefetch else None 
+        try :
+            for i , fname in enumerate ( files ) :
+                rfile , tree = self.open ( fname , tree_path , *expressions , handle = handle )
+                handle       = None 
+                if self.__prefetch and i + 1 < len ( files ) :
+                    handle = ROOT.TFile.AsyncOpen ( files [ i + 1 ] )
+                    
+                if not rfile : continue
+                try :
+                    yield tree
+                finally :
+                    self.__nbytes += rfile.GetBytesRead ()
+                    self.__nfiles += 1
+                    rfile.Close ()
+        finally :
+            ## the iteration is interrupted: close the prefetched file
+            if handle :
+                rfile = ROOT.TFile.Open ( handle )
+                if rfile : rfile.Close ()
+            self.__seconds += time.time () - start
+
+    # =========================================================================
+    ## The summary line: bytes read, time and throughput
+    def summary ( self ) :
+        """ The summary line: bytes read, time and throughput
+        """
+        return '%d files, %.1f MB read in %.1f s, %.2f MB/s' % ( self.__nfiles  ,
+                                                                float ( self.__nbytes ) / MB ,
+                                                                self.__seconds ,
+                                                                self.rate      )
+
+    ## Reset the counters
+    def reset ( self ) :
+        """ Reset the counters
+        """
+        self.__nbytes  = 0
+        self.__seconds = 0.0
+        self.__nfiles  = 0
+
+    def __repr__ ( self ) : return 'ChainIO(cache_size=%.0fMB,prefetch=%s)' % ( float ( self.__cache_size ) / MB , self.__prefetch )
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  checkpoint.py
+#  Checkpoint/resume of the partial (per tree path & per file) histograms
+#
+#  The partial accepted/rejected histograms of the completed
+#  (tree_path, file) units are periodically written into the local file.
+#  If the processing is interrupted (batch wall-time limit, node loss, ...),
+#  the next run with the same checkpoint file skips the completed
+#  units and merges the stored partials
+#
+#  - the checkpoint is valid only for the same request identity
+#  - the file is written atomically (temporary file & rename)
+#
+#  @code
+#  with Checkpoint ( 'pions.ckpt' , identity , every = 60 ) as ckpt :
+#      for unit in units :
+#          value = ckpt.get ( unit )
+#          if value is None : ckpt.put ( unit , process ( unit ) )
+#  @endcode
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Checkpoint/resume of the partial (per tree path & per file) histograms
+
+The partial accepted/rejected histograms of the completed
+(tree_path, file) units are periodically written into the local file.
+If the processing is interrupted (batch wall-time limit, node loss, ...),
+the next run with the same checkpoint file skips the completed
+units and merges the stored partials
+
+- the checkpoint is valid only for the same request identity
+- the file is written atomically (temporary file & rename)
+
+>>> with Checkpoint ( 'pions.ckpt' , identity , every = 60 ) as ckpt :
+...     for unit in units :
+...         value = ckpt.get ( unit )
+...         if value is None : ckpt.put ( unit , process ( unit ) )
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'Checkpoint' , ## checkpoint/resume of the partial histograms
+)
+# =============================================================================
+import os, time, pickle
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.checkpoint')
+# =============================================================================
+## @class Checkpoint
+#  Checkpoint/resume of the partial histograms
+#  @code
+#  with Checkpoint ( 'pions.ckpt' , identity , every = 60 ) as ckpt :
+#      for unit in units :
+#          value = ckpt.get ( unit )
+#          if value is None : ckpt.put ( unit , process ( unit ) )
+#  @endcode
+class Checkpoint(object) :
+    """ Checkpoint/resume of the partial histograms
+    >>> with Checkpoint ( 'pions.ckpt' , identity , every = 60 ) as ckpt :
+    ...     for unit in units :
+    ...         value = ckpt.get ( unit )
+    ...         if value is None : ckpt.put ( unit , process ( unit ) )
+    """
+    FORMAT = 1
+
+    def __init__ ( self , fname , identity = () , every = 60 ) :
+
+        assert fname , "Checkpoint: invalid file name!"
+        assert 0 <= every , "Checkpoint: invalid `every` %s" % every
+        self.__fname    = fname
+        self.__identity = identity
+        self.__every    = every
+        self.__units    = {}
+        self.__dirty    = False
+        self.__saved    = time.time ()
+        self.__resumed  = 0
+        self.load ()
+
+    @property
+    def fname ( self ) :
+        """`fname` : the checkpoint file"""
+        return self.__fname
+
+    @property
+    def every ( self ) :
+        """`every` : minimal interval (in seconds) between writes, 0: write after each unit"""
+        return self.__every
+
+    @property
+    def resumed ( self ) :
+        """`resumed` : number of units taken from the existing checkpoint"""
+        return self.__resumed
+
+    # =========================================================================
+    ## Load the checkpoint file (if it exists and matches the identity)
+    def load ( self ) :
+        """ Load the checkpoint file (if it exists and matches the identity)
+        """
+        self.__units = {}
+        if not os.path.exists ( self.__fname ) : return
+        try :
+            with open ( self.__fname , 'rb' ) as f : data = pickle.load ( f )
+        except Exception as e :
+            logger.warning ( "Cannot read checkpoint %s: %s" % ( self.__fname , e ) )
+            return
+        if data.get ( 'format' ) != self.FORMAT or data.get ( 'identity' ) != self.__identity :
+            logger.warning ( "Checkpoint %s is for a different request, ignore it" % self.__fname )
+            return
+        self.__units   = data [ 'units' ]
+        self.__resumed = len ( self.__units )
+        logger.info ( "Checkpoint %s: %d completed units" % ( self.__fname , self.__resumed ) )
+
+    # =========================================================================
+    ## Save the checkpoint file (atomically)
+    def save ( self ) :
+        """ Save the checkpoint file (atomically)
+        """
+        if not self.__dirty : return
+        tmp = '%s.%d.tmp' % ( self.__fname , os.getpid () )
+        with open ( tmp , 'wb' ) as f :
+            pickle.dump ( { 'format'   : self.FORMAT     ,
+                            'identity' : self.__identity ,
+                            'units'    : self.__units    } , f , protocol = pickle.HIGHEST_PROTOCOL )
+        os.replace ( tmp , self.__fname )
+        self.__dirty = False
+        self.__saved = time.time ()
+
+    # =========================================================================
+    ## context manager: nothing to do
+    def __enter__ ( self ) : return self
+
+    ## context manager: save the checkpoint (also for exceptions/interrupts)
+    def __exit__ ( self , *_ ) : self.save ()
+
+    # =========================================================================
+    ## Is the unit completed?
+    def __contains__ ( self , unit ) : return unit in self.__units
+
+    ## number of completed units
+    def __len__      ( self ) : return len ( self.__units )
+
+    ## Get the partial result for the completed unit, `None` otherwise
+    def get ( self , unit ) :
+        """ Get the partial result for the completed unit, `None` otherwise
+        """
+        return self.__units.get ( unit , None )
+
+    ## Put the partial result for the completed unit, write the file periodically
+    def put ( self , unit , value ) :
+        """ Put the partial result for the completed unit, write the file periodically
+        """
+        self.__units [ unit ] = value
+        self.__dirty          = True
+        if self.__every <= time.time () - self.__saved : self.save ()
+
+    ## Remove the checkpoint file
+    def clear ( self ) :
+        """ Remove the checkpoint file
+        """
+        self.__units = {}
+        self.__dirty = False
+        if os.path.exists ( self.__fname ) : os.remove ( self.__fname )
+
+    def __repr__ ( self ) : return 'Checkpoint(%s,%d units)' % ( self.__fname , len ( self.__units ) )
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
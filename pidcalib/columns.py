@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  columns.py
+#  Local columnar cache of the calibration branches
+#
+#  The branches, needed for the PIDCalib requests (criteria, cuts, axes and sWeight),
+#  are extracted once per (sample, magnet, particle, tree_path) into
+#  the local `.npy` files. The subsequent requests, including other criteria and
+#  other binning schemes, read the memory-mapped arrays instead of ROOT I/O.
+#  The missing branches are extracted on demand
+#
+#  - the columns are extracted with implicit multithreading disabled:
+#    the row order of the columns, extracted in different calls, is the same
+#  - the key should contain the signatures of the files (as for `PartialStore`):
+#    the changed files give the new entry 
+#  - the total size of the cache is limited, the least recently used
+#    entries are evicted
+#  - the default location is `columns` subdirectory of the local cache directory,
+#    the default size limit is `$PIDCALIB_COLUMNS_SIZE` megabytes (10GB)
+#
+#  @code
+#  cache  = ColumnCache ( max_size = 20000 * MB )
+#  frame , arrays = cache.frame ( key , chain , 'probe_P' , 'probe_ETA' , 'probe_ProbNNpi>0.5' )
+#  @endcode
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Local columnar cache of the calibration branches
+
+The branches, needed for the PIDCalib requests (criteria, cuts, axes and sWeight),
+are extracted once per (sample, magnet, particle, tree_path) into
+the local `.npy` files. The subsequent requests, including other criteria and
+other binning schemes, read the memory-mapped arrays instead of ROOT I/O.
+The missing branches are extracted on demand
+
+- the columns are extracted with implicit multithreading disabled:
+  the row order of the columns, extracted in different calls, is the same
+- the key should contain the signatures of the files (as for `PartialStore`):
+  the changed files give the new entry 
+- the total size of the cache is limited, the least recently used
+  entries are evicted
+- the default location is `columns` subdirectory of the local cache directory,
+  the default size limit is `$PIDCALIB_COLUMNS_SIZE` megabytes (10GB)
+
+>>> cache  = ColumnCache ( max_size = 20000 * MB )
+>>> frame , arrays = cache.frame ( key , chain , 'probe_P' , 'probe_ETA' , 'probe_ProbNNpi>0.5' )
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'ColumnCache' , ## local columnar cache of the calibration branches
+)
+# =============================================================================
+from   pidcalib.utils import MB, cache_dir, used_branches
+import os, json, time, shutil, hashlib, tempfile, numpy
+import ROOT
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.columns')
+# =============================================================================
+## the default size limit for the cache
+DEFAULT_SIZE = int ( os.environ.get ( 'PIDCALIB_COLUMNS_SIZE' , 10000 ) ) * MB
+# =============================================================================
+## @class ColumnCache
+#  Local columnar cache of the calibration branches
+#  @code
+#  cache  = ColumnCache ( max_size = 20000 * MB )
+#  frame , arrays = cache.frame ( key , chain , 'probe_P' , 'probe_ETA' , 'probe_ProbNNpi>0.5' )
+#  @endcode
+class ColumnCache(object) :
+    """ Local columnar cache of the calibration branches
+    >>> cache  = ColumnCache ( max_size = 20000 * MB )
+    >>> frame , arrays = cache.frame ( key , chain , 'probe_P' , 'probe_ETA' , 'probe_ProbNNpi>0.5' )
+    """
+    META   = 'meta.json'
+    FORMAT = 2 
+
+    def __init__ ( self , directory = None , max_size = DEFAULT_SIZE ) :
+
+        assert 0 < max_size , "ColumnCache: invalid `max_size` %s" % max_size
+        self.__directory = directory if directory else cache_dir ( 'columns' )
+        self.__max_size  = max_size
+        os.makedirs ( self.__directory , exist_ok = True )
+
+    @property
+    def directory ( self ) :
+        """`directory` : the top directory of the cache"""
+        return self.__directory
+
+    @property
+    def max_size ( self ) :
+        """`max_size` : the size limit for the cache (in bytes)"""
+        return self.__max_size
+
+    # =========================================================================
+    ## the directory for the given key
+    def path ( self , key ) :
+        """ The directory for the given key, e.g. (sample, magnet, particle, tree_path, files)
+        """
+        tag = hashlib.sha1 ( repr ( ( self.FORMAT , key ) ).encode () ).hexdigest ()
+        return os.path.join ( self.__directory , tag )
+
+    # =========================================================================
+    ## read metadata for the entry
+    def __meta ( self , path ) :
+        try :
+            with open ( os.path.join ( path , self.META ) , 'r' ) as f : return json.load ( f )
+        except ( OSError , ValueError ) :
+            return {}
+
+    ## write metadata for the entry
+    def __write_meta ( self , path , meta ) :
+        fd , tmp = tempfile.mkstemp ( suffix = '.json' , dir = path )
+        with os.fdopen ( fd , 'w' ) as f : json.dump ( meta , f )
+        os.replace ( tmp , os.path.join ( path , self.META ) )
+
+    # =========================================================================
+    ## Get the (memory-mapped) columns for the given key
+    #  - missing columns are extracted from the chain
+    #  - implicit multithreading is disabled for extraction: the row order of
+    #    `AsNumpy` is deterministic only for the single-threaded event loop 
+    #  @param key   the key, e.g. (sample, magnet, particle, tree_path, files & signatures)
+    #  @param chain the calibration chain
+    #  @param expressions the expressions that define the needed branches
+    #  @return dictionary { branch : array }
+    def columns ( self , key , chain , *expressions ) :
+        """ Get the (memory-mapped) columns for the given key
+        - missing columns are extracted from the chain
+        - implicit multithreading is disabled for extraction: the row order of
+          `AsNumpy` is deterministic only for the single-threaded event loop 
+        - return dictionary { branch : array }
+        """
+        path = self.path ( key )
+        os.makedirs ( path , exist_ok = True )
+        meta = self.__meta ( path )
+        if not meta :
+            meta = { 'key'      : repr ( key )                   ,
+                     'names'    : list ( chain.branches () )     ,
+                     'branches' : []                             ,
+                     'created'  : time.time ()                   }
+
+        branches = used_branches ( meta [ 'names' ] , *expressions )
+        missing  = [ b for b in branches if not b in meta [ 'branches' ] ]
+
+        if missing :
+
+            logger.info ( 'Extract %d columns into cache: %s' % ( len ( missing ) , ', '.join ( missing ) ) )
+            nthreads = ROOT.ROOT.GetThreadPoolSize () if ROOT.ROOT.IsImplicitMTEnabled () else 0
+            if nthreads : ROOT.ROOT.DisableImplicitMT ()
+            try : 
+                frame = ROOT.RDataFrame ( chain )
+                data  = frame.AsNumpy ( missing )
+            finally : 
+                if nthreads : ROOT.ROOT.EnableImplicitMT ( nthreads )
+            for b in missing :
+                fd , tmp = tempfile.mkstemp ( suffix = '.npy' , dir = path )
+                os.close ( fd )
+                numpy.save ( tmp , numpy.ascontiguousarray ( data [ b ] ) )
+                os.replace ( tmp , os.path.join ( path , '%s.npy' % b ) )
+            meta [ 'branches' ] = sorted ( set ( meta [ 'branches' ] ) | set ( missing ) )
+
+        meta [ 'used' ] = time.time ()
+        self.__write_meta ( path , meta )
+
+        if missing : self.evict ( keep = path )
+
+        return { b : numpy.load ( os.path.join ( path , '%s.npy' % b ) , mmap_mode = 'r' ) for b in branches }
+
+    # =========================================================================
+    ## Get the data frame, built from the (memory-mapped) columns for the given key
+    #  - the arrays must be kept alive while the frame is used
+    #  @return the data frame and the dictionary of arrays
+    def frame ( self , key , chain , *expressions ) :
+        """ Get the data frame, built from the (memory-mapped) columns for the given key
+        - the arrays must be kept alive while the frame is used
+        - return the data frame and the dictionary of arrays
+        """
+        arrays = self.columns ( key , chain , *expressions )
+        make   = getattr ( ROOT.RDF , 'FromNumpy' , None ) or ROOT.RDF.MakeNumpyDataFrame
+        return make ( arrays ) , arrays
+
+    # =========================================================================
+    ## The entries in the cache: list of (path, size, last-used) triplets
+    def entries ( self ) :
+        """ The entries in the cache: list of (path, size, last-used) triplets
+        """
+        result = []
+        for tag in os.listdir ( self.__directory ) :
+            path = os.path.join ( self.__directory , tag )
+            if not os.path.isdir ( path ) : continue
+            size = sum ( os.path.getsize ( os.path.join ( path , f ) ) for f in os.listdir ( path ) )
+            used = self.__meta ( path ).get ( 'used' , 0 )
+            result.append ( ( path , size , used ) )
+        return result
+
+    ## The total size of the cache (in bytes)
+    def size ( self ) :
+        """ The total size of the cache (in bytes)
+        """
+        return sum ( e [ 1 ] for e in self.entries () )
+
+    # =========================================================================
+    ## Evict the least recently used entries to fit the size limit
+    #  @param keep the entry to keep
+    #  @return number of evicted entries
+    def evict ( self , keep = None ) :
+        """ Evict the least recently used entries to fit the size limit
+        - return number of evicted entries
+        """
+        entries = sorted ( self.entries () , key = lambda e : e [ 2 ] )
+        total   = sum ( e [ 1 ] for e in entries )
+        evicted = 0
+        for path , size , used in entries :
+            if total <= self.__max_size : break
+            if path == keep : continue
+            logger.info ( 'Evict cache entry %s (%.1f MB)' % ( path , float ( size ) / MB ) )
+            shutil.rmtree ( path , ignore_errors = True )
+            total   -= size
+            evicted += 1
+        if self.__max_size < total :
+            logger.warning ( 'Column cache size %.1f MB exceeds the limit %.1f MB' % ( float ( total ) / MB , float ( self.__max_size ) / MB ) )
+        return evicted
+
+    ## Remove all entries
+    def clear ( self ) :
+        """ Remove all entries
+        """
+        for path , _ , _ in self.entries () : shutil.rmtree ( path , ignore_errors = True )
+
+    def __repr__ ( self ) : return 'ColumnCache(%s,%.1fMB)' % ( self.__directory , float ( self.__max_size ) / MB )
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
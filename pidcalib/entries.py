@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  entries.py
+#  Persistent per-file entry lists for the calibration selection
+#
+#  The selection (dataset cuts & user cuts) is evaluated once per
+#  (file, tree_path, cuts) and the surviving entries are stored as `TEntryList`
+#  in the local cache, keyed by the hash of the cuts and validated with
+#  the file signature. The subsequent passes read only the surviving entries
+#
+#  @code
+#  cache = EntryListCache ()
+#  elist = cache.chain_list ( tree_path , files , cuts )
+#  chain.SetEntryList ( elist )
+#  @endcode
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Persistent per-file entry lists for the calibration selection
+
+The selection (dataset cuts & user cuts) is evaluated once per
+(file, tree_path, cuts) and the surviving entries are stored as `TEntryList`
+in the local cache, keyed by the hash of the cuts and validated with
+the file signature. The subsequent passes read only the surviving entries
+
+>>> cache = EntryListCache ()
+>>> elist = cache.chain_list ( tree_path , files , cuts )
+>>> chain.SetEntryList ( elist )
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'EntryListCache' , ## persistent per-file entry lists for the calibration selection
+)
+# =============================================================================
+from   pidcalib.utils    import cache_dir
+from   pidcalib.partials import signature
+import os, hashlib
+import ROOT
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.entries')
+# =============================================================================
+## @class EntryListCache
+#  Persistent per-file entry lists for the calibration selection
+#  @code
+#  cache = EntryListCache ()
+#  elist = cache.chain_list ( tree_path , files , cuts )
+#  chain.SetEntryList ( elist )
+#  @endcode
+class EntryListCache(object) :
+    """ Persistent per-file entry lists for the calibration selection
+    >>> cache = EntryListCache ()
+    >>> elist = cache.chain_list ( tree_path , files , cuts )
+    >>> chain.SetEntryList ( elist )
+    """
+    def __init__ ( self , directory = None ) :
+        self.__directory = directory if directory else cache_dir ( 'entries' )
+        os.makedirs ( self.__directory , exist_ok = True )
+
+    @property
+    def directory ( self ) :
+        """`directory` : the directory of the cache"""
+        return self.__directory
+
+    # =========================================================================
+    ## the hash of the cuts
+    @staticmethod
+    def cuts_hash ( cuts ) :
+        """ The hash of the cuts
+        """
+        return hashlib.sha1 ( str ( cuts ).strip ().encode () ).hexdigest ()
+
+    ## the cache file for (file, tree_path, cuts)
+    def path ( self , fname , tree_path , cuts ) :
+        """ The cache file for (file, tree_path, cuts)
+        """
+        key = hashlib.sha1 ( repr ( ( fname , tree_path , self.cuts_hash ( cuts ) ) ).encode () ).hexdigest ()
+        return os.path.join ( self.__directory , '%s.root' % key )
+
+    # =========================================================================
+    ## load the entry list from the cache, `None` if not found or the signature differs
+    def __load ( self , path , sig ) :
+        if not os.path.exists ( path ) : return None
+        rfile = ROOT.TFile.Open ( path , 'READ' )
+        if not rfile or rfile.IsZombie () : return None
+        try :
+            tag   = rfile.Get ( 'signature' )
+            elist = rfile.Get ( 'elist'     )
+            if not tag or not elist or tag.GetTitle () != repr ( sig ) : return None
+            elist = elist.Clone ()
+            elist.SetDirectory ( ROOT.nullptr )
+            return elist
+        finally :
+            rfile.Close ()
+
+    ## save the entry list into the cache
+    def __save ( self , path , sig , elist ) :
+        tmp   = '%s.%d.tmp' % ( path , os.getpid () )
+        rfile = ROOT.TFile.Open ( tmp , 'RECREATE' )
+        rfile.WriteTObject ( elist , 'elist' )
+        rfile.WriteTObject ( ROOT.TNamed ( 'signature' , repr ( sig ) ) , 'signature' )
+        rfile.Close ()
+        os.replace ( tmp , path )
+
+    # =========================================================================
+    ## Get the entry list for (file, tree_path, cuts)
+    #  - the selection is evaluated only if the list is not in the cache
+    #    or the file has been changed
+    #  @return TEntryList
+    def entry_list ( self , fname , tree_path , cuts ) :
+        """ Get the entry list for (file, tree_path, cuts)
+        - the selection is evaluated only if the list is not in the cache
+          or the file has been changed
+        - return TEntryList
+        """
+        sig   = signature ( fname )
+        path  = self.path ( fname , tree_path , cuts )
+        elist = self.__load ( path , sig )
+        if elist : return elist
+
+        tree  = ROOT.TChain ( tree_path )
+        tree.Add ( fname )
+        name  = 'pidcalib_elist_%s' % self.cuts_hash ( cuts ) [ : 12 ]
+        groot = ROOT.ROOT.GetROOT ()
+        groot.cd ()
+        tree.Draw ( '>>%s' % name , str ( cuts ) , 'entrylist' )
+        elist = groot.FindObject ( name )
+        assert elist , "Cannot create the entry list for %s:%s" % ( fname , tree_path )
+        elist.SetDirectory ( ROOT.nullptr )
+        if sig is not None : self.__save ( path , sig , elist )
+        return elist
+
+    # =========================================================================
+    ## Get the combined entry list for all files of the chain
+    #  @return TEntryList to be used with <code>TChain.SetEntryList</code>
+    def chain_list ( self , tree_path , files , cuts ) :
+        """ Get the combined entry list for all files of the chain
+        - return TEntryList to be used with `TChain.SetEntryList`
+        """
+        total = ROOT.TEntryList ()
+        total.SetDirectory ( ROOT.nullptr )
+        for fname in files : total.Add ( self.entry_list ( fname , tree_path , cuts ) )
+        return total
+
+    ## Remove all entries
+    def clear ( self ) :
+        """ Remove all entries
+        """
+        for f in os.listdir ( self.__directory ) :
+            if f.endswith ( '.root' ) : os.remove ( os.path.join ( self.__directory , f ) )
+
+    def __repr__ ( self ) : return 'EntryListCache(%s)' % self.__directory
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,497 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  fill.py
+#  Single-pass filling of many accepted/rejected histogram pairs
+#  for PIDCalib requests
+#
+#  Each elementary fill is described by the template histogram,
+#  the axis expressions, the PID criterion and the cuts.
+#  All fills are booked as lazy actions for one `ROOT.RDataFrame`
+#  and filled in a single event loop
+#
+#  @code
+#  fills   = [ Fill ( h1 , ( 'log10(probe_P/1000)' , ) , 'probe_ProbNNpi>0.2' , cuts ) ,
+#              Fill ( h1 , ( 'log10(probe_P/1000)' , ) , 'probe_ProbNNpi>0.5' , cuts ) ]
+#  results = fill_chain ( chain , fills , weight = 'probe_sWeight' )
+#  for accepted , rejected in results : ...
+#  @endcode
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Single-pass filling of many accepted/rejected histogram pairs
+for PIDCalib requests
+
+Each elementary fill is described by the template histogram,
+the axis expressions, the PID criterion and the cuts.
+All fills are booked as lazy actions for one `ROOT.RDataFrame`
+and filled in a single event loop
+
+>>> fills   = [ Fill ( h1 , ( 'log10(probe_P/1000)' , ) , 'probe_ProbNNpi>0.2' , cuts ) ,
+...             Fill ( h1 , ( 'log10(probe_P/1000)' , ) , 'probe_ProbNNpi>0.5' , cuts ) ]
+>>> results = fill_chain ( chain , fills , weight = 'probe_sWeight' )
+>>> for accepted , rejected in results : ...
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'Fill'        , ## elementary fill: template, axes, criterion & cuts
+    'axis_edges'  , ## bin edges for the histogram axis
+    'book'        , ## book all fills for the data frame as lazy actions
+    'collect'     , ## get the histograms from the booked actions
+    'fill_chain'  , ## fill all accepted/rejected histograms in a single pass
+    'fill_frame'  , ## fill all accepted/rejected histograms for the data frame
+    'fill_graphs' , ## fill all accepted/rejected histograms for many data frames together
+    'read_columns', ## read the columns for the (numpy-based) filling 
+    'boolean'     , ## is the selection certainly boolean?
+    'selection_problem' , ## check that the selections are boolean 
+    'merge_pairs' , ## merge two lists of accepted/rejected pairs 
+    'tree_reduce' , ## pairwise (tree) reduction of the partial results 
+    'FillTask'    , ## task for the parallel filling of accepted/rejected histograms
+    'MultiFillTask' , ## task for the parallel filling for several components in one pool
+    'efficiency'  , ## efficiency from accepted & rejected histograms
+)
+# =============================================================================
+from   collections         import namedtuple
+from   array               import array
+from   ostap.utils.basic   import typename
+from   ostap.parallel.task import Task
+from   pidcalib.sweights   import calibration_chain
+import ostap.histos.histos
+import ROOT, re 
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.fill')
+# =============================================================================
+## @class Fill
+#  Elementary fill: the template histogram, axis expressions,
+#  the PID criterion and the cuts
+Fill = namedtuple ( 'Fill' , ( 'histogram' ,   ## template histogram
+                               'variables' ,   ## axis expressions
+                               'criterion' ,   ## PID criterion
+                               'cuts'      ) ) ## cuts
+# =============================================================================
+## Bin edges for the histogram axis
+def axis_edges ( axis ) :
+    """ Bin edges for the histogram axis
+    """
+    n = axis.GetNbins ()
+    return array ( 'd' , [ axis.GetBinLowEdge ( i ) for i in range ( 1 , n + 2 ) ] )
+
+# =============================================================================
+## boolean constants 
+_BOOLEANS   = ( '0' , '1' , 'true' , 'false' , 'kTRUE' , 'kFALSE' )
+## identifier (branch name) 
+_name_re    = re.compile ( r'[A-Za-z_][A-Za-z0-9_\.]*$' )
+## comparison operators (not shifts, not `->`)
+_compare_re = re.compile ( r'==|!=|<=|>=|(?<![<\-])<(?!<)|(?<![>\-])>(?!>)' )
+## bitwise operators (`^` is the power for TFormula)
+_bitwise_re = re.compile ( r'(?<![&|])[&|](?![&|])' )
+## negated primary: `!x`, `!(...)`, `!f(...)` 
+_not_re     = re.compile ( r'!+\s*(?:[A-Za-z_][A-Za-z0-9_\.:]*\s*)?(?:\(\s*\))?$' )
+
+## the expression with the content of the parentheses blanked out
+def _top_level ( expression ) :
+    depth , chars = 0 , []
+    for c in expression :
+        if   ')' == c : depth -= 1
+        chars.append ( c if 0 == depth or c in '()' else ' ' ) 
+        if   '(' == c : depth += 1
+    return ''.join ( chars ) 
+
+## strip the enclosing parentheses
+def _strip ( expression ) :
+    expression = expression.strip ()
+    while expression.startswith ( '(' ) and expression.endswith ( ')' ) :
+        ## the first parenthesis must be closed by the last one 
+        depth = 0
+        for i , c in enumerate ( expression ) :
+            if   '(' == c : depth += 1
+            elif ')' == c : depth -= 1
+            if 0 == depth : break
+        if i != len ( expression ) - 1 : break
+        expression = expression [ 1 : -1 ].strip ()
+    return expression
+
+# =============================================================================
+## Is the selection certainly boolean?
+#  - the value of a non-boolean selection is used as a weight by <code>TTree::Project</code>
+#    (and <code>data_efficiency</code>), but as a pass/fail flag by <code>RDataFrame::Filter</code>
+#  - boolean: comparisons, <code>&&</code>/<code>||</code>, negations of a primary,
+#    0/1 constants and boolean columns
+#  @code
+#  boolean ( 'probe_P>1000 && probe_ETA<4.5' ) ## True 
+#  boolean ( 'probe_sWeight' )                 ## False 
+#  boolean ( 'probe_isMuon' , lambda n : 'Bool_t' ) ## True 
+#  @endcode
+#  @param expression the selection
+#  @param types      function to get the type of the column (or `None`) 
+def boolean ( expression , types = None ) :
+    """ Is the selection certainly boolean?
+    - the value of a non-boolean selection is used as a weight by `TTree::Project`
+      (and `data_efficiency`), but as a pass/fail flag by `RDataFrame::Filter`
+    - boolean: comparisons, `&&`/`||`, negations of a primary,
+      0/1 constants and boolean columns
+    >>> boolean ( 'probe_P>1000 && probe_ETA<4.5' ) ## True 
+    >>> boolean ( 'probe_sWeight' )                 ## False 
+    >>> boolean ( 'probe_isMuon' , lambda n : 'Bool_t' ) ## True 
+    """
+    expr = _strip ( str ( expression ) )
+    if expr in _BOOLEANS : return True
+    top  = _top_level ( expr )
+    if '?' in top or ',' in top              : return False
+    if '&&' in top or '||' in top            : return True
+    if _bitwise_re.search ( top )            : return False 
+    if _compare_re.search ( top )            : return True
+    if _not_re.match      ( top )            : return True
+    if types and _name_re.match ( expr ) :
+        return types ( expr ) in ( 'bool' , 'Bool_t' )
+    return False 
+
+## the type of the column of the data frame or of the tree (`None` for unknown column)
+def _column_type ( source , name ) :
+    try :
+        if hasattr ( source , 'GetColumnType' ) : return str ( source.GetColumnType ( name ) )
+        leaf = source.GetLeaf ( name )
+        return leaf.GetTypeName () if leaf else None
+    except Exception :
+        return None
+
+# =============================================================================
+## Check that the selections (criteria & cuts) are boolean
+#  - the fills use <code>RDataFrame::Filter</code>, while <code>data_efficiency</code>
+#    uses the value of a non-boolean selection as a weight: the results would differ
+#  @param source     the data frame or the tree (for the column types) 
+#  @param selections the selections
+#  @return `None` if all selections are boolean, otherwise the error message
+def selection_problem ( source , *selections ) :
+    """ Check that the selections (criteria & cuts) are boolean
+    - the fills use `RDataFrame::Filter`, while `data_efficiency`
+      uses the value of a non-boolean selection as a weight: the results would differ
+    - return `None` if all selections are boolean, otherwise the error message
+    """
+    types = lambda name : _column_type ( source , name )
+    for s in selections :
+        s = str ( s ).strip () if s else ''
+        if s and not boolean ( s , types ) : return "non-boolean selection `%s`" % s
+    return None
+
+# =============================================================================
+## Create RDataFrame model for the template histogram
+def _model ( histo ) :
+    """ Create RDataFrame model for the template histogram
+    """
+    dim = histo.GetDimension ()
+    xe  = axis_edges ( histo.GetXaxis () )
+    if 1 == dim : return ROOT.RDF.TH1DModel ( '' , '' , len ( xe ) - 1 , xe )
+    ye  = axis_edges ( histo.GetYaxis () )
+    if 2 == dim : return ROOT.RDF.TH2DModel ( '' , '' , len ( xe ) - 1 , xe , len ( ye ) - 1 , ye )
+    ze  = axis_edges ( histo.GetZaxis () )
+    return ROOT.RDF.TH3DModel ( '' , '' , len ( xe ) - 1 , xe , len ( ye ) - 1 , ye , len ( ze ) - 1 , ze )
+
+# =============================================================================
+## Book all fills for the data frame as lazy actions
+#  - each distinct expression/selection is defined only once
+#  - the criteria and cuts must be boolean, ValueError is raised otherwise
+#  @see selection_problem 
+#  @param frame  the data frame
+#  @param fills  list of elementary fills
+#  @param weight the weight expression
+#  @return list of (accepted,rejected) pairs of lazy results
+def book ( frame , fills , weight = '' ) :
+    """ Book all fills for the data frame as lazy actions
+    - each distinct expression/selection is defined only once
+    - the criteria and cuts must be boolean, ValueError is raised otherwise
+    - return list of (accepted,rejected) pairs of lazy results
+    """
+    for f in fills :
+        problem = selection_problem ( frame , f.criterion , f.cuts )
+        if problem : raise ValueError ( "book: %s, use `data_efficiency` (`PARTICLE.process`)" % problem ) 
+        
+    node    = frame
+    columns = {}
+
+    wname   = ''
+    if weight :
+        wname = '__pidcalib_weight'
+        node  = node.Define ( wname , '(double)(%s)' % weight )
+
+    ## define the axis variables
+    for f in fills :
+        assert isinstance ( f.histogram , ROOT.TH1 ) and f.histogram.GetDimension () == len ( f.variables ) , \
+            "Invalid histogram type %s for %d variables" % ( typename ( f.histogram ) , len ( f.variables ) )
+        for v in f.variables :
+            if not v in columns :
+                name = '__pidcalib_var%d' % len ( columns )
+                node = node.Define ( name , '(double)(%s)' % v )
+                columns [ v ] = name
+
+    ## selections
+    bases    = {}
+    selected = {}
+    def _select ( cuts , criterion , accept ) :
+        key = cuts , criterion , accept
+        if not key in selected :
+            if not cuts in bases : bases [ cuts ] = node.Filter ( cuts ) if cuts else node
+            selected [ key ] = bases [ cuts ].Filter ( ( '(%s)' if accept else '!(%s)' ) % criterion )
+        return selected [ key ]
+
+    results = []
+    for f in fills :
+
+        cuts  = str ( f.cuts ).strip() if f.cuts else ''
+        model = _model ( f.histogram )
+        cols  = [ columns [ v ] for v in f.variables ]
+        if wname : cols.append ( wname )
+
+        dim  = f.histogram.GetDimension ()
+        pair = []
+        for accept in ( True , False ) :
+            sel = _select ( cuts , f.criterion , accept )
+            if   1 == dim : pair.append ( sel.Histo1D ( model , *cols ) )
+            elif 2 == dim : pair.append ( sel.Histo2D ( model , *cols ) )
+            else          : pair.append ( sel.Histo3D ( model , *cols ) )
+
+        results.append ( tuple ( pair ) )
+
+    return results
+
+# =============================================================================
+## Get the histograms from the booked actions: the clones of the template histograms
+#  - it triggers the event loop, if not done yet
+def collect ( booked , fills ) :
+    """ Get the histograms from the booked actions: the clones of the template histograms
+    - it triggers the event loop, if not done yet
+    """
+    results = []
+    for ( a , r ) , f in zip ( booked , fills ) :
+        pair = []
+        for ptr in ( a , r ) :
+            h = f.histogram.clone ()
+            h.Reset ()
+            if not h.GetSumw2N () : h.Sumw2 ()
+            h.Add ( ptr.GetValue () )
+            pair.append ( h )
+        results.append ( tuple ( pair ) )
+    return results
+
+# =============================================================================
+## Fill all accepted/rejected histograms in a single pass over the chain
+#  @param chain  the input chain
+#  @param fills  list of elementary fills
+#  @param weight the weight expression
+#  @return list of (accepted,rejected) pairs
+def fill_chain ( chain , fills , weight = '' , progress = False ) :
+    """ Fill all accepted/rejected histograms in a single pass over the chain
+    - return list of (accepted,rejected) pairs
+    """
+    return fill_frame ( ROOT.RDataFrame ( chain ) , fills , weight = weight , progress = progress )
+
+# =============================================================================
+## Fill all accepted/rejected histograms in a single pass over the data frame
+#  @param frame  the input data frame 
+#  @param fills  list of elementary fills
+#  @param weight the weight expression
+#  @return list of (accepted,rejected) pairs
+def fill_frame ( frame , fills , weight = '' , progress = False ) :
+    """ Fill all accepted/rejected histograms in a single pass over the data frame
+    - return list of (accepted,rejected) pairs
+    """
+    if progress and hasattr ( ROOT.RDF , 'Experimental' ) and hasattr ( ROOT.RDF.Experimental , 'AddProgressBar' ) :
+        ROOT.RDF.Experimental.AddProgressBar ( frame )
+    booked = book ( frame , fills , weight )
+    return collect ( booked , fills )
+
+# =============================================================================
+## Fill all accepted/rejected histograms for many data frames
+#  - all actions are booked first and executed together with `ROOT.RDF.RunGraphs`,
+#    sharing the threads, the JIT compilation and the event-loop setup 
+#  @code
+#  jobs    = [ ( frame1 , fills1 , 'probe_sWeight' ) , ( frame2 , fills2 , 'probe_sWeight' ) ]
+#  results = fill_graphs ( jobs )
+#  @endcode 
+#  @param jobs list of (frame, fills, weight) triplets
+#  @return list of lists of (accepted,rejected) pairs, one list per job 
+def fill_graphs ( jobs ) :
+    """ Fill all accepted/rejected histograms for many data frames
+    - all actions are booked first and executed together with `ROOT.RDF.RunGraphs`,
+      sharing the threads, the JIT compilation and the event-loop setup 
+    >>> jobs    = [ ( frame1 , fills1 , 'probe_sWeight' ) , ( frame2 , fills2 , 'probe_sWeight' ) ]
+    >>> results = fill_graphs ( jobs )
+    """
+    jobs    = tuple ( jobs )
+    booked  = [ book ( frame , fills , weight ) for frame , fills , weight in jobs ]
+    handles = [ h for b in booked for pair in b for h in pair ]
+    if 1 < len ( jobs ) and hasattr ( ROOT.RDF , 'RunGraphs' ) :
+        ROOT.RDF.RunGraphs ( handles )
+    return [ collect ( b , fills ) for b , ( _ , fills , _ ) in zip ( booked , jobs ) ]
+
+# =============================================================================
+## Read the columns for the (numpy-based) filling 
+#  @param chain     the input chain
+#  @param variables axis expressions
+#  @param criterion PID criterion
+#  @param cuts      cuts
+#  @param weight    weight expression
+#  - the criterion and cuts must be boolean, ValueError is raised otherwise
+#  @return list of axis arrays, boolean array for the criterion and array of weights (or `None`)
+def read_columns ( chain , variables , criterion , cuts = '' , weight = '' ) :
+    """ Read the columns for the (numpy-based) filling 
+    - the criterion and cuts must be boolean, ValueError is raised otherwise
+    - return list of axis arrays, boolean array for the criterion and array of weights (or `None`)
+    """
+    frame   = ROOT.RDataFrame ( chain )
+    problem = selection_problem ( frame , criterion , cuts )
+    if problem : raise ValueError ( "read_columns: %s, use `data_efficiency` (`PARTICLE.process`)" % problem ) 
+    cuts  = str ( cuts ).strip () if cuts else ''
+    if cuts : frame = frame.Filter ( cuts )
+
+    columns = []
+    for i , v in enumerate ( variables ) :
+        name  = '__pidcalib_var%d' % i
+        frame = frame.Define ( name , '(double)(%s)' % v )
+        columns.append ( name )
+    frame = frame.Define ( '__pidcalib_accept' , '(bool)(%s)' % criterion )
+    columns.append ( '__pidcalib_accept' )
+    if weight :
+        frame = frame.Define ( '__pidcalib_weight' , '(double)(%s)' % weight )
+        columns.append ( '__pidcalib_weight' )
+
+    data    = frame.AsNumpy ( columns )
+    values  = [ data [ c ] for c in columns [ : len ( variables ) ] ]
+    accept  = data [ '__pidcalib_accept' ].astype ( bool )
+    weights = data [ '__pidcalib_weight' ] if weight else None
+    return values , accept , weights 
+
+# =============================================================================
+## Merge two lists of (accepted,rejected) pairs: the second list is added to the first one
+#  @return the first list 
+def merge_pairs ( first , second ) :
+    """ Merge two lists of (accepted,rejected) pairs: the second list is added to the first one
+    - return the first list 
+    """
+    for ( a1 , r1 ) , ( a2 , r2 ) in zip ( first , second ) :
+        a1.Add ( a2 )
+        r1.Add ( r2 )
+    return first
+
+# =============================================================================
+## Pairwise (tree) reduction of the partial results
+#  - the partials are merged level by level, in the calling thread:
+#    no global switches (thread safety, GIL release) are touched 
+#  @code
+#  partials = [ ... ] ## list of partial results 
+#  result   = tree_reduce ( partials , merge_pairs )
+#  @endcode
+#  @param items partial results
+#  @param merge merge function: merge ( first , second ) -> merged 
+def tree_reduce ( items , merge ) :
+    """ Pairwise (tree) reduction of the partial results
+    - the partials are merged level by level, in the calling thread:
+      no global switches (thread safety, GIL release) are touched 
+    >>> partials = [ ... ] ## list of partial results 
+    >>> result   = tree_reduce ( partials , merge_pairs )
+    """
+    items = list ( items )
+    if not items : return None
+    while 1 < len ( items ) :
+        odd   = [ items [ -1 ] ] if len ( items ) % 2 else []
+        items = [ merge ( items [ i ] , items [ i + 1 ] ) for i in range ( 0 , len ( items ) - 1 , 2 ) ] + odd
+    return items [ 0 ]
+
+# =============================================================================
+## @class FillTask
+#  Task for the parallel filling of accepted/rejected histograms
+#  - each item is (tree_path, files) unit
+#  - the partial results are merged at the end with `tree_reduce`
+class FillTask(Task) :
+    """ Task for the parallel filling of accepted/rejected histograms
+    - each item is (tree_path, files) unit
+    - the partial results are merged at the end with `tree_reduce`
+    """
+    def __init__ ( self , fills , weight = '' , friends = None ) :
+        
+        self.__fills    = tuple ( fills )
+        self.__weight   = weight
+        self.__friends  = friends 
+        self.__partials = []
+
+    ## local initialization (executed once in parent process)
+    def initialize_local ( self ) :
+        self.__partials = []
+
+    # =========================================================================
+    ## the actual processing of (tree_path, files) unit
+    def process ( self , jobid , item ) :
+        """ The actual processing of (tree_path, files) unit
+        """
+        tree_path , files = item
+        chain = calibration_chain ( tree_path , files , self.__friends )
+        return fill_chain ( chain , self.__fills , weight = self.__weight )
+
+    ## merge results: keep the partials 
+    def merge_results ( self , result , jobid = -1 ) :
+        if result : self.__partials.append ( result )
+
+    ## get the results: list of partials 
+    def results ( self ) : return self.__partials
+
+# =============================================================================
+## @class MultiFillTask
+#  Task for the parallel filling of accepted/rejected histograms for several
+#  components (e.g. samples & magnet polarities) in one pool
+#  - each component is defined by (fills, weight, sWeight friends) triplet
+#  - each item is (component index, tree_path, files) unit
+#  - the partial results are kept per component and merged at the end with `tree_reduce`
+class MultiFillTask(Task) :
+    """ Task for the parallel filling of accepted/rejected histograms for several
+    components (e.g. samples & magnet polarities) in one pool
+    - each component is defined by (fills, weight, sWeight friends) triplet
+    - each item is (component index, tree_path, files) unit
+    - the partial results are kept per component and merged at the end with `tree_reduce`
+    """
+    def __init__ ( self , components ) :
+        
+        self.__components = tuple ( ( tuple ( fills ) , weight , friends ) for fills , weight , friends in components )
+        self.__partials   = {}
+
+    ## local initialization (executed once in parent process)
+    def initialize_local ( self ) :
+        self.__partials = {}
+
+    # =========================================================================
+    ## the actual processing of (component index, tree_path, files) unit
+    def process ( self , jobid , item ) :
+        """ The actual processing of (component index, tree_path, files) unit
+        """
+        index , tree_path , files = item
+        fills , weight , friends = self.__components [ index ]
+        chain = calibration_chain ( tree_path , files , friends )
+        return index , fill_chain ( chain , fills , weight = weight )
+
+    ## merge results: keep the partials per component 
+    def merge_results ( self , result , jobid = -1 ) :
+        if result : self.__partials.setdefault ( result [ 0 ] , [] ).append ( result [ 1 ] )
+
+    ## get the results: { component index : list of partials } 
+    def results ( self ) : return self.__partials
+
+# =============================================================================
+## Efficiency from accepted & rejected histograms
+#  \f$ \epsilon = \frac{1}{1+\frac{r}{a}}\f$
+def efficiency ( accepted , rejected ) :
+    """ Efficiency from accepted & rejected histograms
+    """
+    return 1 / ( 1 + rejected / accepted )
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  metadata.py
+#  Memoized (and optionally persistent) cache of the calibration-sample metadata
+#  for PIDCalib requests
+#
+#  Resolution of the calibration sample (`pidcalib2.pid_data.get_calibration_sample`)
+#  and of the tree paths (`pidcalib2.pid_data.get_tree_paths`) parses the samples file
+#  and builds the file lists each time. Here the resolved metadata are cached
+#  - in memory, and shared between all requests for the same
+#    (sample, magnet, particle, samples_file)
+#  - on disk, in the `metadata` subdirectory of the local cache directory
+#  Both caches are invalidated when the samples file is modified
+#
+#  @code
+#  meta = calibration_sample ( 'Turbo18' , 'up' , 'Pi' )
+#  meta.files, meta.cuts, meta.sweight, meta.tree_paths, meta.sweight_dir
+#  @endcode
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Memoized (and optionally persistent) cache of the calibration-sample metadata
+for PIDCalib requests
+
+Resolution of the calibration sample (`pidcalib2.pid_data.get_calibration_sample`)
+and of the tree paths (`pidcalib2.pid_data.get_tree_paths`) parses the samples file
+and builds the file lists each time. Here the resolved metadata are cached
+- in memory, and shared between all requests for the same
+  (sample, magnet, particle, samples_file)
+- on disk, in the `metadata` subdirectory of the local cache directory
+Both caches are invalidated when the samples file is modified
+
+>>> meta = calibration_sample ( 'Turbo18' , 'up' , 'Pi' )
+>>> meta.files, meta.cuts, meta.sweight, meta.tree_paths, meta.sweight_dir
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'Metadata'           , ## resolved metadata of the calibration sample
+    'samples_file'       , ## the actual samples file
+    'calibration_sample' , ## get (cached) metadata of the calibration sample
+    'clear_cache'        , ## clear in-memory & persistent caches
+)
+# =============================================================================
+from   collections     import namedtuple
+from   pidcalib.utils  import cache_dir
+import os, json, hashlib, tempfile
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.metadata')
+# =============================================================================
+## @class Metadata
+#  Resolved metadata of the calibration sample
+#  - all the collections are tuples and can be safely shared between requests
+Metadata = namedtuple ( 'Metadata' , ( 'data'       ,   ## the raw calibration sample
+                                       'files'      ,   ## the calibration files
+                                       'cuts'       ,   ## dataset cuts
+                                       'sweight'    ,   ## sWeight branch
+                                       'tree_paths' ,   ## tree paths
+                                       'sweight_dir' ) ) ## directory with sWeight friend files (or empty)
+# =============================================================================
+## in-memory cache: { key : ( mtime , metadata ) }
+_memo = {}
+## version of the persistent format
+_FORMAT = 1
+# =============================================================================
+## Get the actual samples file
+#  - the default one is the `data/samples.json` resource of `pidcalib2` package,
+#    located via the package resources (works for any installation layout)
+#  @return the samples file or `None` if the default file cannot be located:
+#          `pidcalib2` then resolves it on its own and the metadata are not cached persistently 
+def samples_file ( fname = None ) :
+    """ Get the actual samples file
+    - the default one is the `data/samples.json` resource of `pidcalib2` package,
+      located via the package resources (works for any installation layout)
+    - return the samples file or `None` if the default file cannot be located:
+      `pidcalib2` then resolves it on its own and the metadata are not cached persistently 
+    """
+    if fname : return os.path.abspath ( fname )
+    try :
+        import importlib.resources
+        resource = importlib.resources.files ( 'pidcalib2' ).joinpath ( 'data' ).joinpath ( 'samples.json' )
+        if resource.is_file () : return os.path.abspath ( str ( resource ) )
+    except ( ImportError , AttributeError , TypeError , OSError ) :
+        pass
+    logger.warning ( "Cannot locate the default samples file of `pidcalib2`" )
+    return None 
+
+# =============================================================================
+## modification time of the file, -1 for non-existing file
+def _mtime ( fname ) :
+    try :
+        return os.path.getmtime ( fname )
+    except OSError :
+        return -1
+
+# =============================================================================
+## the persistent file for the given key
+def _cache_file ( key ) :
+    tag = hashlib.sha1 ( repr ( key ).encode () ).hexdigest ()
+    return os.path.join ( cache_dir ( 'metadata' ) , '%s.json' % tag )
+
+# =============================================================================
+## create metadata from the raw calibration sample
+def _metadata ( data , tree_paths ) :
+    return Metadata ( data                                             ,
+                      tuple ( data [ 'files' ] )                       ,
+                      tuple ( data.get ( 'cuts' , () ) )               ,
+                      data.get ( 'sweight_branch' , 'probe_sWeight' )  ,
+                      tuple ( tree_paths )                             ,
+                      data.get ( 'sweight_dir'    , ''              )  )
+
+# =============================================================================
+## load the metadata from the persistent cache
+def _load ( key , mtime ) :
+    try :
+        with open ( _cache_file ( key ) , 'r' ) as f : record = json.load ( f )
+    except ( OSError , ValueError ) :
+        return None
+    if record.get ( 'format' , 0 ) != _FORMAT or record.get ( 'mtime' , -1 ) != mtime : return None
+    if record.get ( 'key' , None ) != list ( key ) : return None
+    return _metadata ( record [ 'data' ] , record [ 'tree_paths' ] )
+
+# =============================================================================
+## save the metadata into persistent cache
+def _save ( key , mtime , meta ) :
+    record = { 'format'     : _FORMAT               ,
+               'key'        : list ( key )          ,
+               'mtime'      : mtime                 ,
+               'data'       : meta.data             ,
+               'tree_paths' : list ( meta.tree_paths ) }
+    fname   = _cache_file ( key )
+    try :
+        ## atomic write
+        fd , tmp = tempfile.mkstemp ( suffix = '.json' , dir = os.path.dirname ( fname ) )
+        with os.fdopen ( fd , 'w' ) as f : json.dump ( record , f )
+        os.replace ( tmp , fname )
+    except ( OSError , TypeError , ValueError ) as e :
+        logger.warning ( "Cannot save metadata for %s: %s" % ( str ( key ) , e ) )
+
+# =============================================================================
+## Get (cached) metadata of the calibration sample
+#  @code
+#  meta = calibration_sample ( 'Turbo18' , 'up' , 'Pi' )
+#  @endcode
+#  @param sample     data sample
+#  @param magnet     magnet polarity
+#  @param particle   particle type
+#  @param samples    the samples file, `None` for the default one
+#  @param persistent use persistent cache?
+#  @return the metadata of the calibration sample
+#  @see pidcalib2.pid_data.get_calibration_sample
+#  @see pidcalib2.pid_data.get_tree_paths
+def calibration_sample ( sample , magnet , particle , samples = None , persistent = True ) :
+    """ Get (cached) metadata of the calibration sample
+    >>> meta = calibration_sample ( 'Turbo18' , 'up' , 'Pi' )
+    - see `pidcalib2.pid_data.get_calibration_sample`
+    - see `pidcalib2.pid_data.get_tree_paths`
+    """
+    sfile = samples_file ( samples )
+    mtime = _mtime ( sfile ) if sfile else -1
+    key   = sample , magnet , particle , sfile
+
+    ## (1) in-memory cache
+    entry = _memo.get ( key , None )
+    if entry and entry [ 0 ] == mtime : return entry [ 1 ]
+
+    ## (2) persistent cache
+    meta = _load ( key , mtime ) if persistent and 0 <= mtime else None
+
+    ## (3) resolve it
+    if meta is None :
+
+        import pidcalib2.pid_data
+
+        ## the same file as in the cache key 
+        data = pidcalib2.pid_data.get_calibration_sample ( sample   ,
+                                                           magnet   ,
+                                                           particle ,
+                                                           sfile    ,
+                                                           None     )
+
+        assert data , "Invalid sample/magnet/particle combination %s/%s/%s" % ( sample , magnet , particle )
+
+        tuple_names = data [ 'tuple_names' ] [ particle ] \
+            if 'tuple_names' in data and particle in data [ 'tuple_names' ] else None
+        tree_paths  = pidcalib2.pid_data.get_tree_paths ( particle , sample , tuple_names )
+
+        meta = _metadata ( data , tree_paths )
+        if persistent and 0 <= mtime : _save ( key , mtime , meta )
+
+    _memo [ key ] = mtime , meta
+    return meta
+
+# =============================================================================
+## Clear in-memory and (optionally) persistent caches
+def clear_cache ( persistent = False ) :
+    """ Clear in-memory and (optionally) persistent caches
+    """
+    _memo.clear ()
+    if not persistent : return
+    the_dir = cache_dir ( 'metadata' )
+    for fname in os.listdir ( the_dir ) :
+        if fname.endswith ( '.json' ) : os.remove ( os.path.join ( the_dir , fname ) )
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  partials.py
+#  Persistent store of the partial (per-file) accepted/rejected histograms
+#
+#  Each partial result is stored together with the signature of the input file.
+#  When the calibration sample grows or files are re-staged, only new or changed
+#  files need to be processed, the partials for other files are taken from the store
+#
+#  - the signature of the local file is its size and modification time
+#    (or adler32 checksum, if requested)
+#  - the signature of the remote file is its size and the file UUID
+#
+#  @code
+#  with PartialStore () as store :
+#      value = store.get ( key , signature ( fname ) )
+#      if value is None :
+#          value = ...
+#          store.put ( key , signature ( fname ) , value )
+#  @endcode
+#  @see ostap.io.zipshelve
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Persistent store of the partial (per-file) accepted/rejected histograms
+
+Each partial result is stored together with the signature of the input file.
+When the calibration sample grows or files are re-staged, only new or changed
+files need to be processed, the partials for other files are taken from the store
+
+- the signature of the local file is its size and modification time
+  (or adler32 checksum, if requested)
+- the signature of the remote file is its size and the file UUID
+
+>>> with PartialStore () as store :
+...     value = store.get ( key , signature ( fname ) )
+...     if value is None :
+...         value = ...
+...         store.put ( key , signature ( fname ) , value )
+- see `ostap.io.zipshelve`
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'signature'    , ## signature of the input file
+    'file_identity', ## cheap identity of the input file (remote files are not opened)
+    'PartialStore' , ## persistent store of partial results
+)
+# =============================================================================
+from   pidcalib.utils import MB, cache_dir
+import os, zlib, hashlib
+import ROOT
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.partials')
+# =============================================================================
+## Signature of the input file
+#  - local file  : size and modification time (or adler32 checksum)
+#  - remote file : size and UUID
+#  @param fname    the file name
+#  @param checksum use adler32 checksum for local files
+#  @return tuple, `None` for inaccessible files
+def signature ( fname , checksum = False ) :
+    """ Signature of the input file
+    - local file  : size and modification time (or adler32 checksum)
+    - remote file : size and UUID
+    - return tuple, `None` for inaccessible files
+    """
+    if os.path.isfile ( fname ) :
+        size = os.path.getsize ( fname )
+        if not checksum : return size , os.path.getmtime ( fname )
+        value = 1
+        with open ( fname , 'rb' ) as f :
+            for block in iter ( lambda : f.read ( 16 * MB ) , b'' ) :
+                value = zlib.adler32 ( block , value )
+        return size , '%08x' % value
+
+    rfile = ROOT.TFile.Open ( fname , 'READ' )
+    if not rfile or rfile.IsZombie () :
+        logger.warning ( "Cannot open file `%s`" % fname )
+        return None
+    try :
+        return rfile.GetSize () , rfile.GetUUID ().AsString ()
+    finally :
+        rfile.Close ()
+
+# =============================================================================
+## Cheap identity of the input file: no (remote) file is opened
+#  - local file  : (name, signature)
+#  - remote file : (name,) - the calibration productions are immutable
+#  @return tuple 
+def file_identity ( fname ) :
+    """ Cheap identity of the input file: no (remote) file is opened
+    - local file  : (name, signature)
+    - remote file : (name,) - the calibration productions are immutable
+    """
+    return ( fname , signature ( fname ) ) if os.path.isfile ( fname ) else ( fname , ) 
+
+# =============================================================================
+## @class PartialStore
+#  Persistent store of partial results
+#  - the default database is `partials.db` in the local cache directory
+#  @code
+#  with PartialStore () as store :
+#      value = store.get ( key , signature ( fname ) )
+#      if value is None :
+#          value = ...
+#          store.put ( key , signature ( fname ) , value )
+#  @endcode
+class PartialStore(object) :
+    """ Persistent store of partial results
+    - the default database is `partials.db` in the local cache directory
+    >>> with PartialStore () as store :
+    ...     value = store.get ( key , signature ( fname ) )
+    ...     if value is None :
+    ...         value = ...
+    ...         store.put ( key , signature ( fname ) , value )
+    """
+    def __init__ ( self , dbname = None , checksum = False ) :
+        self.__dbname   = dbname if dbname else os.path.join ( cache_dir () , 'partials.db' )
+        self.__checksum = True if checksum else False
+        self.__db       = None
+
+    @property
+    def dbname ( self ) :
+        """`dbname` : the name of the database file"""
+        return self.__dbname
+
+    @property
+    def checksum ( self ) :
+        """`checksum` : use adler32 checksums for the local files?"""
+        return self.__checksum
+
+    ## signature of the input file
+    def signature ( self , fname ) :
+        """ Signature of the input file
+        """
+        return signature ( fname , checksum = self.__checksum )
+
+    # =========================================================================
+    ## context manager: open the database
+    def __enter__ ( self ) :
+        import ostap.io.zipshelve as DBASE
+        self.__db = DBASE.open ( self.__dbname , 'c' )
+        return self
+
+    ## context manager: close the database
+    def __exit__ ( self , *_ ) :
+        if self.__db is not None : self.__db.close ()
+        self.__db = None
+
+    # =========================================================================
+    ## The database key for the given key
+    @staticmethod
+    def key ( key ) :
+        """ The database key for the given key
+        """
+        return hashlib.sha1 ( repr ( key ).encode () ).hexdigest ()
+
+    # =========================================================================
+    ## Get the partial result, `None` if not found or the signature differs
+    def get ( self , key , signature ) :
+        """ Get the partial result, `None` if not found or the signature differs
+        """
+        assert self.__db is not None , "PartialStore: the database is not opened!"
+        if signature is None : return None
+        entry = self.__db.get ( self.key ( key ) , None )
+        if entry and entry [ 'signature' ] == signature : return entry [ 'value' ]
+        return None
+
+    # =========================================================================
+    ## Put the partial result into the store
+    def put ( self , key , signature , value ) :
+        """ Put the partial result into the store
+        """
+        assert self.__db is not None , "PartialStore: the database is not opened!"
+        if signature is None : return
+        self.__db [ self.key ( key ) ] = { 'signature' : signature , 'value' : value }
+
+    # =========================================================================
+    ## Remove all entries
+    def clear ( self ) :
+        """ Remove all entries
+        """
+        assert self.__db is not None , "PartialStore: the database is not opened!"
+        for key in list ( self.__db.keys () ) : del self.__db [ key ]
+
+    def __repr__ ( self ) : return 'PartialStore(%s)' % self.__dbname
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -81,6 +81,16 @@
 #  
 #   efficiency = 1 / ( 1 + rejected / accepted )
 #
+# For many samples and magnet polarities it is done by the aggregate request,
+# that processes all components concurrently in one pool:
+#
+# @code
+# request = AGGREGATE ( PARTICLE_2D , 'Pi' , 'probe_MC15TuneV1_ProbNNpi>0.5' , 
+#                       [ 'Turbo16' , 'Turbo17' , 'Turbo18' ] , [ 'up' , 'down' ] , 
+#                       '' , h2D , 'log10(probe_P/1000)' , 'probe_ETA' ) 
+# ( efficiency , accepted , rejected ) , components = request.process ( parallel = True ) 
+# @endcode
+#
 # To speedup athe processing for multicore machines one can use
 # `use_frame` and/or `parallel` directives:
 # 
@@ -97,6 +107,126 @@
 #                                                     parallel  = True  , ## parallel processing ?
 # @endcode
 #
+# Many PID criteria (e.g. the scan of working points) can be processed
+# in a single pass over the calibration data:
+#
+# @code
+# results = request.process_criteria ( [ 'probe_MC15TuneV1_ProbNNpi>0.2' , 'probe_MC15TuneV1_ProbNNpi>0.5' ] )
+# results = request.process_scan     ( 'probe_MC15TuneV1_ProbNNpi' , [ 0.1 , 0.2 , 0.3 , 0.4 , 0.5 ] ) 
+# for efficiency , accepted , rejected in results : ... 
+# @endcode
+#
+# Similarly, many binning schemes for the same PID criterion can be filled in a single pass:
+#
+# @code
+# results = request.process_templates ( [ ( h1D , 'log10(probe_P/1000)' ) , ( h2D , ( 'log10(probe_P/1000)' , 'probe_ETA' ) ) ] )
+# @endcode
+#
+# The calibration branches can be cached locally in columnar format, 
+# the subsequent requests (other criteria, other binnings) read memory-mapped arrays:
+#
+# @code
+# efficiency , accepted, rejected = request.process ( columns = True ) 
+# @endcode
+#
+# The results can be taken from (and saved into) the persistent result store,
+# keyed by the full identity of the request (see also `pidcalib-results` script):
+#
+# @code
+# efficiency , accepted, rejected = request.process ( store = True ) 
+# @endcode
+#
+# When the calibration sample grows, only new or changed files can be processed,
+# the partial histograms for other files are taken from the persistent store:
+#
+# @code
+# efficiency , accepted, rejected = request.process ( incremental = True ) 
+# @endcode
+#
+# For samples with many tree paths and files, all (tree_path, file) units 
+# can be dispatched to one process pool:
+#
+# @code
+# efficiency , accepted, rejected = request.process ( concurrent = True ) 
+# @endcode
+#
+# Many requests (e.g. different criteria, cuts or binnings) for the same calibration data
+# are grouped and processed in a single pass per group:
+#
+# @code
+# results = process_requests ( [ request1 , request2 , request3 ] ) 
+# ## run all event loops (all groups and tree paths) together with ROOT.RDF.RunGraphs
+# results = process_requests ( [ request1 , request2 , request3 ] , run_graphs = True ) 
+# @endcode
+#
+# For fine N-dimensional binnings the sparse storage can be used:
+#
+# @code
+# request = PARTICLE_ND ( 'Pi' , 'probe_MC15TuneV1_ProbNNpi>0.5' , 'Turbo18' , 'up' , '' , 
+#                         [ p_edges , eta_edges , ntrk_edges , npv_edges ] , 
+#                         [ 'log10(probe_P/1000)' , 'probe_ETA' , 'nTracks' , 'nPVs' ] )
+# efficiency , accepted, rejected = request.process ( parallel = True ) ## THnSparseD histograms 
+# @endcode
+#
+# The selection (dataset & user cuts) can be evaluated once and stored as per-file entry lists,
+# the subsequent passes read only the selected entries:
+#
+# @code
+# efficiency , accepted, rejected = request.process ( entry_lists = True ) 
+# @endcode
+#
+# The files and clusters that cannot contribute to the histogram range 
+# or cannot pass the cuts can be skipped using the zone maps (min/max summaries):
+#
+# @code
+# efficiency , accepted, rejected = request.process ( zones = True ) 
+# @endcode
+#
+# The statistical uncertainties (including bin-to-bin correlations) can be estimated
+# with Poisson bootstrap replicas, filled in the same pass over the data:
+#
+# @code
+# efficiency , accepted, rejected, boot = request.process ( bootstrap = 100 , seed = 12345 ) 
+# replicas = boot.replicas   () ## replica efficiency maps 
+# cov      = boot.covariance () ## covariance matrix of the efficiencies 
+# @endcode
+#
+# A quick look: a reproducible random subset of files, sized for the target precision per bin,
+# with the estimated full-run statistics and time. The subset is reused for the full run:
+#
+# @code
+# efficiency , accepted, rejected = request.preview ( precision = 0.05 , seed = 1 ) 
+# efficiency , accepted, rejected = request.upgrade () ## only the remaining files are processed 
+# @endcode
+#
+# Over remote (xrootd) paths the calibration files can be read file-by-file with the tree cache
+# restricted to the used branches and the next file opened asynchronously (MB/s are logged):
+#
+# @code
+# efficiency , accepted, rejected = request.process ( io = ChainIO ( cache_size = 200 * MB ) ) 
+# @endcode
+#
+# Long runs can be checkpointed: the per-file partials are periodically written into the local file,
+# and the interrupted run is resumed with the same call, skipping the completed units:
+#
+# @code
+# efficiency , accepted, rejected = request.process ( resume = 'pions_up.ckpt' ) 
+# @endcode
+#
+# The native NumPy backend reads only the used branches, evaluates the criterion, cuts and axes
+# as vectorized array expressions and fills the histograms with weighted `numpy.bincount`:
+#
+# @code
+# efficiency , accepted, rejected = request.process ( backend = 'numpy' , parallel = True ) 
+# @endcode
+#
+# For the samples with separate sWeight files (`sweight_dir` in the samples file) the sWeights
+# are read from the friend trees in lockstep with the calibration trees; the mapping of the
+# calibration files to the sWeight files is configurable:
+#
+# @code
+# request = PARTICLE_1D ( ... , sweights = SWeightFriends ( '/path/to/sweights/' ) ) 
+# @endcode
 #
 # At the end  all results can be saved into database:
 #
@@ -200,6 +330,14 @@
   
       efficiency = 1 / ( 1 + rejected / accepted )
 
+ For many samples and magnet polarities it is done by the aggregate request,
+ that processes all components concurrently in one pool:
+
+ >>> request = AGGREGATE ( PARTICLE_2D , 'Pi' , 'probe_MC15TuneV1_ProbNNpi>0.5' , 
+ ...                       [ 'Turbo16' , 'Turbo17' , 'Turbo18' ] , [ 'up' , 'down' ] , 
+ ...                       '' , h2D , 'log10(probe_P/1000)' , 'probe_ETA' ) 
+ >>> ( efficiency , accepted , rejected ) , components = request.process ( parallel = True ) 
+
  To speedup athe processing for multicore machines one can use
  `use_frame` and/or `parallel` directives:
  
@@ -214,6 +352,94 @@
  ...                                                     progress  = True  , ## show progress bar  ?
  ...                                                     parallel  = True  , ## parallel processing ?
 
+ Many PID criteria (e.g. the scan of working points) can be processed
+ in a single pass over the calibration data:
+
+ >>> results = request.process_criteria ( [ 'probe_MC15TuneV1_ProbNNpi>0.2' , 'probe_MC15TuneV1_ProbNNpi>0.5' ] )
+ >>> results = request.process_scan     ( 'probe_MC15TuneV1_ProbNNpi' , [ 0.1 , 0.2 , 0.3 , 0.4 , 0.5 ] ) 
+ >>> for efficiency , accepted , rejected in results : ... 
+
+ Similarly, many binning schemes for the same PID criterion can be filled in a single pass:
+
+ >>> results = request.process_templates ( [ ( h1D , 'log10(probe_P/1000)' ) , ( h2D , ( 'log10(probe_P/1000)' , 'probe_ETA' ) ) ] )
+
+ The calibration branches can be cached locally in columnar format, 
+ the subsequent requests (other criteria, other binnings) read memory-mapped arrays:
+
+ >>> efficiency , accepted, rejected = request.process ( columns = True ) 
+
+ The results can be taken from (and saved into) the persistent result store,
+ keyed by the full identity of the request (see also `pidcalib-results` script):
+
+ >>> efficiency , accepted, rejected = request.process ( store = True ) 
+
+ When the calibration sample grows, only new or changed files can be processed,
+ the partial histograms for other files are taken from the persistent store:
+
+ >>> efficiency , accepted, rejected = request.process ( incremental = True ) 
+
+ For samples with many tree paths and files, all (tree_path, file) units 
+ can be dispatched to one process pool:
+
+ >>> efficiency , accepted, rejected = request.process ( concurrent = True ) 
+
+ Many requests (e.g. different criteria, cuts or binnings) for the same calibration data
+ are grouped and processed in a single pass per group:
+
+ >>> results = process_requests ( [ request1 , request2 , request3 ] ) 
+ >>> ## run all event loops (all groups and tree paths) together with ROOT.RDF.RunGraphs
+ >>> results = process_requests ( [ request1 , request2 , request3 ] , run_graphs = True ) 
+
+ For fine N-dimensional binnings the sparse storage can be used:
+
+ >>> request = PARTICLE_ND ( 'Pi' , 'probe_MC15TuneV1_ProbNNpi>0.5' , 'Turbo18' , 'up' , '' , 
+ ...                         [ p_edges , eta_edges , ntrk_edges , npv_edges ] , 
+ ...                         [ 'log10(probe_P/1000)' , 'probe_ETA' , 'nTracks' , 'nPVs' ] )
+ >>> efficiency , accepted, rejected = request.process ( parallel = True ) ## THnSparseD histograms 
+
+ The selection (dataset & user cuts) can be evaluated once and stored as per-file entry lists,
+ the subsequent passes read only the selected entries:
+
+ >>> efficiency , accepted, rejected = request.process ( entry_lists = True ) 
+
+ The files and clusters that cannot contribute to the histogram range 
+ or cannot pass the cuts can be skipped using the zone maps (min/max summaries):
+
+ >>> efficiency , accepted, rejected = request.process ( zones = True ) 
+
+ The statistical uncertainties (including bin-to-bin correlations) can be estimated
+ with Poisson bootstrap replicas, filled in the same pass over the data:
+
+ >>> efficiency , accepted, rejected, boot = request.process ( bootstrap = 100 , seed = 12345 ) 
+ >>> replicas = boot.replicas   () ## replica efficiency maps 
+ >>> cov      = boot.covariance () ## covariance matrix of the efficiencies 
+
+ A quick look: a reproducible random subset of files, sized for the target precision per bin,
+ with the estimated full-run statistics and time. The subset is reused for the full run:
+
+ >>> efficiency , accepted, rejected = request.preview ( precision = 0.05 , seed = 1 ) 
+ >>> efficiency , accepted, rejected = request.upgrade () ## only the remaining files are processed 
+
+ Over remote (xrootd) paths the calibration files can be read file-by-file with the tree cache
+ restricted to the used branches and the next file opened asynchronously (MB/s are logged):
+
+ >>> efficiency , accepted, rejected = request.process ( io = ChainIO ( cache_size = 200 * MB ) ) 
+
+ Long runs can be checkpointed: the per-file partials are periodically written into the local file,
+ and the interrupted run is resumed with the same call, skipping the completed units:
+
+ >>> efficiency , accepted, rejected = request.process ( resume = 'pions_up.ckpt' ) 
+
+ The native NumPy backend reads only the used branches, evaluates the criterion, cuts and axes
+ as vectorized array expressions and fills the histograms with weighted `numpy.bincount`:
+
+ >>> efficiency , accepted, rejected = request.process ( backend = 'numpy' , parallel = True ) 
+
+ For the samples with separate sWeight files (`sweight_dir` in the samples file) the sWeights
+ are read from the friend trees in lockstep with the calibration trees; the mapping of the
+ calibration files to the sWeight files is configurable:
+
+ >>> request = PARTICLE_1D ( ... , sweights = SWeightFriends ( '/path/to/sweights/' ) ) 
 
  At the end  all results can be saved into database 
 
@@ -245,19 +471,122 @@ __all__     = (
     'PARTICLE_1D' , ## description of elementary request to make  1D-efficiency
     'PARTICLE_2D' , ## description of elementary request to make  1D-efficiency
     'PARTICLE_3D' , ## description of elementary request to make  1D-efficiency
+    'PARTICLE_ND' , ## description of elementary request to make  ND-efficiency (sparse)
+    'AGGREGATE'   , ## aggregate request over samples & magnet polarities 
+    'process_requests' , ## process many requests, grouped by calibration data 
 )    
 # =============================================================================
 from   abc                   import ABC, abstractmethod
 from   ostap.utils.basic     import typename
+from   pidcalib.fill         import ( Fill, fill_chain, fill_frame, fill_graphs, efficiency,
+                                      merge_pairs, tree_reduce, selection_problem, FillTask, MultiFillTask )
+from   pidcalib.columns      import ColumnCache 
+from   pidcalib.results      import ResultStore, identity 
+from   pidcalib.partials     import PartialStore, signature 
+from   pidcalib.entries      import EntryListCache 
+from   pidcalib.zones        import ZoneMaps, ZONE_BRANCHES 
+from   pidcalib.utils        import MB 
+from   pidcalib.sparse       import SparseHisto, SparseTask, sparse_edges 
+from   pidcalib.bootstrap    import BootstrapTask 
+from   pidcalib.chains       import ChainIO 
+from   pidcalib.checkpoint   import Checkpoint 
+from   pidcalib.vectorized   import NumpyTask, vectorizable, to_histo 
+from   pidcalib.sweights     import SWeightFriends, calibration_chain 
+from   pidcalib.metadata     import calibration_sample 
 import ostap.trees.trees
 import ostap.histos.histos
-import pidcalib2.pid_data 
-import ROOT
+import ROOT, math, random, time 
 # =============================================================================
 from ostap.logger.logger import getLogger
 logger = getLogger('ostap.pidcalib')
 # =============================================================================
+## maximal number of files for the preview mode (non-positive: no limit) 
 MAX_FILES = -1 
+# =============================================================================
+## The quantile of the relative uncertainties over the well-populated (in-range) bins
+#  - the bins with less than <code>min_entries</code> (accepted+rejected) entries
+#    are not considered: a few sparsely filled edge bins do not drive the preview 
+#  @param histo       the efficiency histogram
+#  @param accepted    the accepted histogram
+#  @param rejected    the rejected histogram
+#  @param quantile    the quantile of the relative uncertainties
+#  @param min_entries the minimal number of entries in the bin 
+#  @return the quantile of the relative uncertainties or `None` if there are no such bins 
+def _bin_precision ( histo , accepted , rejected , quantile = 0.9 , min_entries = 10 ) :
+    """ The quantile of the relative uncertainties over the well-populated (in-range) bins
+    - the bins with less than `min_entries` (accepted+rejected) entries
+      are not considered: a few sparsely filled edge bins do not drive the preview 
+    - return the quantile of the relative uncertainties or `None` if there are no such bins 
+    """
+    precisions = []
+    for b in range ( histo.GetNcells () ) :
+        if histo.IsBinUnderflow ( b ) or histo.IsBinOverflow ( b ) : continue
+        if accepted.GetBinContent ( b ) + rejected.GetBinContent ( b ) < min_entries : continue 
+        value = histo.GetBinContent ( b )
+        if 0 < value : precisions.append ( histo.GetBinError ( b ) / value )
+    if not precisions : return None
+    precisions.sort ()
+    index = int ( math.ceil ( quantile * len ( precisions ) ) ) - 1 
+    return precisions [ min ( max ( index , 0 ) , len ( precisions ) - 1 ) ]
+
+# =============================================================================
+## Accumulate (sum) the accepted/rejected pairs
+#  @param results list of accumulated [accepted,rejected] pairs (or `None`)
+#  @param pairs   list of (accepted,rejected) pairs to be added 
+#  - the first pair is cloned: the added pairs (e.g. the partials stored
+#    in the checkpoint or in the partial store) are never modified 
+def _accumulate ( results , pairs ) :
+    """ Accumulate (sum) the accepted/rejected pairs
+    - the first pair is cloned: the added pairs (e.g. the partials stored
+      in the checkpoint or in the partial store) are never modified 
+    """
+    for i , ( a , r ) in enumerate ( pairs ) :
+        if results [ i ] is None : results [ i ] = [ a.clone () , r.clone () ]
+        else :
+            results [ i ] [ 0 ] += a
+            results [ i ] [ 1 ] += r
+    return results
+
+# =============================================================================
+## Run the task for all units: in the process pool or sequentially
+#  @param task     the task (<code>ostap.parallel.task.Task</code>)
+#  @param units    the work units
+#  @param parallel use the process pool (<code>WorkManager</code>)?
+#  @param ncpus    number of processes for the parallel mode 
+#  @return the task results 
+def _run_task ( task , units , parallel = False , progress = True , silent = False , ncpus = None ) :
+    """ Run the task for all units: in the process pool or sequentially
+    - task     : the task (`ostap.parallel.task.Task`)
+    - units    : the work units
+    - parallel : use the process pool (`WorkManager`)?
+    - ncpus    : number of processes for the parallel mode 
+    - return the task results 
+    """
+    if parallel :
+        from ostap.parallel.parallel import WorkManager
+        kw   = { 'ncpus' : ncpus } if isinstance ( ncpus , int ) and 0 < ncpus else {} 
+        wmgr = WorkManager ( silent = silent , progress = progress , **kw )
+        wmgr.process ( task , units )
+    else :
+        from ostap.utils.progress_bar import progress_bar
+        task.initialize_local ()
+        for jobid , unit in enumerate ( progress_bar ( units , silent = not progress ) ) :
+            task.merge_results ( task.process ( jobid , unit ) , jobid ) 
+    return task.results ()
+
+# =============================================================================
+## Check that the options are not combined with the processing mode
+#  - TypeError is raised for the options that are not applicable to the mode 
+#  @param mode    the processing mode
+#  @param method  the dedicated entry point for the mode 
+#  @param options the options: { name : value } 
+def _exclusive ( mode , method , **options ) :
+    """ Check that the options are not combined with the processing mode
+    - TypeError is raised for the options that are not applicable to the mode 
+    """
+    used = sorted ( k for k , v in options.items () if v )
+    if used : raise TypeError ( "process: %s cannot be combined with `%s`, see `PARTICLE.%s`" % ( mode , '`, `'.join ( used ) , method ) )
+
 # =============================================================================
 ## The abstract base class for processing
 #  - It has only one essential method: <code>process</code>
@@ -267,12 +596,15 @@ class PARTICLE (ABC)  :
     - It has only one   essential method: `process`
     - It should return a tuple of three thistogram: efficiency, accepted and rejected 
     """
-    def __init__ ( self      ,
-                   particle  ,
-                   criterion , 
-                   sample    ,
-                   magnet    ,
-                   cuts      = '' ) :
+    def __init__ ( self                ,
+                   particle            ,
+                   criterion           , 
+                   sample              ,
+                   magnet              ,
+                   cuts         = ''   ,
+                   samples_file = None ,
+                   sweights     = None ,
+                   persistent   = True ) :
         
         self.__particle  = particle
         self.__criterion = criterion
@@ -280,35 +612,35 @@ class PARTICLE (ABC)  :
         self.__magnet    = magnet
         self.__cuts      = ROOT.TCut ( cuts ) 
         
-        ## get the calibration sample 
-        self.__data = pidcalib2.pid_data.get_calibration_sample  (
-            self.__sample   ,
-            self.__magnet   ,
-            self.__particle ,
-            None            , #
-            None            )
-        
-        ##
-        ## MAX_FILES if isinstance ( MAX_FILES , int ) and 0 < MAX_FILES else None )
-        ##
-        
-        assert self.__data , "Invalid sample/magnet/particle combination %s/%s/%s" % ( self.__sample   ,
-                                                                                       self.__magnet   ,
-                                                                                       self.__particle )
+        ## get the calibration sample (cached & shared between requests),
+        ## `persistent` - use the persistent (on-disk) metadata cache too 
+        meta = calibration_sample ( self.__sample   ,
+                                    self.__magnet   ,
+                                    self.__particle ,
+                                    samples_file    ,
+                                    persistent = persistent )
+        self.__data = meta.data 
         
         ## update the CUTS
-        data_cuts = self.__data.get ( 'cuts' , [] )
-        if data_cuts : logger.attention ( "The `cuts` are defined with dataset: %s" % str ( data_cuts ) )  
-        for cut in self.__data.get ( 'cuts', [] ) : self.__cuts &= cut
+        if meta.cuts : logger.attention ( "The `cuts` are defined with dataset: %s" % str ( meta.cuts ) )  
+        for cut in meta.cuts : self.__cuts &= cut
         
         ## get sWeightvariable 
-        self.__sWeight    = self.__data.get ( 'sweight_branch' , 'probe_sWeight' )
+        self.__sWeight    = meta.sweight
         
-        self.__tree_paths = pidcalib2.pid_data.get_tree_paths (
-            self.__particle , 
-            self.__sample   ,
-            self.__data [ "tuple_names" ][ self.__particle ] \
-            if "tuple_names" in self.__data and self.__particle in self.__data ["tuple_names" ] else None )
+        self.__tree_paths = meta.tree_paths 
+        self.__files      = meta.files 
+
+        ## sWeights in the friend files: `None` - from the dataset, `False` - disable
+        if sweights is None and meta.sweight_dir : sweights = SWeightFriends ( meta.sweight_dir ) 
+        self.__friends    = sweights if sweights else None
+        if self.__friends :
+            logger.attention ( "sWeights are taken from the friend files: %s" % self.__friends ) 
+            self.__sWeight = self.__friends.branch
+            self.__cuts   &= self.__friends.cuts 
+
+        ## the state of the preview (subset) processing 
+        self.__preview    = None 
 
     @abstractmethod 
     def histogram ( self ) :
@@ -336,6 +668,690 @@ class PARTICLE (ABC)  :
     def magnet ( self  ) :
         """`magnet` : Magner polarity"""
         return self.__magnet
+
+    @property
+    def criterion ( self  ) :
+        """`criterion` : PID criterion to be tested"""
+        return self.__criterion
+    
+    @property
+    def cuts ( self  ) :
+        """`cuts` : all cuts: user-defined & dataset cuts """
+        return self.__cuts
+    
+    @property
+    def weight ( self  ) :
+        """`weight` : sWeight variable"""
+        return self.__sWeight
+
+    @property
+    def files ( self  ) :
+        """`files` : calibration files (shared between requests)"""
+        return self.__files
+    
+    @property
+    def tree_paths ( self  ) :
+        """`tree_paths` : tree paths in the calibration files"""
+        return self.__tree_paths
+
+    @property
+    def friends ( self  ) :
+        """`friends` : sWeight friend files (or `None`)"""
+        return self.__friends
+    
+    # =========================================================================
+    ## Create the calibration chain for the given tree path
+    def chain ( self , tree_path ) :
+        """ Create the calibration chain for the given tree path
+        """
+        return calibration_chain ( tree_path , self.__files , self.__friends )
+    
+    # =========================================================================
+    ## Elementary fill for this request 
+    #  - criterion, histogram and variables can be redefined
+    #  @see pidcalib.fill.Fill
+    def fill ( self , criterion = None , histogram = None , variables = None ) :
+        """ Elementary fill for this request 
+        - criterion, histogram and variables can be redefined
+        - see pidcalib.fill.Fill
+        """
+        return Fill ( self.histogram () if histogram is None else histogram ,
+                      tuple ( self.variables () if variables is None else variables ) ,
+                      self.__criterion if criterion is None else criterion ,
+                      self.__cuts )
+    
+    # =========================================================================
+    ## Check that the criteria and cuts of the fills are boolean 
+    #  - the fills (and the bootstrap/sparse filling) use <code>RDataFrame::Filter</code>,
+    #    while <code>data_efficiency</code> uses a non-boolean selection value as a weight 
+    #  @param fills the elementary fills (`None` for the criterion and cuts of this request) 
+    #  @return `None` if all selections are boolean, otherwise the error message
+    #  @see pidcalib.fill.selection_problem 
+    def selection_problem ( self , fills = None ) :
+        """ Check that the criteria and cuts of the fills are boolean 
+        - the fills (and the bootstrap/sparse filling) use `RDataFrame::Filter`,
+          while `data_efficiency` uses a non-boolean selection value as a weight 
+        - fills : the elementary fills (`None` for the criterion and cuts of this request) 
+        - return `None` if all selections are boolean, otherwise the error message
+        - see pidcalib.fill.selection_problem 
+        """
+        selections = [ self.__criterion , self.__cuts ] if fills is None else \
+                     [ s for f in fills for s in ( f.criterion , f.cuts ) ]
+        return selection_problem ( self.chain ( self.__tree_paths [ 0 ] ) , *selections )
+    
+    # =========================================================================
+    ## The key of the calibration data: requests with the same key 
+    #  can be processed in a single pass over the calibration data 
+    @property 
+    def calibration_key ( self ) :
+        """`calibration_key` : the key of the calibration data: requests with the same key 
+        can be processed in a single pass over the calibration data"""
+        return self.__sample , self.__magnet , self.__particle , self.__files , self.__tree_paths , self.__sWeight
+    
+    # =========================================================================
+    ## Full identity of the elementary fill for this calibration data
+    #  @see pidcalib.results.identity 
+    #  - for sWeight friends the sWeight files and their signatures are included 
+    def identity ( self , fill = None ) :
+        """ Full identity of the elementary fill for this calibration data
+        - for sWeight friends the sWeight files and their signatures are included 
+        - see pidcalib.results.identity 
+        """
+        extra = ( self.__friends.identity ( self.__files ) , ) if self.__friends else ()
+        return identity ( self.fill () if fill is None else fill ,
+                          self.__particle ,
+                          self.__sample   ,
+                          self.__magnet   ,
+                          self.__sWeight  ,
+                          self.__files    ,
+                          ( 'tree_paths' , tuple ( self.__tree_paths ) ) , *extra )
+    
+    # =========================================================================
+    ## Fill the partial histograms file-by-file, using the persistent store of partials
+    #  - only new or changed files are processed 
+    #  @see pidcalib.partials.PartialStore
+    def __fill_incremental ( self , store , tree_path , fills ) :
+        """ Fill the partial histograms file-by-file, using the persistent store of partials
+        - only new or changed files are processed 
+        - see pidcalib.partials.PartialStore
+        """
+        bases   = [ identity ( f , self.__particle , self.__sample , self.__magnet , self.__sWeight , () ) for f in fills ]
+        results = [ None ] * len ( fills )
+        nnew    = 0
+        for fname in self.__files :
+            
+            sig   = store.signature ( fname )
+            if self.__friends and not sig is None :
+                ## the partials are invalidated also by the changed sWeight files 
+                sfile , ssig = self.__friends.signature ( fname , checksum = store.checksum )
+                sig = ( sig , sfile , ssig ) if not ssig is None else None 
+            keys  = [ b + ( ( 'tree_path' , tree_path ) , ( 'file' , fname ) ) for b in bases ]
+            pairs = [ store.get ( k , sig ) for k in keys ]
+            todo  = [ i for i , p in enumerate ( pairs ) if p is None ]
+            
+            if todo :
+                chain = calibration_chain ( tree_path , [ fname ] , self.__friends )
+                new   = fill_chain ( chain , [ fills [ i ] for i in todo ] , weight = self.__sWeight )
+                for i , pair in zip ( todo , new ) :
+                    pairs [ i ] = pair
+                    store.put ( keys [ i ] , sig , pair )
+                nnew += 1
+                
+            _accumulate ( results , pairs )
+            
+        logger.info ( '%s: %d new/changed files out of %d are processed' % ( tree_path , nnew , len ( self.__files ) ) )
+        return results 
+                
+    # =========================================================================
+    ## The (tree_path, files) units for concurrent processing
+    def units ( self , chunk_files = 1 ) :
+        """ The (tree_path, files) units for concurrent processing
+        """
+        assert isinstance ( chunk_files , int ) and 1 <= chunk_files , "Invalid `chunk_files` %s" % chunk_files
+        return [ ( tree_path , self.__files [ i : i + chunk_files ] )
+                 for tree_path in self.__tree_paths
+                 for i in range ( 0 , len ( self.__files ) , chunk_files ) ]
+    
+    # =========================================================================
+    ## Fill the histograms concurrently: all (tree_path, files) units are dispatched
+    #  to one process pool, the partials are merged with pairwise (tree) reduction
+    #  @see pidcalib.fill.FillTask
+    #  @see pidcalib.fill.tree_reduce
+    def __fill_concurrent ( self , fills , progress = True , silent = False , chunk_files = 1 , ncpus = None ) :
+        """ Fill the histograms concurrently: all (tree_path, files) units are dispatched
+        to one process pool, the partials are merged with pairwise (tree) reduction
+        - see pidcalib.fill.FillTask
+        - see pidcalib.fill.tree_reduce
+        """
+        units = self.units ( chunk_files )
+        if not silent : logger.info ( 'Processing: %s/%s/%s: %d units, %d fills' % ( self.__particle ,
+                                                                                   self.__sample   ,
+                                                                                   self.__magnet   ,
+                                                                                   len ( units )   ,
+                                                                                   len ( fills )   ) )
+        
+        task     = FillTask ( fills , weight = self.__sWeight , friends = self.__friends )
+        partials = _run_task ( task , units , parallel = True , progress = progress , silent = silent , ncpus = ncpus )
+        assert partials , "No partial results are produced!"
+        return tree_reduce ( partials , merge_pairs ) 
+        
+    # =========================================================================
+    ## Process many elementary fills in a single pass over each calibration tree
+    #  @param fills       list of elementary fills
+    #  @param columns     use local columnar cache: `True` for the default cache or `ColumnCache` instance 
+    #  @param incremental keep per-file partials and process only new/changed files:
+    #                     `True` for the default store or `PartialStore` instance 
+    #  @param concurrent  dispatch all (tree_path, files) units to one process pool 
+    #  @param chunk_files number of files per unit for the concurrent mode 
+    #  @param ncpus       number of processes for the concurrent mode 
+    #  @return list of (efficiency, accepted, rejected) triplets, one per fill 
+    #  @see pidcalib.fill.Fill 
+    #  @see pidcalib.columns.ColumnCache 
+    #  @see pidcalib.partials.PartialStore 
+    def process_fills ( self                ,
+                        fills               , 
+                        progress    = True  ,
+                        silent      = False ,
+                        parallel    = False ,
+                        columns     = None  ,
+                        incremental = None  ,
+                        concurrent  = False ,
+                        chunk_files = 1     ,
+                        ncpus       = None  ) :
+        """ Process many elementary fills in a single pass over each calibration tree
+        - columns     : use local columnar cache: `True` for the default cache or `ColumnCache` instance 
+        - incremental : keep per-file partials and process only new/changed files:
+                        `True` for the default store or `PartialStore` instance 
+        - concurrent  : dispatch all (tree_path, files) units to one process pool 
+        - chunk_files : number of files per unit for the concurrent mode 
+        - ncpus       : number of processes for the concurrent mode 
+        - return list of (efficiency, accepted, rejected) triplets, one per fill 
+        - see pidcalib.fill.Fill 
+        - see pidcalib.columns.ColumnCache 
+        - see pidcalib.partials.PartialStore 
+        """
+        fills = tuple ( fills )
+
+        problem = self.selection_problem ( fills )
+        if problem : raise ValueError ( "process_fills: %s, use `process`" % problem ) 
+        
+        if concurrent :
+            if columns or incremental :
+                logger.warning ( "process_fills: `columns` and `incremental` are ignored for concurrent processing" )
+            results = self.__fill_concurrent ( fills , progress = progress , silent = silent , chunk_files = chunk_files , ncpus = ncpus )
+            return [ ( efficiency ( a , r ) , a , r ) for a , r in results ]
+        
+        if columns and self.__friends :
+            logger.warning ( "process_fills: `columns` is ignored for sWeight friend files" )
+            columns = None 
+            
+        cache = ColumnCache  () if columns     is True else columns 
+        store = PartialStore () if incremental is True else incremental 
+        
+        expressions = [ self.__sWeight ]
+        for f in fills : expressions += [ f.criterion , str ( f.cuts ) ] + list ( f.variables ) 
+        
+        if parallel and not ROOT.ROOT.IsImplicitMTEnabled () : ROOT.ROOT.EnableImplicitMT()
+
+        results = [ None ] * len ( fills ) 
+        for tree_path in self.__tree_paths :
+
+            if not silent : logger.info ( 'Processing: %s/%s/%s:%s (%d fills)' % ( self.__particle ,
+                                                                                 self.__sample   ,
+                                                                                 self.__magnet   ,
+                                                                                 tree_path       ,
+                                                                                 len ( fills )   ) ) 
+
+            if store :
+                with store : pairs = self.__fill_incremental ( store , tree_path , fills )
+            elif cache :
+                key = self.__sample , self.__magnet , self.__particle , tree_path , \
+                      tuple ( ( f , signature ( f ) ) for f in self.__files ) 
+                frame , arrays = cache.frame ( key , self.chain ( tree_path ) , *expressions )
+                pairs = fill_frame ( frame , fills , weight = self.__sWeight , progress = progress )
+                del frame , arrays 
+            else : 
+                pairs = fill_chain ( self.chain ( tree_path ) , fills , weight = self.__sWeight , progress = progress )
+                
+            _accumulate ( results , pairs )
+                    
+        return [ ( efficiency ( a , r ) , a , r ) for a , r in results ]
+    
+    # =========================================================================
+    ## Process many PID criteria in a single pass over each calibration tree
+    #  - particle, sample, magnet, cuts, binning and variables are shared 
+    #  @code
+    #  request = PARTICLE_1D ( ... )
+    #  results = request.process_criteria ( [ 'probe_MC15TuneV1_ProbNNpi>0.2' ,
+    #                                         'probe_MC15TuneV1_ProbNNpi>0.5' ,
+    #                                         'probe_MC15TuneV1_ProbNNpi>0.8' ] )
+    #  for efficiency , accepted , rejected in results : ...
+    #  @endcode
+    #  @return list of (efficiency, accepted, rejected) triplets, one per criterion
+    def process_criteria ( self             ,
+                           criteria         ,
+                           progress = True  ,
+                           silent   = False ,
+                           parallel = False ,
+                           **kwargs         ) :
+        """ Process many PID criteria in a single pass over each calibration tree
+        - particle, sample, magnet, cuts, binning and variables are shared 
+        >>> request = PARTICLE_1D ( ... )
+        >>> results = request.process_criteria ( [ 'probe_MC15TuneV1_ProbNNpi>0.2' ,
+        ...                                        'probe_MC15TuneV1_ProbNNpi>0.5' ,
+        ...                                        'probe_MC15TuneV1_ProbNNpi>0.8' ] )
+        >>> for efficiency , accepted , rejected in results : ...
+        - return list of (efficiency, accepted, rejected) triplets, one per criterion
+        - other arguments are passed to `process_fills`
+        """
+        fills = [ self.fill ( criterion = c ) for c in criteria ]
+        return self.process_fills ( fills , progress = progress , silent = silent , parallel = parallel , **kwargs )
+    
+    # =========================================================================
+    ## Process many binning schemes for the PID criterion in a single pass over each calibration tree
+    #  @code
+    #  request = PARTICLE_1D ( ... )
+    #  results = request.process_templates ( [ ( h1D , 'probe_P' ) ,
+    #                                          ( h2D , ( 'probe_P' , 'probe_ETA' ) ) ,
+    #                                          ( h3D , ( 'probe_P' , 'probe_ETA' , 'nSPDhits' ) ) ] )
+    #  for efficiency , accepted , rejected in results : ...
+    #  @endcode
+    #  @param templates list of (histogram, variables) pairs 
+    #  @return list of (efficiency, accepted, rejected) triplets, one per template
+    def process_templates ( self             ,
+                            templates        ,
+                            progress = True  ,
+                            silent   = False ,
+                            parallel = False ,
+                            **kwargs         ) :
+        """ Process many binning schemes for the PID criterion in a single pass over each calibration tree
+        >>> request = PARTICLE_1D ( ... )
+        >>> results = request.process_templates ( [ ( h1D , 'probe_P' ) ,
+        ...                                         ( h2D , ( 'probe_P' , 'probe_ETA' ) ) ,
+        ...                                         ( h3D , ( 'probe_P' , 'probe_ETA' , 'nSPDhits' ) ) ] )
+        >>> for efficiency , accepted , rejected in results : ...
+        - templates : list of (histogram, variables) pairs 
+        - return list of (efficiency, accepted, rejected) triplets, one per template
+        - other arguments are passed to `process_fills`
+        """
+        fills = []
+        for histogram , variables in templates :
+            if isinstance ( variables , str ) : variables = variables ,
+            assert isinstance ( histogram , ROOT.TH1 ) and histogram.GetDimension () == len ( variables ) , \
+                "Invalid histogram type %s for %d variables" % ( typename ( histogram ) , len ( variables ) )
+            fills.append ( self.fill ( histogram = histogram , variables = variables ) )
+        return self.process_fills ( fills , progress = progress , silent = silent , parallel = parallel , **kwargs )
+    
+    # =========================================================================
+    ## Threshold scan for one PID variable in a single pass over each calibration tree
+    #  @code
+    #  request = PARTICLE_1D ( ... )
+    #  results = request.process_scan ( 'probe_MC15TuneV1_ProbNNpi' , [ 0.1 * i for i in range ( 10 ) ] ) 
+    #  @endcode
+    #  @return list of (efficiency, accepted, rejected) triplets, one per threshold 
+    def process_scan ( self             ,
+                       variable         ,
+                       thresholds       ,
+                       progress = True  ,
+                       silent   = False ,
+                       parallel = False ,
+                       **kwargs         ) :
+        """ Threshold scan for one PID variable in a single pass over each calibration tree
+        >>> request = PARTICLE_1D ( ... )
+        >>> results = request.process_scan ( 'probe_MC15TuneV1_ProbNNpi' , [ 0.1 * i for i in range ( 10 ) ] ) 
+        - return list of (efficiency, accepted, rejected) triplets, one per threshold 
+        - other arguments are passed to `process_fills`
+        """
+        criteria = [ '%s>%s' % ( variable , t ) for t in thresholds ] 
+        return self.process_criteria ( criteria , progress = progress , silent = silent , parallel = parallel , **kwargs )
+    
+    # =========================================================================
+    ## Process the next file of the preview subset (all tree paths) 
+    def __preview_file ( self , state , progress = False ) :
+        """ Process the next file of the preview subset (all tree paths) 
+        """
+        fname = state [ 'order' ] [ state [ 'done' ] ]
+        start = time.time () 
+        for tree_path in self.__tree_paths :
+            chain  = calibration_chain ( tree_path , [ fname ] , self.__friends )
+            a , r  = fill_chain ( chain , [ self.fill () ] , weight = self.__sWeight , progress = progress ) [ 0 ]
+            state [ 'entries' ] += len ( chain )
+            if state [ 'accepted' ] is None : state [ 'accepted' ] , state [ 'rejected' ] = a , r
+            else :
+                state [ 'accepted' ] += a
+                state [ 'rejected' ] += r
+        state [ 'time' ] += time.time () - start 
+        state [ 'done' ] += 1
+
+    # =========================================================================
+    ## Preview: process a reproducible random subset of calibration files,
+    #  sized to reach the target relative precision in the well-populated bins
+    #  - the precision is the <code>quantile</code> of the relative uncertainties
+    #    over the bins with at least <code>min_entries</code> entries
+    #  - the files are shuffled with the given seed
+    #  - the first (pilot) file estimates the number of files needed,
+    #    assuming the uncertainties scale as 1/sqrt(N)
+    #  - the estimated full-run statistics, precision and time are reported
+    #  - the processed subset is kept: use <code>upgrade</code> to complete the full run
+    #  @code
+    #  request = PARTICLE_1D ( ... )
+    #  efficiency , accepted , rejected = request.preview ( precision = 0.05 )
+    #  ...
+    #  efficiency , accepted , rejected = request.upgrade () ## the remaining files only 
+    #  @endcode
+    #  @param precision   the target relative precision per bin
+    #  @param seed        the seed for the file subset
+    #  @param max_files   maximal number of files (default: <code>MAX_FILES</code> if positive)
+    #  @param quantile    the quantile of the per-bin relative uncertainties to reach the target 
+    #  @param min_entries the minimal number of entries for the bin to be considered 
+    #  @return (efficiency, accepted, rejected) triplet for the subset 
+    def preview ( self                ,
+                  precision   = 0.05  ,
+                  seed        = 0     ,
+                  max_files   = None  ,
+                  quantile    = 0.9   ,
+                  min_entries = 10    , 
+                  progress    = False ,
+                  silent      = False ,
+                  parallel    = False ) :
+        """ Preview: process a reproducible random subset of calibration files,
+        sized to reach the target relative precision in the well-populated bins
+        - the precision is the `quantile` of the relative uncertainties
+          over the bins with at least `min_entries` entries
+        - the files are shuffled with the given seed
+        - the first (pilot) file estimates the number of files needed,
+          assuming the uncertainties scale as 1/sqrt(N)
+        - the estimated full-run statistics, precision and time are reported
+        - the processed subset is kept: use `upgrade` to complete the full run
+        >>> request = PARTICLE_1D ( ... )
+        >>> efficiency , accepted , rejected = request.preview ( precision = 0.05 )
+        ...
+        >>> efficiency , accepted , rejected = request.upgrade () ## the remaining files only 
+        - precision   : the target relative precision per bin
+        - seed        : the seed for the file subset
+        - max_files   : maximal number of files (default: `MAX_FILES` if positive)
+        - quantile    : the quantile of the per-bin relative uncertainties to reach the target 
+        - min_entries : the minimal number of entries for the bin to be considered 
+        - return (efficiency, accepted, rejected) triplet for the subset 
+        """
+        assert 0 < precision < 1 , "preview: invalid `precision` %s"   % precision
+        assert 0 < quantile <= 1 , "preview: invalid `quantile` %s"    % quantile
+        assert 0 <= min_entries  , "preview: invalid `min_entries` %s" % min_entries
+        if max_files is None and isinstance ( MAX_FILES , int ) and 0 < MAX_FILES : max_files = MAX_FILES
+
+        problem = self.selection_problem ()
+        if problem : raise ValueError ( "preview: %s, use `process`" % problem )
+        
+        state = self.__preview
+        if state is None or state [ 'seed' ] != seed :
+            order = list ( self.__files )
+            random.Random ( seed ).shuffle ( order )
+            state = { 'seed'     : seed  , 'order'    : order , 'done' : 0 , 'entries' : 0 , 'time' : 0.0 , 
+                      'accepted' : None  , 'rejected' : None  }
+            self.__preview = state 
+            
+        if parallel and not ROOT.ROOT.IsImplicitMTEnabled () : ROOT.ROOT.EnableImplicitMT()
+        
+        nfiles = len ( state [ 'order' ] )
+        limit  = min ( nfiles , max_files ) if isinstance ( max_files , int ) and 0 < max_files else nfiles
+        target = max ( 1 , state [ 'done' ] )
+        reached = None 
+        while True :
+            while state [ 'done' ] < min ( target , limit ) : self.__preview_file ( state , progress = progress )
+            reached = _bin_precision ( efficiency ( state [ 'accepted' ] , state [ 'rejected' ] ) ,
+                                       state [ 'accepted' ] , state [ 'rejected' ] , quantile , min_entries )
+            if reached is not None and reached <= precision : break
+            if limit <= state [ 'done' ]                    : break 
+            done   = state [ 'done' ]
+            target = 2 * done if reached is None else max ( done + 1 , int ( math.ceil ( done * ( reached / precision ) ** 2 ) ) )
+
+        done  = state [ 'done' ]
+        scale = float ( nfiles ) / done
+        if not silent :
+            from ostap.logger.table import table
+            rows  = [ ( 'Quantity' , 'Preview' , 'Full run (estimated)' ) ]
+            rows.append ( ( 'Files'    , '%d' % done , '%d' % nfiles ) )
+            rows.append ( ( 'Entries'  , '%d' % state [ 'entries' ] , '%.0f' % ( state [ 'entries' ] * scale ) ) )
+            rows.append ( ( 'Accepted' , '%.1f' % state [ 'accepted' ].Integral () , '%.1f' % ( state [ 'accepted' ].Integral () * scale ) ) )
+            rows.append ( ( 'Rejected' , '%.1f' % state [ 'rejected' ].Integral () , '%.1f' % ( state [ 'rejected' ].Integral () * scale ) ) )
+            if reached is not None :
+                label = 'Bin precision, %g%% quantile [%%]' % ( 100 * quantile )
+                rows.append ( ( label , '%.2f' % ( 100 * reached ) , '%.2f' % ( 100 * reached / scale ** 0.5 ) ) )
+            rows.append ( ( 'Time [s]' , '%.1f' % state [ 'time' ] , '%.1f' % ( state [ 'time' ] * scale ) ) )
+            title = 'Preview %s/%s/%s (seed=%s)' % ( self.__particle , self.__sample , self.__magnet , seed )
+            logger.info ( '%s:\n%s' % ( title , table ( rows , title = title , prefix = '# ' , alignment = 'lrr' ) ) )
+            if reached is None or precision < reached :
+                logger.warning ( 'preview: the target precision %.2f%% is not reached with %d files' % ( 100 * precision , done ) )
+            
+        accepted = state [ 'accepted' ].clone ()
+        rejected = state [ 'rejected' ].clone ()
+        return efficiency ( accepted , rejected ) , accepted , rejected
+    
+    # =========================================================================
+    ## Upgrade the preview to the full run: only the remaining files are processed
+    #  - without the preview all files are processed 
+    #  @return (efficiency, accepted, rejected) triplet for all files 
+    def upgrade ( self , progress = False , silent = False , parallel = False ) :
+        """ Upgrade the preview to the full run: only the remaining files are processed
+        - without the preview all files are processed 
+        - return (efficiency, accepted, rejected) triplet for all files 
+        """
+        problem = self.selection_problem ()
+        if problem : raise ValueError ( "upgrade: %s, use `process`" % problem )
+        
+        state = self.__preview
+        if state is None :
+            state = { 'seed'     : None , 'order'    : list ( self.__files ) , 'done' : 0 , 'entries' : 0 , 'time' : 0.0 , 
+                      'accepted' : None , 'rejected' : None }
+            self.__preview = state
+            
+        if parallel and not ROOT.ROOT.IsImplicitMTEnabled () : ROOT.ROOT.EnableImplicitMT()
+
+        nfiles = len ( state [ 'order' ] )
+        if not silent : logger.info ( 'Upgrade %s/%s/%s: %d files from preview, %d files to process' % ( self.__particle ,
+                                                                                                       self.__sample   ,
+                                                                                                       self.__magnet   ,
+                                                                                                       state [ 'done' ] ,
+                                                                                                       nfiles - state [ 'done' ] ) ) 
+        while state [ 'done' ] < nfiles : self.__preview_file ( state , progress = progress )
+        
+        accepted = state [ 'accepted' ].clone ()
+        rejected = state [ 'rejected' ].clone ()
+        return efficiency ( accepted , rejected ) , accepted , rejected
+
+    # =========================================================================
+    ## Fill the nominal and bootstrap replica histograms in a single pass
+    #  - (tree_path, files) units are processed sequentially or in parallel,
+    #    the Poisson weights use deterministic per-file seeds 
+    #  @code
+    #  efficiency , accepted , rejected , boot = request.process_bootstrap ( 100 , seed = 12345 )
+    #  @endcode
+    #  @param replicas number of Poisson bootstrap replicas
+    #  @param seed     the global seed for the bootstrap replicas 
+    #  @return (efficiency, accepted, rejected, Bootstrap) 
+    #  @see pidcalib.bootstrap.Bootstrap 
+    def process_bootstrap ( self , replicas , seed = 0 , progress = True , silent = False ,
+                            parallel = False , chunk_files = 1 , ncpus = None ) :
+        """ Fill the nominal and bootstrap replica histograms in a single pass
+        - (tree_path, files) units are processed sequentially or in parallel,
+          the Poisson weights use deterministic per-file seeds 
+        >>> efficiency , accepted , rejected , boot = request.process_bootstrap ( 100 , seed = 12345 )
+        - replicas : number of Poisson bootstrap replicas
+        - seed     : the global seed for the bootstrap replicas 
+        - return (efficiency, accepted, rejected, Bootstrap) 
+        - see pidcalib.bootstrap.Bootstrap 
+        """
+        assert isinstance ( replicas , int ) and 0 < replicas , "process_bootstrap: invalid `replicas` %s" % replicas 
+        problem = self.selection_problem ()
+        if problem : raise ValueError ( "process_bootstrap: %s" % problem )
+        units = self.units ( chunk_files )
+        if not silent : logger.info ( 'Processing: %s/%s/%s: %d units, %d bootstrap replicas' % ( self.__particle ,
+                                                                                                self.__sample   ,
+                                                                                                self.__magnet   ,
+                                                                                                len ( units )   ,
+                                                                                                replicas        ) )
+        task = BootstrapTask ( self.histogram () , self.variables () , self.__criterion , self.__cuts ,
+                               self.__sWeight , replicas = replicas , seed = seed , friends = self.__friends )
+        boot = _run_task ( task , units , parallel = parallel , progress = progress , silent = silent , ncpus = ncpus )
+        assert boot , "No partial results are produced!"
+        return boot.nominal () + ( boot , )
+    
+    # =========================================================================
+    ## Fill the accepted/rejected histograms file-by-file with the configured I/O
+    #  - only the branches used by the criterion, cuts, axes and sWeight are cached
+    #  - the next file is opened asynchronously 
+    #  @see pidcalib.chains.ChainIO
+    #  @return list with one (accepted, rejected) pair (empty if no files are read)
+    def __process_io ( self , io , tree_path , files , elists = None , progress = False , parallel = False ) :
+        """ Fill the accepted/rejected histograms file-by-file with the configured I/O
+        - only the branches used by the criterion, cuts, axes and sWeight are cached
+        - the next file is opened asynchronously 
+        - see pidcalib.chains.ChainIO
+        - return list with one (accepted, rejected) pair (empty if no files are read)
+        """
+        from ostap.stats.statvars import data_efficiency 
+        
+        expressions = [ self.__criterion , str ( self.__cuts ) , self.__sWeight ] + list ( self.variables () )
+        results     = [ None ] 
+        for tree in io.trees ( tree_path , files , *expressions ) :
+            if self.__friends and not self.__friends.attach ( tree , tree_path , tree.GetCurrentFile ().GetName () ) : continue 
+            if elists :
+                ## TTree::Project respects the entry list (the cuts are kept: they are cheap) 
+                fname = tree.GetCurrentFile ().GetName ()
+                tree.SetEntryList ( elists.entry_list ( fname , tree_path , self.__cuts ) )
+            _ , a , r = data_efficiency ( tree             ,
+                                          self.__criterion ,
+                                          self.histogram() ,
+                                          self.variables() ,
+                                          self.__cuts      ,
+                                          weight    = self.__sWeight ,
+                                          use_frame = False          ,
+                                          parallel  = parallel       ,
+                                          progress  = progress       )
+            _accumulate ( results , [ ( a , r ) ] )
+        return [ tuple ( results [ 0 ] ) ] if results [ 0 ] else []
+
+    # =========================================================================
+    ## Process (tree_path, file) units one-by-one with checkpointing
+    #  - the partials of the completed units are periodically written into the checkpoint file
+    #  - the completed units from the existing checkpoint are skipped and their partials are merged 
+    #  @code
+    #  efficiency , accepted , rejected = request.process_resume ( 'pions.ckpt' )
+    #  @endcode
+    #  @param resume      checkpoint file or <code>Checkpoint</code> instance 
+    #  @param entry_lists use persistent per-file entry lists for the selection:
+    #                     `True` for the default cache or `EntryListCache` instance 
+    #  @return (efficiency, accepted, rejected) triplet 
+    #  @see pidcalib.checkpoint.Checkpoint
+    def process_resume ( self , resume , progress = False , silent = False , parallel = False , entry_lists = None ) :
+        """ Process (tree_path, file) units one-by-one with checkpointing
+        - the partials of the completed units are periodically written into the checkpoint file
+        - the completed units from the existing checkpoint are skipped and their partials are merged 
+        >>> efficiency , accepted , rejected = request.process_resume ( 'pions.ckpt' )
+        - resume      : checkpoint file or `Checkpoint` instance 
+        - entry_lists : use persistent per-file entry lists for the selection:
+                        `True` for the default cache or `EntryListCache` instance 
+        - return (efficiency, accepted, rejected) triplet 
+        - see pidcalib.checkpoint.Checkpoint
+        """
+        if self.__friends and entry_lists :
+            logger.warning ( "process_resume: `entry_lists` is ignored for sWeight friend files" )
+            entry_lists = None
+            
+        ckpt   = resume if isinstance ( resume , Checkpoint ) else Checkpoint ( resume , self.identity () )
+        elists = EntryListCache () if entry_lists is True else entry_lists 
+        units  = self.units ( 1 )
+        if elists and parallel :
+            ## the parallel processing rebuilds the chains from the file names:
+            ## the entry lists are not propagated, do not build them at all 
+            logger.warning ( "process_resume: `entry_lists` is ignored for parallel processing" )
+            elists = None 
+        
+        if parallel and not ROOT.ROOT.IsImplicitMTEnabled () : ROOT.ROOT.EnableImplicitMT()
+        
+        from ostap.utils.progress_bar import progress_bar
+        from ostap.stats.statvars     import data_efficiency 
+        
+        results = [ None ]
+        nnew    = 0 
+        with ckpt :
+            for tree_path , files in progress_bar ( units , silent = not progress ) :
+                unit = tree_path , files [ 0 ]
+                pair = ckpt.get ( unit )
+                if pair is None :
+                    chain = calibration_chain ( tree_path , files , self.__friends )
+                    if elists :
+                        ## TTree::Project respects the entry list (the cuts are kept: they are cheap) 
+                        chain.SetEntryList ( elists.chain_list ( tree_path , files , self.__cuts ) )
+                    _ , a , r = data_efficiency ( chain            ,
+                                                  self.__criterion ,
+                                                  self.histogram() ,
+                                                  self.variables() ,
+                                                  self.__cuts      ,
+                                                  weight    = self.__sWeight ,
+                                                  use_frame = False          ,
+                                                  parallel  = parallel       ,
+                                                  progress  = False          )
+                    pair = a , r 
+                    ckpt.put ( unit , pair )
+                    nnew += 1
+                _accumulate ( results , [ pair ] )
+                
+        if not silent : logger.info ( 'Checkpoint %s: %d units are resumed, %d units are processed' % ( ckpt.fname ,
+                                                                                                     len ( units ) - nnew ,
+                                                                                                     nnew ) )
+        if results [ 0 ] is None :
+            accepted = self.histogram ().clone () ; accepted.Reset ()
+            rejected = self.histogram ().clone () ; rejected.Reset ()
+        else :
+            accepted , rejected = results [ 0 ]
+        return efficiency ( accepted , rejected ) , accepted , rejected
+
+    # =========================================================================
+    ## Fill the accepted/rejected histograms with the native NumPy backend
+    #  - only the used branches are read, file-by-file
+    #  - the expressions are evaluated as vectorized NumPy expressions,
+    #    the histograms are filled with weighted bincount
+    #  - (tree_path, file) units are processed sequentially or in the process pool 
+    #  @code
+    #  result = request.process_numpy ( parallel = True )
+    #  @endcode
+    #  @see pidcalib.vectorized
+    #  @return (efficiency, accepted, rejected) triplet or `None` if expressions cannot be translated
+    def process_numpy ( self , progress = False , silent = False , parallel = False , ncpus = None ) :
+        """ Fill the accepted/rejected histograms with the native NumPy backend
+        - only the used branches are read, file-by-file
+        - the expressions are evaluated as vectorized NumPy expressions,
+          the histograms are filled with weighted bincount
+        - (tree_path, file) units are processed sequentially or in the process pool 
+        >>> result = request.process_numpy ( parallel = True )
+        - see pidcalib.vectorized
+        - return (efficiency, accepted, rejected) triplet or `None` if expressions cannot be translated
+        """
+        histo = self.histogram ()
+        units = self.units ( 1 )
+        if units : 
+            tree_path , files = units [ 0 ]
+            chain   = calibration_chain ( tree_path , files , self.__friends )
+            problem = vectorizable ( chain , self.__sWeight , *self.variables () ,
+                                     selections = ( self.__criterion , str ( self.__cuts ) ) )
+            if problem :
+                logger.warning ( "process_numpy: %s, fall back to 'root' backend" % problem )
+                return None
+            
+        if not silent : logger.info ( 'Processing: %s/%s/%s: %d units, numpy backend' % ( self.__particle ,
+                                                                                        self.__sample   ,
+                                                                                        self.__magnet   ,
+                                                                                        len ( units )   ) ) 
+        task = NumpyTask ( histo , self.variables () , self.__criterion , self.__cuts , self.__sWeight , friends = self.__friends )
+        result = _run_task ( task , units , parallel = parallel , progress = progress , silent = silent , ncpus = ncpus )
+        if result is None :
+            accepted = histo.clone () ; accepted.Reset ()
+            rejected = histo.clone () ; rejected.Reset ()
+        else : 
+            accepted = to_histo ( histo , result [ 0 ] ) 
+            rejected = to_histo ( histo , result [ 1 ] ) 
+        return efficiency ( accepted , rejected ) , accepted , rejected 
     
     # =========================================================================
     ## Process the request 
@@ -345,12 +1361,56 @@ class PARTICLE (ABC)  :
     #  - accepted   : distribution for events accepted by criterion
     #  - rejected   : distribution for events rejected by criterion
     #
+    #  @param columns use local columnar cache: `True` for the default cache or `ColumnCache` instance
+    #  @param store   use persistent result store: `True` for the default store or `ResultStore` instance
+    #  @param incremental keep per-file partials and process only new/changed files:
+    #                     `True` for the default store or `PartialStore` instance 
+    #  @param concurrent  dispatch all (tree_path, files) units to one process pool 
+    #  @param entry_lists use persistent per-file entry lists for the selection:
+    #                     `True` for the default cache or `EntryListCache` instance 
+    #                     (ignored for `parallel`: the workers rebuild the chains) 
+    #  @param zones       skip files and clusters outside the histogram range or the cuts:
+    #                     `True` for the default zone maps or `ZoneMaps` instance 
+    #                     (the under/overflow bins miss the skipped entries;
+    #                     only the whole files are skipped for `parallel`) 
+    #  @param bootstrap   number of Poisson bootstrap replicas, filled in the same pass:
+    #                     the result is (efficiency, accepted, rejected, Bootstrap) 
+    #  @param seed        the global seed for the bootstrap replicas 
+    #  @param io          file-by-file reading with the tree cache for the used branches 
+    #                     and prefetch of the next file: `True` for the default or `ChainIO` instance
+    #  @param resume      checkpoint file (or `Checkpoint` instance) for the per-file partials:
+    #                     the completed units are skipped and their partials are merged 
+    #  @param backend     'root' (TTree formulae) or 'numpy' (vectorized NumPy expressions & bincount):
+    #                     `parallel` means the process pool for the 'numpy' backend  
+    #  - `bootstrap`, `resume` and `backend='numpy'` delegate to the dedicated entry points
+    #    <code>process_bootstrap</code>, <code>process_resume</code> and <code>process_numpy</code>;
+    #    TypeError is raised for the options that are not applicable to them 
     #  @see data_efficiency 
-    def process ( self              ,
-                  progress  = True  ,
-                  silent    = False , 
-                  use_frame = False ,
-                  parallel  = False ) :
+    #  @see pidcalib.columns.ColumnCache 
+    #  @see pidcalib.results.ResultStore
+    #  @see pidcalib.partials.PartialStore 
+    #  @see pidcalib.entries.EntryListCache 
+    #  @see pidcalib.zones.ZoneMaps 
+    #  @see pidcalib.bootstrap.Bootstrap 
+    #  @see pidcalib.chains.ChainIO 
+    #  @see pidcalib.checkpoint.Checkpoint 
+    #  @see pidcalib.vectorized 
+    def process ( self                ,
+                  progress    = True  ,
+                  silent      = False , 
+                  use_frame   = False ,
+                  parallel    = False ,
+                  columns     = None  ,
+                  store       = None  ,
+                  incremental = None  ,
+                  concurrent  = False ,
+                  entry_lists = None  ,
+                  zones       = None  ,
+                  bootstrap   = 0     ,
+                  seed        = 0     ,
+                  io          = None  ,
+                  resume      = None  ,
+                  backend     = 'root' ) :
         """ Process the samples
         
         The actual methdo that loops over calibration smaples and  produce a tripet of histograms
@@ -359,43 +1419,295 @@ class PARTICLE (ABC)  :
         - rejected   : distribution for events rejected by criterion
         
         see `data_efficiency` 
+        - columns     : use local columnar cache: `True` for the default cache or `ColumnCache` instance
+        - store       : use persistent result store: `True` for the default store or `ResultStore` instance
+        - incremental : keep per-file partials and process only new/changed files:
+                        `True` for the default store or `PartialStore` instance 
+        - concurrent  : dispatch all (tree_path, files) units to one process pool 
+        - entry_lists : use persistent per-file entry lists for the selection:
+                        `True` for the default cache or `EntryListCache` instance 
+                        (ignored for `parallel`: the workers rebuild the chains) 
+        - zones       : skip files and clusters outside the histogram range or the cuts:
+                        `True` for the default zone maps or `ZoneMaps` instance 
+                        (the under/overflow bins miss the skipped entries;
+                        only the whole files are skipped for `parallel`) 
+        - bootstrap   : number of Poisson bootstrap replicas, filled in the same pass:
+                        the result is (efficiency, accepted, rejected, Bootstrap) 
+        - seed        : the global seed for the bootstrap replicas 
+        - io          : file-by-file reading with the tree cache for the used branches 
+                        and prefetch of the next file: `True` for the default or `ChainIO` instance
+        - resume      : checkpoint file (or `Checkpoint` instance) for the per-file partials:
+                        the completed units are skipped and their partials are merged 
+        - backend     : 'root' (TTree formulae) or 'numpy' (vectorized NumPy expressions & bincount):
+                        `parallel` means the process pool for the 'numpy' backend  
+        - `bootstrap`, `resume` and `backend='numpy'` delegate to the dedicated entry points
+          `process_bootstrap`, `process_resume` and `process_numpy`;
+          TypeError is raised for the options that are not applicable to them 
         """
-        efficiency, accepted, rejected = None , None , None
+        assert backend in ( 'root' , 'numpy' ) , "process: invalid `backend` %s" % backend
+        
+        ## bootstrap replicas in the same pass: other options are not applicable 
+        if bootstrap :
+            _exclusive ( 'bootstrap'   , 'process_bootstrap' ,
+                         columns       = columns     ,
+                         store         = store       ,
+                         incremental   = incremental ,
+                         entry_lists   = entry_lists ,
+                         zones         = zones       ,
+                         io            = io          ,
+                         resume        = resume      )
+            return self.process_bootstrap ( bootstrap , seed = seed , progress = progress , silent = silent ,
+                                            parallel = parallel or concurrent ) 
+        
+        ## check the persistent result store first 
+        if store :
+            store  = ResultStore () if store is True else store
+            ident  = self.identity () 
+            ## zone maps drop the under/overflow entries of the skipped files and clusters:
+            ## the zone-reduced results are stored separately 
+            if zones : ident += ( ( 'zones' , tuple ( zones.branches ) if isinstance ( zones , ZoneMaps ) else ZONE_BRANCHES ) , )
+            key    = store.key ( ident )
+            result = store.get ( key )
+            if result is not None :
+                if not silent : logger.info ( 'Result for %s/%s/%s is taken from %s' % ( self.__particle ,
+                                                                                         self.__sample   ,
+                                                                                         self.__magnet   ,
+                                                                                         store           ) )
+                return result
+            result = self.process ( progress    = progress    ,
+                                    silent      = silent      ,
+                                    use_frame   = use_frame   ,
+                                    parallel    = parallel    ,
+                                    columns     = columns     ,
+                                    incremental = incremental ,
+                                    concurrent  = concurrent  ,
+                                    entry_lists = entry_lists ,
+                                    zones       = zones       ,
+                                    io          = io          ,
+                                    resume      = resume      ,
+                                    backend     = backend     )
+            store.put ( key , result , ident )
+            return result
+        
+        ## checkpointed per-file processing 
+        if resume :
+            _exclusive ( 'resume'      , 'process_resume' ,
+                         columns       = columns     ,
+                         incremental   = incremental ,
+                         concurrent    = concurrent  ,
+                         zones         = zones       ,
+                         io            = io          )
+            return self.process_resume ( resume , progress = progress , silent = silent ,
+                                         parallel = parallel , entry_lists = entry_lists ) 
+        
+        ## native NumPy backend 
+        if 'numpy' == backend :
+            _exclusive ( "backend='numpy'" , 'process_numpy' ,
+                         columns       = columns     ,
+                         incremental   = incremental ,
+                         entry_lists   = entry_lists ,
+                         zones         = zones       ,
+                         io            = io          )
+            result = self.process_numpy ( progress = progress , silent = silent , parallel = parallel or concurrent )
+            if result : return result
+            
+        ## use local columnar cache, per-file partials or concurrent processing:
+        ## the fills treat the selections as boolean, fall back to `data_efficiency` otherwise 
+        if columns or incremental or concurrent :
+            problem = self.selection_problem () 
+            if problem :
+                logger.warning ( "process: %s, `columns`, `incremental` and `concurrent` are ignored" % problem )
+                columns , incremental , concurrent = None , None , False 
+        if columns or incremental or concurrent :
+            return self.process_fills ( [ self.fill () ] ,
+                                        progress    = progress    ,
+                                        silent      = silent      ,
+                                        parallel    = parallel    ,
+                                        columns     = columns     ,
+                                        incremental = incremental ,
+                                        concurrent  = concurrent  ) [ 0 ]
+        
+        results = [ None ]
 
         from ostap.stats.statvars import data_efficiency 
 
         if use_frame and not ROOT.ROOT.IsImplicitMTEnabled () : ROOT.ROOT.EnableImplicitMT()
             
+        ## entry lists and zone maps are built from the calibration files alone
+        if self.__friends and ( entry_lists or zones ) :
+            logger.warning ( "process: `entry_lists` and `zones` are ignored for sWeight friend files" )
+            entry_lists , zones = None , None 
+            
+        ## persistent entry lists for the selection: TTree::Project respects them 
+        elists = EntryListCache () if entry_lists is True else entry_lists 
+        if elists and parallel :
+            ## the parallel processing rebuilds the chains from the file names:
+            ## the entry lists are not propagated, do not build them at all 
+            logger.warning ( "process: `entry_lists` is ignored for parallel processing" )
+            elists = None 
+        if elists and use_frame :
+            logger.warning ( "process: `use_frame` is ignored for entry lists" )
+            use_frame = False
+
+        ## configurable I/O: file-by-file with tree cache and prefetch 
+        io = ChainIO () if io is True else io 
+        if io and use_frame :
+            logger.warning ( "process: `use_frame` is ignored for `io`" )
+            use_frame = False
+            
+        ## zone maps: skip files and clusters that cannot contribute 
+        zmaps       = ZoneMaps () if zones is True else zones
+        constraints = zmaps.constraints ( self.histogram () , self.variables () , self.__cuts ) if zmaps else {}
+        clusters    = not parallel 
+        if constraints and parallel :
+            ## the parallel processing rebuilds the chains from the file names:
+            ## the cluster entry lists are not propagated, only the whole files are skipped  
+            logger.warning ( "process: `zones` skip only the whole files for parallel processing" )
+        
         ## explicit loop over the defiend paths 
         for tree_path in self.__tree_paths :
             
-            chain = ROOT.TChain ( tree_path )
-            for fname in self.__data['files'] : chain.Add  ( fname ) 
-            
             if not silent : logger.info ( 'Processing: %s/%s/%s:%s' % ( self.__particle ,
                                                                         self.__sample   ,
                                                                         self.__magnet   ,
                                                                         tree_path       ) ) 
+            files = self.__files
+            kept  = None
+            if constraints :
+                kept , skipped , total = zmaps.select ( tree_path , self.__files , constraints )
+                files = tuple ( f for f , _ in kept )
+                if not silent : logger.info ( 'Zone maps: %d/%d files are skipped, %.1f/%.1f MB are not read' % (
+                    len ( self.__files ) - len ( files ) , len ( self.__files ) , float ( skipped ) / MB , float ( total ) / MB ) ) 
+                if not files : continue
+
+            if io :
+                pairs = self.__process_io ( io , tree_path , files , elists , progress = progress , parallel = parallel )
+                _accumulate ( results , pairs )
+                continue
+            
+            chain = calibration_chain ( tree_path , files , self.__friends )
+
+            frame = use_frame 
+            if elists :
+                ## TTree::Project respects the entry list (the cuts are kept: they are cheap) 
+                elist = elists.chain_list ( tree_path , files , self.__cuts )
+                chain.SetEntryList ( elist )
+                if not silent : logger.info ( 'Entry list: %d/%d entries are selected' % ( elist.GetN () , len ( chain ) ) ) 
+            elif clusters and kept and any ( ranges for _ , ranges in kept ) :
+                ## skip the clusters: TTree::Project respects the entry list 
+                chain.SetEntryList ( ZoneMaps.entry_list ( tree_path , kept ) )
+                frame = False 
+                
             _ , a , r = data_efficiency ( chain            ,
                                           self.__criterion ,
                                           self.histogram() ,
                                           self.variables() ,
                                           self.__cuts      ,
                                           weight    = self.__sWeight ,
-                                          use_frame = use_frame      ,
+                                          use_frame = frame          ,
                                           parallel  = parallel       ,
                                           progress  = progress       )
             
-            if  accepted is None : accepted  = a
-            else                 : accepted += a
+            _accumulate ( results , [ ( a , r ) ] )
+
+        if io and not silent : logger.info ( 'I/O %s/%s/%s: %s' % ( self.__particle ,
+                                                                   self.__sample   ,
+                                                                   self.__magnet   ,
+                                                                   io.summary ()   ) )
+            
+        ## everything is skipped
+        accepted , rejected = results [ 0 ] if results [ 0 ] else ( None , None )
+        if accepted is None :
+            accepted = self.histogram ().clone () ; accepted.Reset ()
+            rejected = self.histogram ().clone () ; rejected.Reset ()
             
-            if  rejected is None : rejected  = r 
-            else                 : rejected += r
+        return efficiency ( accepted , rejected ) , accepted , rejected
+
 
-            efficiency = 1 / ( 1 + rejected / accepted )
+# =============================================================================
+## Process many requests: the requests are grouped by the calibration data
+#  and each group is processed in a single pass (each request with its own
+#  criterion, cuts, binning and variables)
+#  @code
+#  requests = [ PARTICLE_1D ( ... ) , PARTICLE_2D ( ... ) , PARTICLE_1D ( ... ) ]
+#  results  = process_requests ( requests , progress = True )
+#  for request , ( efficiency , accepted , rejected ) in zip ( requests , results ) : ...
+#  @endcode
+#
+#  With <code>run_graphs=True</code> all histogram fills for all groups and all tree paths
+#  are booked as lazy <code>RDataFrame</code> actions and executed together with
+#  <code>ROOT.RDF.RunGraphs</code>, so that small samples do not leave threads idle 
+#  @code
+#  results  = process_requests ( requests , run_graphs = True )
+#  @endcode
+#  @param requests   list of requests
+#  @param run_graphs execute all event loops together with <code>ROOT.RDF.RunGraphs</code>
+#  @param kwargs     other arguments are passed to <code>PARTICLE.process_fills</code>
+#  @return list of (efficiency, accepted, rejected) triplets in the order of requests 
+def process_requests ( requests , progress = True , silent = False , run_graphs = False , **kwargs ) :
+    """ Process many requests: the requests are grouped by the calibration data
+    and each group is processed in a single pass (each request with its own
+    criterion, cuts, binning and variables)
+    >>> requests = [ PARTICLE_1D ( ... ) , PARTICLE_2D ( ... ) , PARTICLE_1D ( ... ) ]
+    >>> results  = process_requests ( requests , progress = True )
+    >>> for request , ( efficiency , accepted , rejected ) in zip ( requests , results ) : ...
+    
+    With `run_graphs=True` all histogram fills for all groups and all tree paths
+    are booked as lazy `RDataFrame` actions and executed together with
+    `ROOT.RDF.RunGraphs`, so that small samples do not leave threads idle 
+    >>> results  = process_requests ( requests , run_graphs = True )
+    
+    - other arguments are passed to `PARTICLE.process_fills`
+    - return list of (efficiency, accepted, rejected) triplets in the order of requests 
+    """
+    requests = tuple ( requests )
+    for r in requests :
+        assert isinstance ( r , PARTICLE ) , "Invalid request type %s" % typename ( r )
+        if isinstance ( r , PARTICLE_ND ) :
+            raise TypeError ( "process_requests: PARTICLE_ND requests are not supported, use `PARTICLE_ND.process`" )
+
+    groups = {}
+    for i , r in enumerate ( requests ) :
+        groups.setdefault ( r.calibration_key , [] ).append ( i )
+
+    if not silent : logger.info ( 'Process %d requests in %d group(s)' % ( len ( requests ) , len ( groups ) ) )
+
+    results = [ None ] * len ( requests )
+    
+    if run_graphs :
+        
+        if kwargs : logger.warning ( "process_requests: arguments %s are ignored for `run_graphs`" % list ( kwargs.keys () ) ) 
+        if not ROOT.ROOT.IsImplicitMTEnabled () : ROOT.ROOT.EnableImplicitMT()
+        
+        ## book everything 
+        chains , jobs , owners = [] , [] , []  
+        for key , indices in groups.items () :
+            driver = requests [ indices [ 0 ] ]
+            fills  = [ requests [ i ].fill () for i in indices ]
+            for tree_path in driver.tree_paths :
+                chain = driver.chain ( tree_path )
+                chains.append ( chain ) ## keep the chains alive 
+                jobs  .append ( ( ROOT.RDataFrame ( chain ) , fills , driver.weight ) )
+                owners.append ( indices )
+                
+        if not silent : logger.info ( 'Run %d graphs together' % len ( jobs ) )
+        
+        ## run all event loops together 
+        partials = {}
+        for indices , pairs in zip ( owners , fill_graphs ( jobs ) ) :
+            _accumulate ( partials.setdefault ( tuple ( indices ) , [ None ] * len ( indices ) ) , pairs ) 
+            
+        for indices , pairs in partials.items () :
+            for i , ( a , r ) in zip ( indices , pairs ) : results [ i ] = efficiency ( a , r ) , a , r
             
-        return efficiency , accepted , rejected
+        return results
+    
+    for key , indices in groups.items () :
+        fills    = [ requests [ i ].fill () for i in indices ]
+        triplets = requests [ indices [ 0 ] ].process_fills ( fills , progress = progress , silent = silent , **kwargs )
+        for i , t in zip ( indices , triplets ) : results [ i ] = t
 
+    return results
 
 # =============================================================================
 ## @class PARTICLD_1D
@@ -413,13 +1725,15 @@ class PARTICLE_1D(PARTICLE):
                    magnet     ,
                    cuts       ,
                    histogram  ,
-                   xvar       ) :
+                   xvar       ,
+                   **kwargs   ) :
         
         super().__init__ ( particle   ,
                            criterion  ,
                            sample     ,
                            magnet     ,
-                           cuts       )
+                           cuts       ,
+                           **kwargs   )
         
         assert isinstance ( histogram , ROOT.TH1 ) and 1 == histogram.GetDimension() , \
             "Invalid histogram type %s" % typename ( histogram )
@@ -447,13 +1761,15 @@ class PARTICLE_2D(PARTICLE):
                    cuts       ,
                    histogram  ,
                    xvar       , 
-                   yvar       ) :
+                   yvar       ,
+                   **kwargs   ) :
         
         super().__init__ ( particle   ,
                            criterion  ,
                            sample     ,
                            magnet     ,
-                           cuts       )
+                           cuts       ,
+                           **kwargs   )
         
         assert isinstance ( histogram , ROOT.TH1 ) and 2 == histogram.GetDimension() , \
             "Invalid histogram type %s" % typename ( histogram )
@@ -483,13 +1799,15 @@ class PARTICLE_3D(PARTICLE):
                    histogram  ,
                    xvar       , 
                    yvar       , 
-                   zvar       ) :
+                   zvar       ,
+                   **kwargs   ) :
         
         super().__init__ ( particle   ,
                            criterion  ,
                            sample     ,
                            magnet     ,
-                           cuts       )
+                           cuts       ,
+                           **kwargs   )
         
         assert isinstance ( histogram , ROOT.TH1 ) and 3 == histogram.GetDimension() , \
             "Invalid histogram type %s" % typename ( histogram )
@@ -502,6 +1820,260 @@ class PARTICLE_3D(PARTICLE):
     def variables ( self ) : return self.__xvar  , self.__yvar, self.__zvar 
     def histogram ( self ) : return self.__histogram 
 
+# =============================================================================
+## @class PARTICLE_ND
+#  The actual function to produce N-dimensional efficiency with sparse storage,
+#  e.g. as function of P, eta, #trk and #PV
+#  - only non-empty bins are stored and merged 
+#  - the efficiency, accepted and rejected histograms are <code>THnSparseD</code>
+#  @code
+#  request = PARTICLE_ND ( 'Pi'                             , ## particle type 
+#                          'probe_MC15TuneV1_ProbNNpi>0.5'  , ## criterion to be tested
+#                          'Turbo18'                        , ## data sample
+#                          'up'                             , ## magnet polarity
+#                          ""                               , ## additional cuts
+#                          [ p_edges , eta_edges , ntrk_edges , npv_edges ] , ## bin edges (or THnSparse template)
+#                          [ 'log10(probe_P/1000)' , 'probe_ETA' , 'nTracks' , 'nPVs' ] ) ## axes 
+#  efficiency , accepted , rejected = request.process ( parallel = True )
+#  @endcode
+#  @see pidcalib.sparse.SparseHisto
+#  - the methods of <code>PARTICLE</code> that rely on <code>TH1</code> histograms (fills, identity, 
+#    preview, store, resume, bootstrap, ...) are not supported: <code>TypeError</code> is raised 
+class PARTICLE_ND(PARTICLE):
+    """ The actual function to produce N-dimensional efficiency with sparse storage,
+    e.g. as function of P, eta, #trk and #PV
+    - only non-empty bins are stored and merged 
+    - the efficiency, accepted and rejected histograms are `THnSparseD`
+    >>> request = PARTICLE_ND ( 'Pi'                             , ## particle type 
+    ...                         'probe_MC15TuneV1_ProbNNpi>0.5'  , ## criterion to be tested
+    ...                         'Turbo18'                        , ## data sample
+    ...                         'up'                             , ## magnet polarity
+    ...                         ""                               , ## additional cuts
+    ...                         [ p_edges , eta_edges , ntrk_edges , npv_edges ] , ## bin edges (or THnSparse template)
+    ...                         [ 'log10(probe_P/1000)' , 'probe_ETA' , 'nTracks' , 'nPVs' ] ) ## axes 
+    >>> efficiency , accepted , rejected = request.process ( parallel = True )
+    - see pidcalib.sparse.SparseHisto
+    - the methods of `PARTICLE` that rely on `TH1` histograms (fills, identity, 
+      preview, store, resume, bootstrap, ...) are not supported: `TypeError` is raised 
+    """
+    ## create the object
+    def __init__ ( self       ,
+                   particle   ,
+                   criterion  ,
+                   sample     ,
+                   magnet     ,
+                   cuts       ,
+                   edges      ,
+                   variables  ,
+                   **kwargs   ) :
+        
+        super().__init__ ( particle   ,
+                           criterion  ,
+                           sample     ,
+                           magnet     ,
+                           cuts       ,
+                           **kwargs   )
+
+        if isinstance ( edges , ROOT.THnBase ) : edges = sparse_edges ( edges )
+        variables = ( variables , ) if isinstance ( variables , str ) else tuple ( variables )
+        
+        assert 1 <= len ( variables ) and len ( edges ) == len ( variables ) , \
+            "Invalid number of axes: %d edges for %d variables" % ( len ( edges ) , len ( variables ) )
+        
+        self.__edges     = tuple ( tuple ( float ( x ) for x in e ) for e in edges )
+        self.__variables = variables 
+        
+    def variables ( self ) : return self.__variables 
+    def histogram ( self ) : return SparseHisto ( self.__edges ).empty () 
+
+    @property
+    def edges ( self ) :
+        """`edges` : bin edges for all axes"""
+        return self.__edges 
+
+    # =========================================================================
+    ## the methods of PARTICLE, that rely on TH1 histograms, are not supported 
+    def __unsupported ( self , what ) :
+        raise TypeError ( "PARTICLE_ND: `%s` is not supported for sparse N-dimensional requests" % what )
+    
+    def fill              ( self , *args , **kwargs ) : self.__unsupported ( 'fill'              )
+    def identity          ( self , *args , **kwargs ) : self.__unsupported ( 'identity'          )
+    def process_fills     ( self , *args , **kwargs ) : self.__unsupported ( 'process_fills'     )
+    def process_criteria  ( self , *args , **kwargs ) : self.__unsupported ( 'process_criteria'  )
+    def process_templates ( self , *args , **kwargs ) : self.__unsupported ( 'process_templates' )
+    def process_scan      ( self , *args , **kwargs ) : self.__unsupported ( 'process_scan'      )
+    def preview           ( self , *args , **kwargs ) : self.__unsupported ( 'preview'           )
+    def upgrade           ( self , *args , **kwargs ) : self.__unsupported ( 'upgrade'           )
+    def process_bootstrap ( self , *args , **kwargs ) : self.__unsupported ( 'process_bootstrap' )
+    def process_resume    ( self , *args , **kwargs ) : self.__unsupported ( 'process_resume'    )
+    def process_numpy     ( self , *args , **kwargs ) : self.__unsupported ( 'process_numpy'     )
+    
+    # =========================================================================
+    ## Process the request
+    #  - (tree_path, files) units are processed sequentially or in parallel,
+    #    the sparse partials are merged with pairwise (tree) reduction
+    #  @param parallel    parallel processing of units?
+    #  @param chunk_files number of files per unit 
+    #  @param ncpus       number of processes for parallel processing
+    #  @return (efficiency, accepted, rejected) triplet of <code>THnSparseD</code> histograms 
+    def process ( self                ,
+                  progress    = True  ,
+                  silent      = False ,
+                  parallel    = False ,
+                  chunk_files = 1     ,
+                  ncpus       = None  ,
+                  **kwargs            ) :
+        """ Process the request
+        - (tree_path, files) units are processed sequentially or in parallel,
+          the sparse partials are merged with pairwise (tree) reduction
+        - return (efficiency, accepted, rejected) triplet of `THnSparseD` histograms 
+        - other arguments of `PARTICLE.process` (store, resume, bootstrap, ...) are not supported 
+        """
+        unsupported = [ k for k , v in kwargs.items () if v ]
+        if unsupported : self.__unsupported ( 'process ( %s )' % ', '.join ( unsupported ) ) 
+        problem = self.selection_problem ()
+        if problem : raise ValueError ( "PARTICLE_ND.process: %s" % problem )
+        
+        units = self.units ( chunk_files )
+        if not silent : logger.info ( 'Processing: %s/%s/%s: %d units, %dD sparse' % ( self.particle , 
+                                                                                     self.sample   ,
+                                                                                     self.magnet   ,
+                                                                                     len ( units ) ,
+                                                                                     len ( self.__edges ) ) )
+        task = SparseTask ( self.__edges , self.__variables , self.criterion , self.cuts , self.weight , friends = self.friends )
+        partials = _run_task ( task , units , parallel = parallel , progress = progress , silent = silent , ncpus = ncpus )
+        assert partials , "No partial results are produced!"
+        accepted , rejected = tree_reduce ( partials , _merge_sparse )
+        
+        index , eff , var = SparseHisto.efficiency ( accepted , rejected )
+        efficiency = accepted._fill_root ( accepted.empty () , index , eff , var )
+        
+        return efficiency , accepted.THnSparse () , rejected.THnSparse ()
+
+# =============================================================================
+## @class AGGREGATE
+#  Aggregate request over lists of samples and magnet polarities, e.g. all Run-2 years
+#  - the component requests are <code>PARTICLE_1D</code>, <code>PARTICLE_2D</code> or <code>PARTICLE_3D</code>
+#    with the same particle, criterion, cuts, binning and variables
+#  - all (component, tree_path, files) units are processed concurrently in one pool
+#  - the partials are merged per component, the components are summed up 
+#  @code
+#  request = AGGREGATE ( PARTICLE_2D                         , ## component type 
+#                        'Pi'                                , ## particle type 
+#                        'probe_MC15TuneV1_ProbNNpi>0.5'     , ## criterion to be tested
+#                        [ 'Turbo16' , 'Turbo17' , 'Turbo18' ] , ## data samples
+#                        [ 'up' , 'down' ]                   , ## magnet polarities 
+#                        ''                                  , ## additional cuts
+#                        h2D                                 , ## template histogram 
+#                        'log10(probe_P/1000)' , 'probe_ETA' ) ## axes
+#  combined , components = request.process ( parallel = True )
+#  efficiency , accepted , rejected = combined 
+#  efficiency , accepted , rejected = components [ ( 'Turbo18' , 'up' ) ]
+#  @endcode
+class AGGREGATE(object) :
+    """ Aggregate request over lists of samples and magnet polarities, e.g. all Run-2 years
+    - the component requests are `PARTICLE_1D`, `PARTICLE_2D` or `PARTICLE_3D`
+      with the same particle, criterion, cuts, binning and variables
+    - all (component, tree_path, files) units are processed concurrently in one pool
+    - the partials are merged per component, the components are summed up 
+    >>> request = AGGREGATE ( PARTICLE_2D                         , ## component type 
+    ...                       'Pi'                                , ## particle type 
+    ...                       'probe_MC15TuneV1_ProbNNpi>0.5'     , ## criterion to be tested
+    ...                       [ 'Turbo16' , 'Turbo17' , 'Turbo18' ] , ## data samples
+    ...                       [ 'up' , 'down' ]                   , ## magnet polarities 
+    ...                       ''                                  , ## additional cuts
+    ...                       h2D                                 , ## template histogram 
+    ...                       'log10(probe_P/1000)' , 'probe_ETA' ) ## axes
+    >>> combined , components = request.process ( parallel = True )
+    >>> efficiency , accepted , rejected = combined 
+    >>> efficiency , accepted , rejected = components [ ( 'Turbo18' , 'up' ) ]
+    """
+    def __init__ ( self       ,
+                   klass      ,
+                   particle   ,
+                   criterion  ,
+                   samples    ,
+                   magnets    ,
+                   *args      ,
+                   **kwargs   ) :
+        
+        assert isinstance ( klass , type ) and issubclass ( klass , ( PARTICLE_1D , PARTICLE_2D , PARTICLE_3D ) ) , \
+            "AGGREGATE: invalid component type %s" % typename ( klass )
+        
+        samples = ( samples , ) if isinstance ( samples , str ) else tuple ( samples )
+        magnets = ( magnets , ) if isinstance ( magnets , str ) else tuple ( magnets )
+        assert samples and magnets , "AGGREGATE: empty list of samples/magnets!"
+        
+        self.__keys       = tuple ( ( s , m ) for s in samples for m in magnets )
+        self.__components = tuple ( klass ( particle , criterion , s , m , *args , **kwargs ) for s , m in self.__keys )
+
+    @property
+    def keys ( self ) :
+        """`keys` : (sample, magnet) pairs for all components"""
+        return self.__keys
+    
+    @property
+    def components ( self ) :
+        """`components` : the component requests"""
+        return self.__components
+    
+    # =========================================================================
+    ## Process all components concurrently in one pool
+    #  @param parallel    use the process pool? (otherwise the units are processed sequentially)
+    #  @param chunk_files number of files per unit 
+    #  @param ncpus       number of processes 
+    #  @return (combined, components) pair: the combined (efficiency, accepted, rejected) triplet
+    #          and the dictionary { (sample, magnet) : (efficiency, accepted, rejected) }
+    def process ( self                ,
+                  progress    = True  ,
+                  silent      = False ,
+                  parallel    = True  ,
+                  chunk_files = 1     ,
+                  ncpus       = None  ) :
+        """ Process all components concurrently in one pool
+        - parallel    : use the process pool? (otherwise the units are processed sequentially)
+        - chunk_files : number of files per unit 
+        - ncpus       : number of processes 
+        - return (combined, components) pair: the combined (efficiency, accepted, rejected) triplet
+          and the dictionary { (sample, magnet) : (efficiency, accepted, rejected) }
+        """
+        for c in self.__components :
+            problem = c.selection_problem ()
+            if problem : raise ValueError ( "AGGREGATE: %s" % problem )
+            
+        units = [ ( i , ) + u for i , c in enumerate ( self.__components ) for u in c.units ( chunk_files ) ]
+        if not silent : logger.info ( 'Processing: %s: %d components, %d units' % ( self.__components [ 0 ].particle ,
+                                                                                   len ( self.__components )        ,
+                                                                                   len ( units )                    ) )
+        task = MultiFillTask ( [ ( [ c.fill () ] , c.weight , c.friends ) for c in self.__components ] )
+        partials = _run_task ( task , units , parallel = parallel , progress = progress , silent = silent , ncpus = ncpus )
+        components = {}
+        accepted , rejected = None , None 
+        for i , ( key , c ) in enumerate ( zip ( self.__keys , self.__components ) ) :
+            if i in partials : 
+                a , r = tree_reduce ( partials [ i ] , merge_pairs ) [ 0 ]
+            else :
+                logger.warning ( "AGGREGATE: no data for %s/%s" % key )
+                a = c.histogram ().clone () ; a.Reset ()
+                r = c.histogram ().clone () ; r.Reset ()
+            components [ key ] = efficiency ( a , r ) , a , r
+            if accepted is None : accepted , rejected = a.clone () , r.clone ()
+            else :
+                accepted += a
+                rejected += r
+                
+        return ( efficiency ( accepted , rejected ) , accepted , rejected ) , components 
+
+# =============================================================================
+## Sparse merge of (accepted, rejected) pairs 
+def _merge_sparse ( first , second ) :
+    """ Sparse merge of (accepted, rejected) pairs
+    """
+    a , r  = first
+    a     += second [ 0 ]
+    r     += second [ 1 ]
+    return a , r 
+
 
 # ===================================================================================================
     
@@ -241,8 +241,10 @@ from   ostap.utils.basic        import typename
 from   ostap.utils.progress_bar import progress_bar
 from   ostap.parallel.task      import Task
 import ostap.utils.cleanup      as     CU 
+from   pidcalib.utils           import ( MB, rss, file_size, SharedArray,
+                                         used_branches, read_range, Throughput )
 import ostap.trees.trees
-import pidgen2, ROOT, numpy, random, re  
+import pidgen2, ROOT, numpy, random, re, os, time, hashlib  
 # =============================================================================
 assert (3,0,0,4) <= ostap_info , "OStap versiopm *MUST* be >= 3.0.0.4!"
 # =============================================================================
@@ -250,13 +252,101 @@ assert (3,0,0,4) <= ostap_info , "OStap versiopm *MUST* be >= 3.0.0.4!"
 # =============================================================================
 from   ostap.logger.logger import getLogger
 logger = getLogger ( 'ostap.tools.pidgen' )
+# =============================================================================
+## Default memory estimate for the single pidgen2 template, if not known 
+TEMPLATE_SIZE   = 250 * MB
+## Memory estimate for the (empty) worker process with python/ROOT/pidgen2 
+WORKER_OVERHEAD = 400 * MB
+## Minimal chunk size (in entries) for chunked processing 
+MIN_CHUNK       = 10000 
+## Default throughput (entries x requests per second per core), if not measured yet  
+DEFAULT_RATE    = 20000 
+# =============================================================================
+## cached pidgen2 sample registries: { 'data'/'mc' : samples }
+_samples  = {} 
+# =============================================================================
+## Get (cached) pidgen2 sample registry
+#  @see pidgen2.resampling.get_samples 
+#  @see pidgen2.resampling.get_mc_samples 
+def pidgen_samples ( mc = False ) :
+    """ Get (cached) pidgen2 sample registry
+    - see pidgen2.resampling.get_samples 
+    - see pidgen2.resampling.get_mc_samples 
+    """
+    key = 'mc' if mc else 'data'
+    if not key in _samples :
+        if mc : from pidgen2.resampling import get_mc_samples as get_the_samples 
+        else  : from pidgen2.resampling import get_samples    as get_the_samples
+        _samples [ key ] = get_the_samples ()
+    return _samples [ key ]
+# =============================================================================
+## cached file schemas: { ( file , path ) : ( signature , names ) } 
+_schemas  = {}
+## cached validity of expressions: { ( names , expression ) : good } 
+_formulas = {}
+# =============================================================================
+## Get the (cached) schema (branch & leaf names) for the tree in the file
+#  - the schema for local files is invalidated when the file is changed 
+#  - the schema for remote files (no signature) is not cached 
+def file_schema ( fname , path ) :
+    """ Get the (cached) schema (branch & leaf names) for the tree in the file
+    - the schema for local files is invalidated when the file is changed 
+    - the schema for remote files (no signature) is not cached 
+    """
+    try :
+        st        = os.stat ( fname )
+        signature = st.st_size , st.st_mtime
+    except OSError :
+        signature = None 
+    ##
+    key    = fname , path
+    cached = _schemas.get ( key , None )
+    if cached and cached [ 0 ] == signature : return cached [ 1 ]
+    ##
+    names = None 
+    rfile = ROOT.TFile.Open ( fname , 'READ' )
+    if rfile and not rfile.IsZombie () :
+        tree  = rfile.Get ( path )
+        if tree : 
+            names = frozenset ( [ b.GetName () for b in tree.GetListOfBranches () ] +
+                                [ l.GetName () for l in tree.GetListOfLeaves   () ] )
+        rfile.Close ()
+    ##
+    if names is None : return None
+    if not signature is None : _schemas [ key ] = signature , names
+    return names
+
+# =============================================================================
+## Get the schema (branch & leaf names) for the tree/chain
+#  - the schema of the first file is used for TChain (as ROOT does)  
+def tree_schema ( tree ) :
+    """ Get the schema (branch & leaf names) for the tree/chain
+    - the schema of the first file is used for TChain (as ROOT does)  
+    """
+    if isinstance ( tree , ROOT.TChain ) :
+        files = tree.files
+        return file_schema ( files [ 0 ] , tree.GetName () ) if files else None 
+    return frozenset ( [ b.GetName () for b in tree.GetListOfBranches () ] +
+                       [ l.GetName () for l in tree.GetListOfLeaves   () ] )
+
 # =============================================================================
 ## (good) variables in the tree ?
+#  - the validity of expressions is cached per tree schema 
 def vars_in_tree ( tree , *variables ) :
-    #
+    """ (good) variables in the tree ?
+    - the validity of expressions is cached per tree schema 
+    """
+    schema = tree_schema ( tree )
     for variable in variables :
-        if not variable in tree and not tree.good_variables ( variable.replace ( ':,' , '' ) ) :
-            logger.error ( "Variable `%s` is not in input dataset!" )
+        if schema and variable in schema : continue
+        key  = schema , variable 
+        good = _formulas.get ( key , None ) if schema else None 
+        if good is None :
+            good = variable in tree or tree.good_variables ( variable.replace ( ':,' , '' ) )
+            good = True if good else False 
+            if schema : _formulas [ key ] = good 
+        if not good : 
+            logger.error ( "Variable `%s` is not in input dataset!" % variable )
             return False
         ##
     return True 
@@ -282,6 +372,88 @@ Correct = namedtuple ( 'Correct'  , ( 'invar'    ,   ## input variable to be cor
                                       'eta'      ,   ## how to get eta 
                                       'ntrk'     ) ) ## how to get number of tracks )
 # ===============================================================================
+## Convert the source of #ntrk distribution into arrays
+#  - 1D-histogram: ( True  , [ low edges , high edges , contents ] ), 
+#    negative contents and x<0 are ignored 
+#  - sequence    : ( False , values )
+def ntrk_arrays ( obj ) :
+    """ Convert the source of #ntrk distribution into arrays
+    - 1D-histogram: ( True  , [ low edges , high edges , contents ] ), 
+      negative contents and x<0 are ignored 
+    - sequence    : ( False , values )
+    """
+    if isinstance ( obj , ROOT.TH1 ) :
+        axis     = obj.GetXaxis ()
+        nbins    = axis.GetNbins () 
+        low      = numpy.array ( [ axis.GetBinLowEdge ( i ) for i in range ( 1 , nbins + 1 ) ] , dtype = numpy.float64 )
+        high     = numpy.array ( [ axis.GetBinUpEdge  ( i ) for i in range ( 1 , nbins + 1 ) ] , dtype = numpy.float64 )
+        contents = numpy.array ( [ obj.GetBinContent  ( i ) for i in range ( 1 , nbins + 1 ) ] , dtype = numpy.float64 )
+        ## ignore negative contents and x<0 
+        contents [ ( contents < 0 ) | ( high <= 0 ) ] = 0
+        low      = numpy.maximum ( low , 0 ) 
+        return True , numpy.stack ( [ low , high , contents ] ) 
+    return False , numpy.asarray ( obj , dtype = numpy.float64 )
+
+# ===============================================================================
+## Sample #ntrk array of length N from the arrays
+#  - the same implementation for the sequential and the parallel processing 
+#  - the random seed is taken from `random`, e.g. set via `random_random`
+#  @see ntrk_arrays 
+def ntrk_sample ( histo , data , N ) :
+    """ Sample #ntrk array of length N from the arrays
+    - the same implementation for the sequential and the parallel processing 
+    - the random seed is taken from `random`, e.g. set via `random_random`
+    - see ntrk_arrays 
+    """
+    rng  = numpy.random.default_rng ( random.getrandbits ( 64 ) )
+    if histo :
+        low , high , contents = data
+        index  = rng.choice   ( len ( contents ) , size = N , p = contents / contents.sum () )
+        values = rng.uniform  ( low [ index ] , high [ index ] ) 
+    else :
+        values = rng.choice   ( data , size = N ) 
+    return values.astype ( numpy.int64 ).astype ( numpy.uint16 )
+
+# ===============================================================================
+## @class NtrkSource
+#  Light-weight handle to the (validated) source of #ntrk distribution:
+#  1D-histogram or sequence of non-negative numbers
+#  - the content is published once via memory-mapped file
+#  - the parallel tasks carry only this handle 
+#  @see SharedArray 
+class NtrkSource(object) :
+    """ Light-weight handle to the (validated) source of #ntrk distribution:
+    1D-histogram or sequence of non-negative numbers
+    - the content is published once via memory-mapped file
+    - the parallel tasks carry only this handle 
+    - see SharedArray 
+    """
+    def __init__ ( self , obj , arrays = None ) :
+        
+        histo , data = arrays if arrays else ntrk_arrays ( obj )
+        self.__histo = histo 
+        self.__data  = SharedArray ( data ) 
+
+    @property
+    def histo ( self ) :
+        """`histo` : the source is a histogram?"""
+        return self.__histo
+    
+    # =========================================================================
+    ## Sample #ntrk array of length N
+    #  - the random seed is taken from `random`, e.g. set via `random_random`
+    #  @see ntrk_sample 
+    def sample ( self , N ) :
+        """ Sample #ntrk array of length N 
+        - the random seed is taken from `random`, e.g. set via `random_random`
+        - see ntrk_sample 
+        """
+        return ntrk_sample ( self.__histo , self.__data.array , N ) 
+    
+    def __repr__ ( self ) :
+        return 'NtrkSource(%s,%s)' % ( 'histo' if self.__histo else 'data' , self.__data ) 
+    
+# ===============================================================================
 ## @class PidBase
 #  Helper base class for PidGen & PidCorr
 #  It provided some purely technical methods
@@ -311,6 +483,8 @@ class PidBase(object) :
         kw.update ( kwargs )
         self.__nTrk_name = nTrk_name 
         self.__kwargs    = kw
+        ## published #ntrk sources: { ( histo , content digest ) : NtrkSource }
+        self.__published = {}
         
         if not 'local_storage' in kwargs :
             dir1 = CU.CleanUp.tempdir ( prefix = 'ostap-PIDGEN2-templates-'    )
@@ -363,24 +537,24 @@ class PidBase(object) :
 
     # ==========================================================================
     ## Check existence/validity of sample/dataset combination
+    #  - the sample registries are cached 
     #  @see pidgen2.resampling.get_samples 
     @classmethod 
     def check_requests ( klass , requests , simversion  = '' ) :
         """ Check existence/validity  of sample/dataset combination         
+        - the sample registries are cached 
         - see pidgen2.resampling.get_samples 
         """
         requests = klass.requests ( requests )
         ## 
-        from pidgen2.resampling import get_samples 
-        samples = get_samples()
+        samples = pidgen_samples ()
         for r in requests :
             the_sample = samples.get ( r.sample , None )
             assert the_sample and r.dataset in the_sample , \
                 "Invalid/non-existing sample/dataset: %s/%s" % ( r.sample , r.dataset )
             
         if simversion :
-            from pidgen2.resampling import get_mc_samples 
-            samples = get_mc_samples()
+            samples = pidgen_samples ( mc = True ) 
             for r in requests :
                 the_sample = samples.get ( r.sample , None )
                 ds = '%s_%s' % ( simversion , r.dataset )
@@ -395,8 +569,10 @@ class PidBase(object) :
         """ Check a single request
         """
         if not vars_in_tree ( tree , request.pt , request.eta ) : return False
-        if request.outvar in tree :
-            logger.error ( 'Variable %s already in the ROOT.TTree!' % r.outvar )
+        schema = tree_schema ( tree )
+        names  = schema if schema else tree 
+        if request.outvar in names :
+            logger.error ( 'Variable %s already in the ROOT.TTree!' % request.outvar )
             return False
 
         if isinstance ( request.ntrk , string_types ) :
@@ -406,7 +582,7 @@ class PidBase(object) :
             logger.error ( 'Wrong `ntrk` specification: %s ' % typename ( request.ntrk ) ) 
             return False
 
-        if self.nTrk_name and self.nTrk_name in tree :
+        if self.nTrk_name and self.nTrk_name in names :
             logger.error ( 'Variable %s already in the ROOT.TTree!' % self.nTrk_name )
             return False 
 
@@ -438,9 +614,44 @@ class PidBase(object) :
         - 1D-histo with specific setting 
         - sequence of non-negative numbers 
         """
-        if isinstance ( obj , ROOT.TH1 ) : return self.sampling_histo (  obj )
-        ## otherwise some non-empty sequnce of non-negative numbers 
-        return obj and 10 <= len ( obj ) and isinstance ( obj , sequence_types ) and all ( 0 < int ( v ) for v in obj )
+        ## published sources are validated already 
+        if isinstance ( obj , NtrkSource ) : return True
+        
+        if isinstance ( obj , ROOT.TH1 ) : return True if self.sampling_histo (  obj ) else False 
+        
+        ## otherwise some non-empty sequnce of non-negative numbers (vectorized check)
+        if not isinstance ( obj , sequence_types ) or len ( obj ) < 10 : return False
+        try : 
+            data = numpy.asarray ( obj , dtype = numpy.float64 )
+        except ( TypeError , ValueError ) :
+            return False 
+        return 1 == data.ndim and bool ( numpy.all ( 0 < data.astype ( numpy.int64 ) ) ) 
+
+    # =========================================================================
+    ## Publish the #ntrk sources (histograms & sequences) for the requests:
+    #  the sources are replaced by the light-weight handles
+    #  @see NtrkSource
+    def publish ( self , requests ) :
+        """ Publish the #ntrk sources (histograms & sequences) for the requests:
+        the sources are replaced by the light-weight handles
+        - see NtrkSource
+        """
+        result = []
+        for r in self.requests ( requests ) :
+            ntrk = r.ntrk 
+            if isinstance ( ntrk , string_types + ( NtrkSource , ) ) :
+                result.append ( r )
+                continue
+            assert self.good_for_sampling ( ntrk ) , "Wrong `ntrk` specification: %s " % typename ( ntrk ) 
+            ## the same content is published only once 
+            histo , data = ntrk_arrays ( ntrk )
+            key    = histo , hashlib.sha1 ( numpy.ascontiguousarray ( data ).tobytes () ).hexdigest () 
+            source = self.__published.get ( key , None )
+            if source is None : 
+                source = NtrkSource ( ntrk , arrays = ( histo , data ) )
+                self.__published [ key ] = source 
+            result.append ( r._replace ( ntrk = source ) )
+        return tuple ( result ) 
 
     # =========================================================================
     ## Generate/sample #ntr array of length N 
@@ -448,32 +659,384 @@ class PidBase(object) :
         """ Generate/sample #ntr array of length N 
         """
         if not self.good_for_sampling ( ntrk ) : return None
-        ## 
-        if self.sampling_histo ( ntrk ) :
-            sample = tuple ( int ( v ) for v in ntrk.shoot     ( N , lambda s : 0 < s ) )
-        else :
-            sample = tuple ( int ( v ) for v in random.choices ( ntrk , k = N ) )
-        
-        return numpy.asarray ( sample , dtype = numpy.uint16 )
+        ## the same implementation as for the parallel processing 
+        if isinstance ( ntrk , NtrkSource ) : return ntrk.sample ( N ) 
+        return ntrk_sample ( *ntrk_arrays ( ntrk ) , N ) 
         
     # =========================================================================
-    ## Get data from a single tree 
-    def get_data ( self , tree , *vars , ntrk = None ) :
+    ## Get data from a single tree
+    #  @param tree (INPUT) the tree
+    #  @param vars (INPUT) variables to get
+    #  @param ntrk (INPUT) #ntrk: expression or array (for selected entries)
+    #  @param cuts (INPUT) selection of entries 
+    #  @param first (INPUT) the first entry
+    #  @param last  (INPUT) the last entry (exclusive), negative for all entries;
+    #                       only the entries in the range are read 
+    def get_data ( self , tree , *vars , ntrk = None , cuts = '' , first = 0 , last = -1 ) :
         """ Get data from a single tree 
+        - tree  (INPUT) the tree
+        - vars  (INPUT) variables to get
+        - ntrk  (INPUT) #ntrk: expression or array (for selected entries)
+        - cuts  (INPUT) selection of entries 
+        - first (INPUT) the first entry
+        - last  (INPUT) the last entry (exclusive), negative for all entries;
+                        only the entries in the range are read 
         """
+        N = len ( tree ) 
+        if last < 0 or N < last : last = N
+        
+        def _slice ( variables ) :
+            if 0 == first and N <= last :
+                data , _ = tree.slice ( variables , cuts , structured = False , transpose = True )
+                return data 
+            return read_range ( tree , variables , first , last , cuts ) 
+        
         ## number of entries
         if ntrk is None : 
-            data , _ = tree.slice ( [ v for v in vars ] ,            structured = False , transpose = True ) 
+            data = _slice ( [ v for v in vars ]            ) 
         elif isinstance ( ntrk , string_types  ) and tree.good_variables ( ntrk ) :
-            data , _ = tree.slice ( [ v for v in vars ] + [ ntrk ] , structured = False , transpose = True )
-        elif isinstance ( ntrk , numpy.ndarray ) and len ( ntrk ) == len ( tree ) :
-            data , _ = tree.slice ( [ v for v in vars ] ,            structured = False , transpose = True ) 
+            data = _slice ( [ v for v in vars ] + [ ntrk ] ) 
+        elif isinstance ( ntrk , numpy.ndarray ) :
+            data = _slice ( [ v for v in vars ]            ) 
+            if len ( ntrk ) != len ( data ) :
+                raise  TypeError ( "get_data: invalid length for `ntrk` : %s != %s" % ( len ( ntrk ) , len ( data ) ) )
             data     = numpy.column_stack ( [ data , ntrk ] )
         else :
             raise  TypeError ( "get_data: invalid type  for `ntrk` : %s" % typename ( ntrk ) )
 
         return data
     
+    # =========================================================================
+    ## Split N entries into the ranges of (at most) `chunk_size` entries 
+    @staticmethod
+    def ranges ( N , chunk_size = -1 ) :
+        """ Split N entries into the ranges of (at most) `chunk_size` entries 
+        """
+        if chunk_size <= 0 or N <= chunk_size : return ( 0 , N ) ,
+        return tuple ( ( first , min ( first + chunk_size , N ) ) for first in range ( 0 , N , chunk_size ) )
+    
+    # =========================================================================
+    ## Get the indices of entries that pass the cuts (`None` for no cuts)
+    @staticmethod
+    def selection ( tree , cuts = '' ) :
+        """ Get the indices of entries that pass the cuts (`None` for no cuts)
+        """
+        cuts = str ( cuts ).strip () if cuts else ''
+        if not cuts : return None
+        index , _ = tree.slice ( [ 'Entry$' ] , cuts , structured = False , transpose = True )
+        return numpy.asarray ( index , dtype = numpy.int64 ).reshape ( -1 ) 
+
+    # =========================================================================
+    ## Selected entries within the given range (`None` for no selection) 
+    @staticmethod
+    def selected ( index , first , last ) :
+        """ Selected entries within the given range (`None` for no selection) 
+        """
+        if index is None : return None
+        return index [ ( first <= index ) & ( index < last ) ]
+
+    # =========================================================================
+    ## Merge the chunks and expand the results for selected entries to all 
+    #  entries of the tree, filling the unselected entries with `nan` value
+    def expand ( self , chunks , index , N ) :
+        """ Merge the chunks and expand the results for selected entries to all 
+        entries of the tree, filling the unselected entries with `nan` value
+        """
+        chunks = [ c for c in chunks if not c is None ]
+        result = chunks [ 0 ] if 1 == len ( chunks ) else numpy.concatenate ( chunks ) if chunks else numpy.empty ( 0 )
+        if index is None : return result
+        full = numpy.full ( N , self.kwargs.get ( 'nan' , -1 ) , dtype = numpy.float64 )
+        full [ index ] = result
+        return full
+
+    # =========================================================================
+    ## Helper method to unpack the input bunches:
+    #  - ( tree , requests ) or ( tree , requests , cuts ) 
+    #  @return the sequence of ( tree , requests , cuts ) triplets 
+    @classmethod
+    def bunches ( klass , the_requests ) :
+        """ Helper method to unpack the input bunches:
+        - ( tree , requests ) or ( tree , requests , cuts ) 
+        - return the sequence of ( tree , requests , cuts ) triplets 
+        """
+        result = []
+        for bunch in the_requests :
+            assert isinstance ( bunch , sequence_types ) and len ( bunch ) in ( 2 , 3 ) , \
+                "Invalid bunch type/length: %s" % typename ( bunch )
+            tree , requests = bunch [ : 2 ]
+            cuts = str ( bunch [ 2 ] ).strip () if 3 == len ( bunch ) and bunch [ 2 ] else ''
+            result.append ( ( tree , requests , cuts ) )
+        return tuple ( result ) 
+    
+    # =========================================================================
+    ## Memory estimate for the pidgen2 template(s) for the given request
+    #  - the sizes of the files in the local template storage are used, if found  
+    #  - otherwise `TEMPLATE_SIZE` is used 
+    def template_size ( self , request ) :
+        """ Memory estimate for the pidgen2 template(s) for the given request
+        - the sizes of the files in the local template storage are used, if found  
+        - otherwise `TEMPLATE_SIZE` is used 
+        """
+        size = 0 
+        for storage in ( 'local_storage' , 'local_mc_storage' ) :
+            dirname = self.kwargs.get ( storage , '' )
+            if not dirname or not os.path.isdir ( dirname ) : continue
+            for fname in os.listdir ( dirname ) :
+                if request.sample in fname and request.dataset in fname :
+                    size += file_size ( os.path.join ( dirname , fname ) )
+        return size if size else TEMPLATE_SIZE 
+
+    # =========================================================================
+    ## Memory estimate for processing of the (single-file) tree
+    #  @return fixed (entry-independent) and variable (entry-dependent) parts 
+    def memory_parts ( self , tree , requests ) :
+        """ Memory estimate for processing of the (single-file) tree
+        - return fixed (entry-independent) and variable (entry-dependent) parts 
+        """
+        requests  = self.requests ( requests )
+        N         = len ( tree )
+        ## input data: sliced & transposed arrays, output arrays and sampled #ntrk 
+        variable  = N * ( 2 * 8 * self.NCOLS + 8 * len ( requests ) + 2 )
+        ## templates are loaded one-by-one 
+        templates = max ( self.template_size ( r ) for r in requests ) if requests else 0 
+        return WORKER_OVERHEAD + templates , variable 
+        
+    # =========================================================================
+    ## Memory estimate for processing of the (single-file) tree
+    def memory_estimate ( self , tree , requests ) :
+        """ Memory estimate for processing of the (single-file) tree
+        """
+        return sum ( self.memory_parts ( tree , requests ) )
+
+    # =========================================================================
+    ## Chunk size (in entries) needed to keep the memory within the budget
+    #  @return chunk size, negative for no chunking 
+    def chunk_size ( self , tree , requests , budget ) :
+        """ Chunk size (in entries) needed to keep the memory within the budget
+        - return chunk size, negative for no chunking 
+        """
+        fixed , variable = self.memory_parts ( tree , requests )
+        if fixed + variable <= budget : return -1
+        N    = len ( tree ) 
+        free = budget - fixed
+        if free <= 0 :
+            logger.warning ( 'Memory budget %.0fMB is too small, use minimal chunks' % ( budget / MB ) )
+            return MIN_CHUNK 
+        return max ( MIN_CHUNK , int ( N * free / variable ) )
+    
+    # =========================================================================
+    ## Get the metadata for the tree in the file, no baskets are read
+    #  @return number of entries and compressed size of branches used by expressions 
+    @staticmethod
+    def file_metadata ( fname , path , *expressions ) :
+        """ Get the metadata for the tree in the file, no baskets are read
+        - return number of entries and compressed size of branches used by expressions 
+        """
+        rfile = ROOT.TFile.Open ( fname , 'READ' )
+        if not rfile or rfile.IsZombie () :
+            logger.warning ( "Cannot open file %s" % fname )
+            return 0 , 0
+        try :
+            tree = rfile.Get ( path )
+            if not tree : 
+                logger.warning ( "No tree %s in file %s" % ( path , fname ) )
+                return 0 , 0
+            names    = set ( b.GetName () for b in tree.GetListOfBranches () ) | \
+                       set ( l.GetName () for l in tree.GetListOfLeaves   () ) 
+            branches = [ tree.GetBranch ( b ) for b in used_branches ( names , *expressions ) ]
+            nbytes   = sum ( b.GetZipBytes ( '*' ) for b in branches if b )
+            return tree.GetEntries () , nbytes
+        finally :
+            rfile.Close ()
+            
+    # =========================================================================
+    ## Dry-run planner: estimate the cost of processing without processing
+    #  - the requests are validated in the same way as for `process`
+    #  - only file metadata are inspected, no baskets are read
+    #  - the wall time is estimated from the throughput, measured in previous runs 
+    #  @code
+    #  pgen = PidGen ( ... )
+    #  pgen.plan    ( requests , ncpus = 16 ) 
+    #  pgen.process ( requests , ... ) 
+    #  @endcode
+    #  @param the_requests  (INPUT) the same as for `process`
+    #  @param ncpus         (INPUT) number of cores for the parallel processing
+    #  @return summary of the cost estimates 
+    def plan ( self , the_requests , * , ncpus = None , silent = False ) :
+        """ Dry-run planner: estimate the cost of processing without processing
+        - the requests are validated in the same way as for `process`
+        - only file metadata are inspected, no baskets are read
+        - the wall time is estimated from the throughput, measured in previous runs 
+        >>> pgen = PidGen ( ... )
+        >>> pgen.plan    ( requests , ncpus = 16 ) 
+        >>> pgen.process ( requests , ... ) 
+        """
+        the_requests = self.bunches ( the_requests )
+        if not isinstance ( ncpus , int ) or ncpus <= 0 : ncpus = os.cpu_count ()
+        
+        key       = self.__class__.__name__ 
+        rate      = Throughput.rate ( key , -1 ) 
+        measured  = 0 < rate
+        if not measured : rate = DEFAULT_RATE
+        
+        templates = set ()
+        chains    = []
+        for tree , requests , cuts in the_requests :
+            
+            ## the same checks as for `process`
+            assert isinstance ( tree , ROOT.TTree ) , "Invalid type for `tree` %s" % typename ( tree )
+            reqs = self.requests ( requests )
+            assert self.check_requests ( reqs , self.kwargs.get ( 'simversion' , '' ) ) , "Invalid/non-exising requests!"
+            if any ( not self.check_request ( tree , r ) for r in reqs ) : return None 
+            if cuts and not vars_in_tree ( tree , cuts ) : return None 
+            
+            templates |= set ( ( r.sample , r.dataset , r.variable ) for r in reqs )
+            
+            expressions = [ cuts ]
+            for r in reqs :
+                expressions += [ getattr ( r , 'invar' , '' ) , r.pt , r.eta ]
+                if isinstance ( r.ntrk , string_types ) : expressions.append ( r.ntrk )
+                
+            path    = tree.fullpath
+            entries = [] 
+            nread   = 0
+            for fname in tree.files :
+                n , b = self.file_metadata ( fname , path , *expressions )
+                entries.append ( n )
+                nread += b
+
+            ## number of new branches
+            nout   = len ( reqs ) 
+            if self.nTrk_name and any ( not isinstance ( r.ntrk , string_types ) for r in reqs ) : nout += 1
+            
+            ## processing time per file 
+            work   = [ n * len ( reqs ) / rate for n in entries ] 
+            wall   = max ( sum ( work ) / max ( 1 , min ( ncpus , len ( work ) ) ) , max ( work ) ) if work else 0
+            
+            chains.append ( { 'chain'    : path                    ,
+                              'files'    : len ( entries )         ,
+                              'entries'  : sum ( entries )         ,
+                              'requests' : len ( reqs )            ,
+                              'read'     : nread                   ,
+                              'write'    : sum ( entries ) * 8 * nout ,
+                              'cpu'      : sum ( work )            ,
+                              'wall'     : wall                    } )
+
+        summary = { 'templates' : len ( templates ) ,
+                    'rate'      : rate              ,
+                    'measured'  : measured          ,
+                    'ncpus'     : ncpus             ,
+                    'chains'    : chains            }
+        for k in ( 'files' , 'entries' , 'read' , 'write' , 'cpu' , 'wall' ) :
+            summary [ k ] = sum ( c [ k ] for c in chains )
+            
+        if not silent :
+            rows = [ ( '#' , 'Chain' , '#files' , '#entries' , '#requests' , 'read [MB]' , 'write [MB]' , 'CPU [s]' , 'wall [s]' ) ]
+            for i , c in enumerate ( chains , start = 1 ) :
+                rows.append ( ( '%d' % i , c [ 'chain' ] , '%d' % c [ 'files' ] , '%d' % c [ 'entries' ] , '%d' % c [ 'requests' ] ,
+                                '%.1f' % ( c [ 'read'  ] / MB ) , '%.1f' % ( c [ 'write' ] / MB ) ,
+                                '%.0f' % c [ 'cpu' ] , '%.0f' % c [ 'wall' ] ) )
+            rows.append ( ( '' , 'Total' , '%d' % summary [ 'files' ] , '%d' % summary [ 'entries' ] , '' ,
+                            '%.1f' % ( summary [ 'read'  ] / MB ) , '%.1f' % ( summary [ 'write' ] / MB ) ,
+                            '%.0f' % summary [ 'cpu' ] , '%.0f' % summary [ 'wall' ] ) )
+            title = '%s plan: %d distinct templates, %s throughput %.0f/s, %d cores' % (
+                key , len ( templates ) , 'measured' if measured else 'default' , rate , ncpus )
+            import ostap.logger.table as T
+            table = T.table ( rows , title = title , prefix = '# ' , alignment = 'rlrrrrrrr' )
+            logger.info ( '%s:\n%s' % ( title , table ) )
+            
+        return summary 
+            
+    # =========================================================================
+    ## Parallel processing of the (multi-file) chain, one file per job
+    #  - if the memory budget (in MB) is specified, the files are processed
+    #    by `WorkManager` in batches: the memory estimates of the files
+    #    in the batch fit into the budget, left after the actual resident
+    #    memory of the current process, re-measured before each batch 
+    #  - files that cannot fit into the budget are processed in chunked mode
+    def run_parallel ( self              ,
+                       chain             ,
+                       requests          , * , 
+                       progress      = True  ,
+                       silent        = False ,
+                       cuts          = ''    , 
+                       memory_budget = -1    , **kwargs ) :
+        """ Parallel processing of the (multi-file) chain, one file per job
+        - if the memory budget (in MB) is specified, the files are processed
+          by `WorkManager` in batches: the memory estimates of the files
+          in the batch fit into the budget, left after the actual resident
+          memory of the current process, re-measured before each batch 
+        - files that cannot fit into the budget are processed in chunked mode
+        """
+        ## publish the heavy #ntrk sources & create the task for the paralell processing
+        task  = PidTask ( self , self.publish ( requests ) , cuts )
+            
+        from ostap.trees.utils import Chain
+        ch    = Chain    ( chain )    
+        trees = ch.split ( chunk_size = -1 , max_files = 1  )
+    
+        from   ostap.parallel.parallel import WorkManager
+        if not memory_budget or memory_budget <= 0 :
+            wmgr   = WorkManager ( silent = silent , progress = progress , **kwargs )
+            wmgr.process ( task , trees )
+            ## record the throughput for the planning (in the parent process only)
+            Throughput.update ( self.__class__.__name__ , *task.results () )
+            return
+        
+        ## memory-aware scheduling 
+        assert rss () < memory_budget * MB , "Memory budget %sMB is already exhausted!" % memory_budget
+        
+        ncpus  = kwargs.pop ( 'ncpus' , None )
+        if not isinstance ( ncpus , int ) or ncpus <= 0 : ncpus = os.cpu_count () 
+
+        sizes     = [ self.memory_estimate ( t.chain , requests ) for t in trees ]
+        ## the largest files first 
+        pending   = sorted ( range ( len ( trees ) ) , key = lambda i : sizes [ i ] , reverse = True )
+        oversized = []
+        items , seconds = 0 , 0.0 
+        while pending :
+            ## the actual resident memory of the current process
+            budget = memory_budget * MB - rss ()
+            batch  = []
+            used   = 0 
+            for i in pending :
+                if ncpus <= len ( batch ) : break 
+                if budget < used + sizes [ i ] : continue
+                batch.append ( i )
+                used += sizes [ i ]
+            ## nothing fits into the budget: the rest is processed in chunked mode 
+            if not batch :
+                oversized = pending
+                break 
+            pending = [ i for i in pending if not i in batch ]
+            if not silent :
+                logger.info ( 'Memory budget %.0fMB: %d file(s) in the batch, %d file(s) pending' % (
+                    budget / MB , len ( batch ) , len ( pending ) ) )
+            wmgr = WorkManager ( silent = silent , progress = progress , ncpus = ncpus , **kwargs )
+            wmgr.process ( task , [ trees [ i ] for i in batch ] )
+            ## `WorkManager` reinitializes the task for each batch 
+            n , t    = task.results ()
+            items   += n
+            seconds += t
+            
+        ## record the throughput for the planning (in the parent process only)
+        Throughput.update ( self.__class__.__name__ , items , seconds )
+            
+        if oversized and not silent :
+            logger.info ( 'Memory budget %sMB: %d oversized file(s) are processed in chunked mode' % (
+                memory_budget , len ( oversized ) ) )
+            
+        ## oversized files: chunked processing in the current process 
+        for i in oversized :
+            self.run ( trees [ i ].chain            ,
+                       requests                     ,
+                       progress      = progress     ,
+                       report        = False        ,
+                       silent        = silent       ,
+                       parallel      = False        ,
+                       cuts          = cuts         , 
+                       memory_budget = memory_budget )
+    
 # =============================================================================
 ## @class PidGen
 #  A tiny wrapper for Anton Poluektov's pidgen2 machinery
@@ -551,6 +1114,19 @@ class PidGen(PidBase):
     # =========================================================================
     ## The actual type for the elementary request 
     Request = ReSample                
+    ## number of input columns for pidgen2 machinery 
+    NCOLS   = 3 
+    # ==========================================================================
+    ## Create the resampler
+    #  @see pidgen2.resampler.create_resampler     
+    def create ( self , sample , dataset , variable ) :
+        """ Create the resampler
+        - see pidgen2.resampler.create_resampler     
+        """
+        from pidgen2.resampler import create_resampler
+        return create_resampler ( sample   = sample   ,
+                                  dataset  = dataset  ,
+                                  variable = variable , **self.kwargs )
     # ==========================================================================
     ## Create the resampler and run the pidgen2 machinery
     #  @param data (INPUT) input numpy array dimension of (N,3)
@@ -577,11 +1153,7 @@ class PidGen(PidBase):
         assert 2 == len ( data.shape ) and  3 == data.shape [ 1 ] , "Invalid `data` shape %s"  % str ( data.shape )
 
         ## use pidgen2 machinery!!! 
-        from pidgen2.resampler import create_resampler
-        resampler = create_resampler ( sample   = sample   ,
-                                       dataset  = dataset  ,
-                                       variable = variable , **self.kwargs )
-        
+        resampler = self.create ( sample , dataset , variable )
         return resampler ( data ) 
 
     # =========================================================================
@@ -598,6 +1170,8 @@ class PidGen(PidBase):
     #  pgen = PidGen ( ... )
     #  pgen.pprocess ( requests  , progress = True , .... ) 
     #  @encode
+    #  Optional preselection can be specified as ( chain , [requests] , cuts ) triplets:
+    #  only selected entries are resampled, others get `nan` value 
     ## Process all requests 
     def process ( self             ,
                   the_requests     , * , 
@@ -615,16 +1189,23 @@ class PidGen(PidBase):
         >>>  ...                   ReSample ( 'pid_K'   , 'K_Dstar2Dpi'  , 'MagDown_2015' , 'MC15TuneV1_ProbNNK'  , 'pt_kaon*1000'    , 'eta_kaon'    , 'nTracks' ) ] ]
         >>> pgen = PidGen ( ... )
         >>> pgen.process ( requests , progress = True , .... ) 
+
+        Optional preselection can be specified as ( chain , [requests] , cuts ) triplets:
+        only selected entries are resampled, others get `nan` value 
         """
 
+        ## (0) unpack the input bunches 
+        the_requests = self.bunches ( the_requests )
+        
         ## (1) initial loop over the entries
         printed = False 
-        for tree , requests in the_requests  :
+        for tree , requests , cuts in the_requests  :
             assert isinstance ( tree , ROOT.TTree ) , "Invalid type for `tree` %s" % typename ( tree )
             reqs = self.requests ( requests )
             assert self.check_requests ( reqs ) , "Invalid/non-exising requests!"
             ## more check for requests, this time  one-by-one 
             if any ( not self.check_request ( tree , r ) for r in requests ) : return 
+            if cuts and not vars_in_tree ( tree , cuts ) : return 
             for f in tree.files :
                 if not printed and '/eos/' in f :
                      logger.warning ( 'EOS is *NOT* a reliable storage for safe modification of data!' )
@@ -637,7 +1218,7 @@ class PidGen(PidBase):
 
         ## (2) start pidgen processing
         nr = 1  
-        for tree , requests in progress_bar ( the_requests , silent = not local_progress , description = 'Input:') :
+        for tree , requests , cuts in progress_bar ( the_requests , silent = not local_progress , description = 'Input:') :
             if not local_progress and not silent : logger.info ( 'Processing bunch #%d from %d' % ( nr , NR ) ) 
             nr += 1 
             requests = self.requests ( requests ) 
@@ -646,24 +1227,37 @@ class PidGen(PidBase):
                        progress = down_progress ,
                        report   = report        ,
                        silent   = silent or local_progress , 
-                       parallel = parallel      , **kwargs )
+                       parallel = parallel      ,
+                       cuts     = cuts          , **kwargs )
 
     # =========================================================================
     ## The secondary entry point: Run pidgen machinery for several request for given tree/chain 
     #  @param tree    (INPUT/UPDATE) the input/update TTree/TChain
     #  @param requests (INPUT)       the list of elementary requests
+    #  @param cuts          (INPUT) only selected entries are resampled, others get `nan` value 
+    #  @param chunk_size    (INPUT) process the tree in chunks of entries 
+    #  @param memory_budget (INPUT) memory budget in MB (chunked mode for oversized files)
+    #  @param throughput    (INPUT) record the measured throughput for the planning? 
     #  @see ReSample 
-    def run ( self             ,
-              tree             ,     ## input TTree/TChain
-              requests         , * , ## requests to process
-              progress = True  ,     ## show progress ?
-              report   = True  ,     ## make a report ?
-              silent   = False ,    
-              parallel = False , 
-              **kwargs         ) :
+    def run ( self                  ,
+              tree                  ,     ## input TTree/TChain
+              requests              , * , ## requests to process
+              progress      = True  ,     ## show progress ?
+              report        = True  ,     ## make a report ?
+              silent        = False ,    
+              parallel      = False ,
+              cuts          = ''    ,     ## preselection 
+              chunk_size    = -1    ,     ## chunk size (in entries)
+              memory_budget = -1    ,     ## memory budget (in MB) 
+              throughput    = True  ,     ## record the throughput ?
+              **kwargs              ) :
         """ The secondary entry point: run pidgen machinery for several request for given tree/chain 
-        - tree    (INPUT/UPDATE) the input/update TTree/TChain
-        - requests (INPUT)       the olist of elementary requests
+        - tree          (INPUT/UPDATE) the input/update TTree/TChain
+        - requests      (INPUT)        the olist of elementary requests
+        - cuts          (INPUT)        only selected entries are resampled, others get `nan` value 
+        - chunk_size    (INPUT)        process the tree in chunks of entries 
+        - memory_budget (INPUT)        memory budget in MB (chunked mode for oversized files)
+        - throughput    (INPUT)        record the measured throughput for the planning? 
         """
         ## (1) check input data 
         assert isinstance ( tree , ROOT.TTree ) , "Invalid `tree` type: %s" % typename ( tree ) 
@@ -685,16 +1279,31 @@ class PidGen(PidBase):
         if isinstance ( tree , ROOT.TChain ) and 1 < tree.nFiles :
             return self.__run_chain ( tree     ,
                                       requests , 
-                                      progress = progress ,
-                                      report   = report   ,
-                                      silent   = silent   , 
-                                      parallel = parallel , **kwargs )
-
+                                      progress      = progress      ,
+                                      report        = report        ,
+                                      silent        = silent        , 
+                                      parallel      = parallel      ,
+                                      cuts          = cuts          , 
+                                      memory_budget = memory_budget , **kwargs )
+
+        started  = time.time () 
         the_file = tree.files [ 0 ]
         
         ## number of entries 
         N = len ( tree )
 
+        ## chunked processing ?
+        if memory_budget and 0 < memory_budget and chunk_size <= 0 :
+            chunk_size = self.chunk_size ( tree , requests , memory_budget * MB - rss () )
+        ranges = self.ranges ( N , chunk_size )
+        if 1 < len ( ranges ) and not silent :
+            logger.info ( 'Chunked processing of %s : %d chunks' % ( the_file , len ( ranges ) ) ) 
+
+        ## preselection of entries 
+        index = self.selection ( tree , cuts )
+        if not index is None and not silent :
+            logger.info ( 'Preselection: %d/%d entries are selected with `%s`' % ( len ( index ) , N , cuts ) ) 
+
         ## sampled #tracks 
         sampled_ntrk = None
         
@@ -717,17 +1326,30 @@ class PidGen(PidBase):
             if sampled_ntrk is None and not isinstance ( ntrk , string_types ) :
                 sampled_ntrk = self.sample_ntrk ( ntrk , N = N )
                 
-            ## get the data 
-            data = self.get_data ( tree , pt , eta , ntrk = ntrk if sampled_ntrk is None else sampled_ntrk )
-            
-            ## run the actual pidgen machinery 
-            pids , _ = self ( data             ,
-                              request.sample   ,
-                              request.dataset  ,
-                              request.variable ) 
+            ## create the resampler 
+            resampler = self.create ( request.sample , request.dataset , request.variable )
+
+            pids = [] 
+            for first , last in ranges :
+                ## selected entries 
+                selected = self.selected ( index , first , last )
+                if not selected is None and 0 == len ( selected ) : continue 
+                ## #ntrk for selected entries 
+                the_ntrk = ntrk
+                if   not sampled_ntrk is None and selected is None : the_ntrk = sampled_ntrk [ first : last ]
+                elif not sampled_ntrk is None                      : the_ntrk = sampled_ntrk [ selected    ]
+                ## get the data 
+                data = self.get_data ( tree , pt , eta ,
+                                       ntrk  = the_ntrk ,
+                                       cuts  = cuts     ,
+                                       first = first    ,
+                                       last  = last     )
+                ## run the actual pidgen machinery 
+                p , _ = resampler ( data )
+                pids.append ( p )
 
             ## collect the results 
-            results [ request.outvar ] = pids 
+            results [ request.outvar ] = self.expand ( pids , index , N ) 
 
         
         ## addd #ntrk is requested
@@ -735,21 +1357,27 @@ class PidGen(PidBase):
             results [ self.nTrk_name ] = sampled_ntrk 
             
         ## add result to TTree:
-        return tree.add_new_buffer ( results , report = report , progress = progress )
+        result = tree.add_new_buffer ( results , report = report , progress = progress )
+
+        ## record the throughput for the planning 
+        if throughput : Throughput.update ( self.__class__.__name__ , N * len ( requests ) , time.time () - started )
+        return result 
 
     
     # =========================================================================
     ## Internal function to run pidgen machinery over TChain with many files
     #  @param chain    (INPUT/UPDATE) input/update TTtree/TChain
     #  @param requests (INPUT)       the list of elementary requests    
-    def __run_chain ( self             ,
-                      chain            ,     ## input TTree/TChain
-                      requests         , * , ## requests  
-                      progress = True  ,     ## show progress
-                      report   = True  ,     ## make a report ? 
-                      parallel = False ,    ## use the parallel processing ?  
-                      silent   = False , 
-                      **kwargs         ) : 
+    def __run_chain ( self                  ,
+                      chain                 ,     ## input TTree/TChain
+                      requests              , * , ## requests  
+                      progress      = True  ,     ## show progress
+                      report        = True  ,     ## make a report ? 
+                      parallel      = False ,     ## use the parallel processing ?  
+                      silent        = False ,
+                      cuts          = ''    ,     ## preselection 
+                      memory_budget = -1    ,     ## memory budget (in MB) 
+                      **kwargs              ) : 
         """ Internal function to run pidgen machinery over TChain with many files 
         - chain    (INPUT/UPDATE) input/update TTtree/TChain
         - requests (INPUT)        the list of elementary requests    
@@ -771,8 +1399,10 @@ class PidGen(PidBase):
         if not isinstance ( chain  , ROOT.TChain ) or 2 > chain .nFiles  :
             return self.run ( chain    ,
                               requests , 
-                              progress = progress ,
-                              report   = report   , **kwargs )
+                              progress      = progress      ,
+                              report        = report        ,
+                              cuts          = cuts          ,
+                              memory_budget = memory_budget , **kwargs )
         
         # ========================================================================================
         ## list of existing branches/leaves 
@@ -785,19 +1415,14 @@ class PidGen(PidBase):
 
         ## parallel processing? 
         if parallel and files :
-        
-            ## create the tast for the paralell processing
-            task  = PidTask ( self , requests )
-            
-            from ostap.trees.utils import Chain
-            ch    = Chain    ( chain )    
-            trees = ch.split ( chunk_size = -1 , max_files = 1  )
-    
-            ## Manager
-            from   ostap.parallel.parallel import WorkManager
-            wmgr   = WorkManager ( silent = silent , progress = progress , **kwargs )
-            wmgr.process ( task , trees )
 
+            self.run_parallel ( chain                          ,
+                                requests                       ,
+                                progress      = progress       ,
+                                silent        = silent         ,
+                                cuts          = cuts           , 
+                                memory_budget = memory_budget  , **kwargs )
+            
         else :
             ## sequential processing here :
 
@@ -812,9 +1437,11 @@ class PidGen(PidBase):
                 ## treat the tree 
                 self.run ( tree     ,
                            requests , 
-                           progress = down_progress            ,
-                           silent   = silent or local_progress , 
-                           report   = False         , **kwargs ) 
+                           progress      = down_progress            ,
+                           silent        = silent or local_progress , 
+                           report        = False                    ,
+                           cuts          = cuts                     , 
+                           memory_budget = memory_budget            , **kwargs ) 
 
         ## reconstruct the resulting chain 
         chain = ROOT.TChain ( cname )
@@ -929,6 +1556,8 @@ class PidCorr(PidBase) :
     # =========================================================================
     ## The actual type for the elementary request 
     Request = Correct 
+    ## number of input columns for pidgen2 machinery 
+    NCOLS   = 4 
     # =========================================================================
     ## constructor
     # `PidCorr` feeds the `pidgen2.correct` function with following arguments 
@@ -967,6 +1596,18 @@ class PidCorr(PidBase) :
         ## 
         if dir2 and self.verbose : logger.info ( 'Local mc_template storage : %s' % dir2 ) 
 
+    # =========================================================================
+    ## Create the corrector
+    #  @see pidgen2.corrector.create_corrector
+    def create ( self , sample , dataset , variable ) :
+        """ Create the corrector
+        - see pidgen2.corrector.create_corrector
+        """
+        from pidgen2.corrector import create_corrector
+        return create_corrector ( sample   = sample   ,
+                                  dataset  = dataset  ,
+                                  variable = variable , **self.kwargs )
+
     # =========================================================================
     ## Create the correctie and run the pidgen2 machinery
     #  @param data (INPUT) input numpy array dimension of (N,3)
@@ -993,15 +1634,14 @@ class PidCorr(PidBase) :
         assert 2 == len ( data.shape ) and 4 == data.shape [ 1 ] , "Invalid `data` shape %s"  % str ( data.shape )
 
         ## use pidgen2 machinery!!! 
-        from pidgen2.corrector import create_corrector
-        corrector = create_corrector ( sample   = sample   ,
-                                       dataset  = dataset  ,
-                                       variable = variable , **self.kwargs )
+        corrector = self.create ( sample , dataset , variable )
         return corrector ( data ) 
 
     # ========================================================================================
     ## The main entry point: processing of  input data in a form of (chain, [requests] ) pairs
     #  @param the_requests    (INPUT)  the sequence (chain,[requests]) pairs    
+    #  Optional preselection can be specified as ( chain , [requests] , cuts ) triplets:
+    #  only selected entries are processed, others get `nan` value 
     def process ( self                 ,
                   the_requests         , * , 
                   progress     = False ,
@@ -1010,17 +1650,23 @@ class PidCorr(PidBase) :
                   parallel     = False , **kwargs ) :
         """ The main entry point: processing of  input data in a form of (chain, [requests] ) pairs
         - the_requests    (INPUT)  the sequence (chain,[requests]) pairs    
+        - optional preselection can be specified as ( chain , [requests] , cuts ) triplets:
+          only selected entries are processed, others get `nan` value 
         """
         
+        ## (0) unpack the input bunches 
+        the_requests = self.bunches ( the_requests )
+        
         ## (1) initial loop over the entries
         printed = False 
-        for tree , requests in the_requests  :
+        for tree , requests , cuts in the_requests  :
             assert isinstance ( tree , ROOT.TTree ) , "Invalid type for `tree` %s" % typename ( tree )
             reqs = self.requests ( requests )
             assert self.check_requests ( reqs , self.kwargs.get ( 'simversion', '' ) ) , "Invalid/non-exising requests!"
             ## more check for requests, this time  one-by-one 
             if any ( not self.check_request ( tree , r ) for r in requests ) : return
             if any ( not vars_in_tree ( tree , r.invar ) for r in requests ) : return 
+            if cuts and not vars_in_tree ( tree , cuts ) : return 
                 
             ## more checks..
             outvars = set()
@@ -1042,7 +1688,7 @@ class PidCorr(PidBase) :
         
         ## loop over input data
         nr = 1 
-        for tree , requests in progress_bar ( the_requests , silent = not local_progress , description = "Input:" ) :
+        for tree , requests , cuts in progress_bar ( the_requests , silent = not local_progress , description = "Input:" ) :
             if not local_progress and not silent : logger.info ( 'Processing bunch #%d from %d' % ( nr , NR ) )
             nr += 1 
             self.run ( tree     ,
@@ -1050,22 +1696,35 @@ class PidCorr(PidBase) :
                        progress = down_progress ,
                        report   = report        , 
                        silent   = silent or local_progress , 
-                       parallel = parallel      , **kwargs ) 
+                       parallel = parallel      ,
+                       cuts     = cuts          , **kwargs ) 
             
     # =========================================================================
     ## The minimal action: process a single  input file
-    #  @param tree      (INPUT/UPDATE)  input/update TTree 
-    #  @param requests  (INPUT)         the list of requests/actions 
-    def run ( self              ,
-              tree              , 
-              requests          , * , 
-              progress  = False ,
-              report    = False ,
-              silent    = False , 
-              parallel  = False , **kwargs ) :
+    #  @param tree          (INPUT/UPDATE)  input/update TTree 
+    #  @param requests      (INPUT)         the list of requests/actions 
+    #  @param cuts          (INPUT)         only selected entries are corrected, others get `nan` value 
+    #  @param chunk_size    (INPUT)         process the tree in chunks of entries 
+    #  @param memory_budget (INPUT)         memory budget in MB (chunked mode for oversized files)
+    #  @param throughput    (INPUT)         record the measured throughput for the planning? 
+    def run ( self                  ,
+              tree                  , 
+              requests              , * , 
+              progress      = False ,
+              report        = False ,
+              silent        = False , 
+              parallel      = False ,
+              cuts          = ''    , 
+              chunk_size    = -1    ,
+              memory_budget = -1    ,
+              throughput    = True  , **kwargs ) :
         """ The minimal action: process a single  input file
-        - file_tree (INPUT/UPDATE)  input/update TTree 
-        - requests  (INPUT)         the list of requests/actions 
+        - file_tree     (INPUT/UPDATE)  input/update TTree 
+        - requests      (INPUT)         the list of requests/actions 
+        - cuts          (INPUT)         only selected entries are corrected, others get `nan` value 
+        - chunk_size    (INPUT)         process the tree in chunks of entries 
+        - memory_budget (INPUT)         memory budget in MB (chunked mode for oversized files)
+        - throughput    (INPUT)         record the measured throughput for the planning? 
         """
 
         ## (1) check input data 
@@ -1088,15 +1747,18 @@ class PidCorr(PidBase) :
         ## (3) chain processing ?
         if isinstance ( tree , ROOT.TChain ) and 1 < tree.nFiles :
             return self.__run_chain ( tree     ,
-                                      requests = requests ,
-                                      progress = progress ,
-                                      report   = report   ,
-                                      silent   = silent   , 
-                                      parallel = parallel , **kwargs )
+                                      requests      = requests      ,
+                                      progress      = progress      ,
+                                      report        = report        ,
+                                      silent        = silent        , 
+                                      parallel      = parallel      ,
+                                      cuts          = cuts          , 
+                                      memory_budget = memory_budget , **kwargs )
 
         
         ## (4) single tree processing
         
+        started  = time.time () 
         the_file = tree.files [ 0 ]
         the_path = tree.full_path
 
@@ -1105,6 +1767,18 @@ class PidCorr(PidBase) :
         ## number of entries 
         N = len ( tree )
 
+        ## chunked processing ?
+        if memory_budget and 0 < memory_budget and chunk_size <= 0 :
+            chunk_size = self.chunk_size ( tree , requests , memory_budget * MB - rss () )
+        ranges = self.ranges ( N , chunk_size )
+        if 1 < len ( ranges ) and not silent :
+            logger.info ( 'Chunked processing of %s : %d chunks' % ( the_file , len ( ranges ) ) ) 
+
+        ## preselection of entries 
+        index = self.selection ( tree , cuts )
+        if not index is None and not silent :
+            logger.info ( 'Preselection: %d/%d entries are selected with `%s`' % ( len ( index ) , N , cuts ) ) 
+
         ## sampled #tracks 
         sampled_ntrk = None  
         
@@ -1121,17 +1795,30 @@ class PidCorr(PidBase) :
             if sampled_ntrk is None and not isinstance ( ntrk , string_types ) :
                 sampled_ntrk = self.sample_ntrk ( ntrk , N = N ) 
 
-            ## get the data 
-            data = self.get_data ( tree , invar , pt , eta , ntrk = ntrk if sampled_ntrk is None else sampled_ntrk )
-            
-            ## run the actual pidgen machinery 
-            pids , _ , _ = self ( data             ,
-                                  request.sample   ,
-                                  request.dataset  ,
-                                  request.variable ) 
+            ## create the corrector 
+            corrector = self.create ( request.sample , request.dataset , request.variable )
+
+            pids = [] 
+            for first , last in ranges :
+                ## selected entries 
+                selected = self.selected ( index , first , last )
+                if not selected is None and 0 == len ( selected ) : continue 
+                ## #ntrk for selected entries 
+                the_ntrk = ntrk
+                if   not sampled_ntrk is None and selected is None : the_ntrk = sampled_ntrk [ first : last ]
+                elif not sampled_ntrk is None                      : the_ntrk = sampled_ntrk [ selected    ]
+                ## get the data 
+                data = self.get_data ( tree , invar , pt , eta ,
+                                       ntrk  = the_ntrk ,
+                                       cuts  = cuts     ,
+                                       first = first    ,
+                                       last  = last     )
+                ## run the actual pidgen machinery 
+                p , _ , _ = corrector ( data )
+                pids.append ( p ) 
             
             ## collect the results 
-            results [ request.outvar ] = pids 
+            results [ request.outvar ] = self.expand ( pids , index , N ) 
 
         ## addd #ntrk is requested
         if not sampled_ntrk is None and self.nTrk_name :
@@ -1139,19 +1826,25 @@ class PidCorr(PidBase) :
    
         chain = ROOT.TChain ( the_path )
         chain.Add ( the_file ) 
-        return chain.add_new_buffer ( results , report = report , progress = progress ) 
+        result = chain.add_new_buffer ( results , report = report , progress = progress )
+
+        ## record the throughput for the planning 
+        if throughput : Throughput.update ( self.__class__.__name__ , N * len ( requests ) , time.time () - started )
+        return result  
 
     # =========================================================================
     ## Process a chain  (sequence of trees)
     #  @param chain     (INPUT/UPDATE)  input/update TTree/TChain 
     #  @param requests  (INPUT)         the list of requests/actions 
-    def __run_chain  ( self             ,
-                       chain            ,
-                       requests         , * , 
-                       progress = True  ,  
-                       report   = True  ,
-                       silent   = False ,
-                       parallel = False , **kwargs ) :
+    def __run_chain  ( self                  ,
+                       chain                 ,
+                       requests              , * , 
+                       progress      = True  ,  
+                       report        = True  ,
+                       silent        = False ,
+                       parallel      = False ,
+                       cuts          = ''    , 
+                       memory_budget = -1    , **kwargs ) :
         """ Process a chain  (sequence of trees)
         - chain     (INPUT/UPDATE)  input/update TTree/TChain 
         - requests  (INPUT)         the list of requests/actions 
@@ -1165,7 +1858,9 @@ class PidCorr(PidBase) :
                               silent   = silent   ,
                               progress = progress ,
                               report   = report   ,
-                              parallel = False    , **kwargs ) 
+                              parallel = False    ,
+                              cuts     = cuts     , 
+                              memory_budget = memory_budget , **kwargs ) 
 
         ## (2) check the configuration of requests 
         if isinstance ( requests , Correct ) : requests = requests,
@@ -1184,18 +1879,13 @@ class PidCorr(PidBase) :
 
         ## parallel processing 
         if parallel and files :
-            
-            ## create the task for paralell processing
-            task  = PidTask ( self, requests )
-            
-            from ostap.trees.utils import Chain
-            ch    = Chain      ( chain )    
-            trees = ch.split   ( chunk_size = -1 , max_files = 1  )
-    
-            ## Manager
-            from   ostap.parallel.parallel import WorkManager
-            wmgr   = WorkManager ( silent = silent , progress = progress , **kwargs )
-            wmgr.process ( task , trees )
+
+            self.run_parallel ( chain                          ,
+                                requests                       ,
+                                progress      = progress       ,
+                                silent        = silent         ,
+                                cuts          = cuts           , 
+                                memory_budget = memory_budget  , **kwargs )
 
         else :
 
@@ -1209,11 +1899,13 @@ class PidCorr(PidBase) :
                 tree = ROOT.TChain ( cname  )
                 tree.Add ( fname )
                 self.run ( tree                     ,
-                           requests = requests      ,                 
-                           progress = down_progress , 
-                           report   = False         ,
-                           silent   = silent or local_progress  , 
-                           parallel = False         ,  **kwargs ) 
+                           requests      = requests      ,                 
+                           progress      = down_progress , 
+                           report        = False         ,
+                           silent        = silent or local_progress  , 
+                           parallel      = False         ,
+                           cuts          = cuts          , 
+                           memory_budget = memory_budget ,  **kwargs ) 
 
         # =====================================================================
         ## reconstruct the resulting chain 
@@ -1239,13 +1931,18 @@ class PidCorr(PidBase) :
 class PidTask(Task) :
     """ Simple Task for the parallel processing of PidGen
     """
-    def __init__ ( self , pidobj , requests ) :
+    def __init__ ( self , pidobj , requests , cuts = '' ) :
         
         self.__pidobj   = pidobj 
         self.__requests = pidobj.requests ( requests ) 
+        self.__cuts     = cuts 
+        self.__items    = 0
+        self.__seconds  = 0.0 
     
     ## local initialization (executed once in parent process)
-    def initialize_local   ( self ) : pass 
+    def initialize_local   ( self ) :
+        self.__items    = 0
+        self.__seconds  = 0.0 
         
     # =============================================================
     ## the actual processing
@@ -1267,18 +1964,26 @@ class PidTask(Task) :
         
         assert all_entries ( chain , first , last ) , \
             "Only the whole TTree/TChain can be processed! "
+
+        started = time.time () 
+        self.__pidobj.run ( chain              ,
+                            self.__requests    ,  
+                            progress   = False , 
+                            report     = False ,
+                            silent     = True  , 
+                            parallel   = False ,
+                            throughput = False , 
+                            cuts       = self.__cuts )
+        ## the throughput is recorded in the parent process 
+        return len ( chain ) * len ( self.__requests ) , time.time () - started 
         
-        self.__pidobj.run ( chain            ,
-                            self.__requests  ,  
-                            progress = False , 
-                            report   = False ,
-                            silent   = True  , 
-                            parallel = False )
-        
-    ## merge results 
-    def merge_results ( self , result , jobid = -1 ) : pass    
-    ## get the results 
-    def results       ( self ) : pass 
+    ## merge results: processed items and seconds 
+    def merge_results ( self , result , jobid = -1 ) :
+        if not result : return 
+        self.__items   += result [ 0 ]
+        self.__seconds += result [ 1 ]
+    ## get the results: processed items and seconds 
+    def results       ( self ) : return self.__items , self.__seconds 
 
     
 # =============================================================================
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  results.py
+#  Persistent store of the PIDCalib results
+#
+#  The (efficiency, accepted, rejected) triplets are stored in `zipshelve` database
+#  with the key, calculated as a hash of the full request identity:
+#  particle, criterion, sample, magnet, combined cuts, sWeight branch,
+#  binning edges, axis expressions and the list of input files with the
+#  signatures of the local ones: rewritten local files give the new key,
+#  the remote files are identified by name and are not opened on a store hit 
+#
+#  @code
+#  store  = ResultStore ()
+#  result = request.process ( store = store ) ## the 1st call: process & store
+#  result = request.process ( store = store ) ## the 2nd call: get from the store
+#  store.ls ()
+#  @endcode
+#  @see ostap.io.zipshelve
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Persistent store of the PIDCalib results
+
+The (efficiency, accepted, rejected) triplets are stored in `zipshelve` database
+with the key, calculated as a hash of the full request identity:
+particle, criterion, sample, magnet, combined cuts, sWeight branch,
+binning edges, axis expressions and the list of input files with the
+signatures of the local ones: rewritten local files give the new key,
+the remote files are identified by name and are not opened on a store hit 
+
+>>> store  = ResultStore ()
+>>> result = request.process ( store = store ) ## the 1st call: process & store
+>>> result = request.process ( store = store ) ## the 2nd call: get from the store
+>>> store.ls ()
+- see `ostap.io.zipshelve`
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'identity'    , ## full identity of the elementary fill
+    'ResultStore' , ## persistent store of PIDCalib results
+)
+# =============================================================================
+from   pidcalib.fill     import axis_edges
+from   pidcalib.utils    import cache_dir
+from   pidcalib.partials import file_identity
+import os, time, hashlib
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.results')
+# =============================================================================
+## Full identity of the elementary fill for the given calibration data
+#  @param fill   the elementary fill
+#  @param sample data sample
+#  @param magnet magnet polarity
+#  @param particle particle type
+#  @param weight sWeight branch
+#  @param files  input files (the signatures of the local files are included)
+#  @param extra  other (optional) items of identity, e.g. tree paths
+#  @return tuple that fully identifies the result
+#  @see pidcalib.fill.Fill
+#  @see pidcalib.partials.file_identity 
+def identity ( fill , particle , sample , magnet , weight , files , *extra ) :
+    """ Full identity of the elementary fill for the given calibration data
+    - the signatures of the local input files are included (remote files are not opened)
+    - return tuple that fully identifies the result
+    - see pidcalib.fill.Fill
+    - see pidcalib.partials.file_identity 
+    """
+    histo = fill.histogram
+    axes  = histo.GetXaxis () , histo.GetYaxis () , histo.GetZaxis ()
+    edges = tuple ( tuple ( axis_edges ( a ) ) for a in axes [ : histo.GetDimension () ] )
+    return ( ( 'particle'  , particle                   ) ,
+             ( 'criterion' , str ( fill.criterion )     ) ,
+             ( 'sample'    , sample                     ) ,
+             ( 'magnet'    , magnet                     ) ,
+             ( 'cuts'      , str ( fill.cuts )          ) ,
+             ( 'weight'    , weight                     ) ,
+             ( 'edges'     , edges                      ) ,
+             ( 'variables' , tuple ( fill.variables )   ) ,
+             ( 'files'     , tuple ( file_identity ( f ) for f in files ) ) ) + tuple ( extra )
+
+# =============================================================================
+## @class ResultStore
+#  Persistent store of PIDCalib results
+#  - the default database is `results.db` in the local cache directory
+#  @code
+#  store = ResultStore ()
+#  key   = store.key ( identity )
+#  if key in store : result = store [ key ]
+#  else            : store.put ( key , result , identity )
+#  @endcode
+class ResultStore(object) :
+    """ Persistent store of PIDCalib results
+    - the default database is `results.db` in the local cache directory
+    >>> store = ResultStore ()
+    >>> key   = store.key ( identity )
+    >>> if key in store : result = store [ key ]
+    >>> else            : store.put ( key , result , identity )
+    """
+    def __init__ ( self , dbname = None ) :
+        self.__dbname = dbname if dbname else os.path.join ( cache_dir () , 'results.db' )
+
+    @property
+    def dbname ( self ) :
+        """`dbname` : the name of the database file"""
+        return self.__dbname
+
+    ## open the database
+    def open ( self , mode = 'c' ) :
+        """ Open the database
+        """
+        import ostap.io.zipshelve as DBASE
+        return DBASE.open ( self.__dbname , mode )
+
+    ## database exists?
+    def __exists ( self ) :
+        return os.path.exists ( self.__dbname )
+
+    # =========================================================================
+    ## The key for the given identity: the hash of identity
+    @staticmethod
+    def key ( identity ) :
+        """ The key for the given identity: the hash of identity
+        """
+        return hashlib.sha1 ( repr ( identity ).encode () ).hexdigest ()
+
+    def __contains__ ( self , key ) :
+        if not self.__exists () : return False
+        with self.open ( 'r' ) as db : return key in db
+
+    def __getitem__ ( self , key ) :
+        with self.open ( 'r' ) as db : return db [ key ] [ 'result' ]
+
+    # =========================================================================
+    ## Get the result for the key, `None` if not found
+    def get ( self , key ) :
+        """ Get the result for the key, `None` if not found
+        """
+        if not self.__exists () : return None
+        with self.open ( 'r' ) as db :
+            entry = db.get ( key , None )
+            return entry [ 'result' ] if entry else None
+
+    # =========================================================================
+    ## Put the result into the store
+    #  @param key      the key
+    #  @param result   the result
+    #  @param identity the full identity of the result
+    def put ( self , key , result , identity = () ) :
+        """ Put the result into the store
+        """
+        with self.open ( 'c' ) as db :
+            db [ key ] = { 'result'   : result          ,
+                           'identity' : dict ( identity ) ,
+                           'created'  : time.time ()    }
+
+    # =========================================================================
+    ## All entries: list of (key, identity, created) triplets
+    def entries ( self ) :
+        """ All entries: list of (key, identity, created) triplets
+        """
+        if not self.__exists () : return []
+        result = []
+        with self.open ( 'r' ) as db :
+            for key in db.keys () :
+                entry = db [ key ]
+                result.append ( ( key , entry.get ( 'identity' , {} ) , entry.get ( 'created' , 0 ) ) )
+        return sorted ( result , key = lambda e : e [ 2 ] )
+
+    # =========================================================================
+    ## Remove entries
+    #  @param keys    keys (or unique key prefixes) to remove
+    #  @param older   remove entries older than `older` seconds
+    #  @return number of removed entries
+    def evict ( self , keys = () , older = -1 ) :
+        """ Remove entries
+        - keys  : keys (or unique key prefixes) to remove
+        - older : remove entries older than `older` seconds
+        - return number of removed entries
+        """
+        if not self.__exists () : return 0
+        now     = time.time ()
+        removed = 0
+        with self.open ( 'c' ) as db :
+            for key in list ( db.keys () ) :
+                remove = any ( key.startswith ( k ) for k in keys )
+                if not remove and 0 <= older :
+                    remove = older < now - db [ key ].get ( 'created' , 0 )
+                if remove :
+                    del db [ key ]
+                    removed += 1
+        return removed
+
+    # =========================================================================
+    ## Print the table of entries
+    def ls ( self , prefix = '# ' ) :
+        """ Print the table of entries
+        """
+        from ostap.logger.table import table
+        rows = [ ( 'Key' , 'Particle' , 'Sample' , 'Magnet' , 'Criterion' , 'Variables' , '#files' , 'Created' ) ]
+        for key , ident , created in self.entries () :
+            rows.append ( ( key [ : 12 ]                                ,
+                            str ( ident.get ( 'particle'  , '' ) )      ,
+                            str ( ident.get ( 'sample'    , '' ) )      ,
+                            str ( ident.get ( 'magnet'    , '' ) )      ,
+                            str ( ident.get ( 'criterion' , '' ) )      ,
+                            ', '.join ( ident.get ( 'variables' , () ) ) ,
+                            '%d' % len ( ident.get ( 'files' , () ) )   ,
+                            time.strftime ( '%Y-%m-%d %H:%M' , time.localtime ( created ) ) ) )
+        title = 'PIDCalib results: %s' % self.__dbname
+        logger.info ( '%s:\n%s' % ( title , table ( rows , title = title , prefix = prefix , alignment = 'llllllrl' ) ) )
+        return len ( rows ) - 1
+
+    def __repr__ ( self ) : return 'ResultStore(%s)' % self.__dbname
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  sparse.py
+#  Sparse N-dimensional histograms for PIDCalib requests
+#
+#  Only non-empty bins are stored: the linear bin indices with the sums
+#  of weights and the sums of squared weights. Filling is vectorized
+#  (numpy bin lookup and aggregation), merging is a sparse
+#  (concatenate & aggregate) operation, and only the light-weight arrays
+#  are transferred between the processes. The final results are
+#  converted to `THnSparseD`
+#
+#  @code
+#  h = SparseHisto ( [ p_edges , eta_edges , ntrk_edges , npv_edges ] )
+#  h.fill ( [ p , eta , ntrk , npv ] , weights )
+#  h += other
+#  root_histo = h.THnSparse ()
+#  @endcode
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Sparse N-dimensional histograms for PIDCalib requests
+
+Only non-empty bins are stored: the linear bin indices with the sums
+of weights and the sums of squared weights. Filling is vectorized
+(numpy bin lookup and aggregation), merging is a sparse
+(concatenate & aggregate) operation, and only the light-weight arrays
+are transferred between the processes. The final results are
+converted to `THnSparseD`
+
+>>> h = SparseHisto ( [ p_edges , eta_edges , ntrk_edges , npv_edges ] )
+>>> h.fill ( [ p , eta , ntrk , npv ] , weights )
+>>> h += other
+>>> root_histo = h.THnSparse ()
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'SparseHisto'   , ## sparse N-dimensional histogram
+    'sparse_edges'  , ## bin edges for all axes of THnBase
+    'fill_sparse'   , ## fill sparse accepted/rejected histograms for the chain
+    'SparseTask'    , ## task for the parallel filling of sparse histograms
+)
+# =============================================================================
+from   array               import array
+from   ostap.parallel.task import Task
+from   pidcalib.fill       import read_columns
+from   pidcalib.sweights   import calibration_chain
+import numpy, ROOT
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.sparse')
+# =============================================================================
+## Bin edges for all axes of THnBase (e.g. THnSparse) histogram
+def sparse_edges ( histo ) :
+    """ Bin edges for all axes of THnBase (e.g. THnSparse) histogram
+    """
+    result = []
+    for i in range ( histo.GetNdimensions () ) :
+        axis = histo.GetAxis ( i )
+        n    = axis.GetNbins ()
+        result.append ( [ axis.GetBinLowEdge ( j ) for j in range ( 1 , n + 2 ) ] )
+    return result
+
+# =============================================================================
+## @class SparseHisto
+#  Sparse N-dimensional histogram
+#  - only non-empty bins are stored: the linear bin indices,
+#    the sums of weights and the sums of squared weights
+#  - underflows & overflows are ignored
+#  @code
+#  h = SparseHisto ( [ p_edges , eta_edges , ntrk_edges , npv_edges ] )
+#  h.fill ( [ p , eta , ntrk , npv ] , weights )
+#  h += other
+#  root_histo = h.THnSparse ()
+#  @endcode
+class SparseHisto(object) :
+    """ Sparse N-dimensional histogram
+    - only non-empty bins are stored: the linear bin indices,
+      the sums of weights and the sums of squared weights
+    - underflows & overflows are ignored
+    >>> h = SparseHisto ( [ p_edges , eta_edges , ntrk_edges , npv_edges ] )
+    >>> h.fill ( [ p , eta , ntrk , npv ] , weights )
+    >>> h += other
+    >>> root_histo = h.THnSparse ()
+    """
+    def __init__ ( self , edges , index = None , sumw = None , sumw2 = None ) :
+
+        self.__edges = tuple ( numpy.asarray ( e , dtype = numpy.float64 ) for e in edges )
+        assert self.__edges and all ( 2 <= len ( e ) and numpy.all ( numpy.diff ( e ) > 0 ) for e in self.__edges ) , \
+            "SparseHisto: invalid bin edges!"
+        self.__shape = tuple ( len ( e ) - 1 for e in self.__edges )
+
+        self.__index = numpy.zeros ( 0 , dtype = numpy.int64   ) if index is None else numpy.asarray ( index , dtype = numpy.int64   )
+        self.__sumw  = numpy.zeros ( 0 , dtype = numpy.float64 ) if sumw  is None else numpy.asarray ( sumw  , dtype = numpy.float64 )
+        self.__sumw2 = numpy.zeros ( 0 , dtype = numpy.float64 ) if sumw2 is None else numpy.asarray ( sumw2 , dtype = numpy.float64 )
+
+    @property
+    def edges ( self ) :
+        """`edges` : bin edges for all axes"""
+        return self.__edges
+
+    @property
+    def shape ( self ) :
+        """`shape` : number of bins for all axes"""
+        return self.__shape
+
+    @property
+    def ndim ( self ) :
+        """`ndim` : number of dimensions"""
+        return len ( self.__shape )
+
+    @property
+    def index ( self ) :
+        """`index` : linear indices of non-empty bins"""
+        return self.__index
+
+    @property
+    def sumw ( self ) :
+        """`sumw` : sums of weights for non-empty bins"""
+        return self.__sumw
+
+    @property
+    def sumw2 ( self ) :
+        """`sumw2` : sums of squared weights for non-empty bins"""
+        return self.__sumw2
+
+    def __len__ ( self ) : return len ( self.__index )
+
+    # =========================================================================
+    ## aggregate the (index, sumw, sumw2) arrays
+    @staticmethod
+    def __aggregate ( index , sumw , sumw2 ) :
+        if not len ( index ) : return index , sumw , sumw2
+        unique , inverse = numpy.unique ( index , return_inverse = True )
+        return ( unique ,
+                 numpy.bincount ( inverse , weights = sumw  , minlength = len ( unique ) ) ,
+                 numpy.bincount ( inverse , weights = sumw2 , minlength = len ( unique ) ) )
+
+    # =========================================================================
+    ## Fill the histogram
+    #  @param values  list of arrays, one per axis
+    #  @param weights array of weights (or `None`)
+    def fill ( self , values , weights = None ) :
+        """ Fill the histogram
+        - values  : list of arrays, one per axis
+        - weights : array of weights (or `None`)
+        """
+        assert len ( values ) == self.ndim , "SparseHisto.fill: invalid number of axes %d" % len ( values )
+
+        values = [ numpy.asarray ( v , dtype = numpy.float64 ) for v in values ]
+        n      = len ( values [ 0 ] )
+        w      = numpy.ones ( n , dtype = numpy.float64 ) if weights is None else numpy.asarray ( weights , dtype = numpy.float64 )
+
+        good   = numpy.ones ( n , dtype = bool )
+        bins   = []
+        for v , e in zip ( values , self.__edges ) :
+            b     = numpy.searchsorted ( e , v , side = 'right' ) - 1
+            good &= ( 0 <= b ) & ( b < len ( e ) - 1 )
+            bins.append ( b )
+
+        if not numpy.any ( good ) : return self
+
+        index = numpy.ravel_multi_index ( [ b [ good ] for b in bins ] , self.__shape )
+        w     = w [ good ]
+        self.__index , self.__sumw , self.__sumw2 = self.__aggregate (
+            numpy.concatenate ( ( self.__index , index ) ) ,
+            numpy.concatenate ( ( self.__sumw  , w     ) ) ,
+            numpy.concatenate ( ( self.__sumw2 , w * w ) ) )
+        return self
+
+    # =========================================================================
+    ## Sparse merge: add another histogram
+    def __iadd__ ( self , other ) :
+        if not isinstance ( other , SparseHisto ) : return NotImplemented
+        assert self.__shape == other.shape and all ( numpy.array_equal ( a , b ) for a , b in zip ( self.__edges , other.edges ) ) , \
+            "SparseHisto: cannot merge histograms with different binnings!"
+        self.__index , self.__sumw , self.__sumw2 = self.__aggregate (
+            numpy.concatenate ( ( self.__index , other.index ) ) ,
+            numpy.concatenate ( ( self.__sumw  , other.sumw  ) ) ,
+            numpy.concatenate ( ( self.__sumw2 , other.sumw2 ) ) )
+        return self
+
+    def __add__ ( self , other ) :
+        if not isinstance ( other , SparseHisto ) : return NotImplemented
+        result = SparseHisto ( self.__edges , self.__index , self.__sumw , self.__sumw2 )
+        result += other
+        return result
+
+    # =========================================================================
+    ## Efficiency from accepted & rejected histograms
+    #  \f$ \epsilon = \frac{a}{a+r} \f$ with uncorrelated uncertainties for a & r
+    #  @return (indices, efficiencies, variances) for the union of non-empty bins
+    @staticmethod
+    def efficiency ( accepted , rejected ) :
+        """ Efficiency from accepted & rejected histograms
+        - eps = a/(a+r) with uncorrelated uncertainties for a & r
+        - return (indices, efficiencies, variances) for the union of non-empty bins
+        """
+        index = numpy.union1d ( accepted.index , rejected.index )
+        def _dense ( h ) :
+            pos = numpy.searchsorted ( index , h.index )
+            s   = numpy.zeros ( len ( index ) ) ; s  [ pos ] = h.sumw
+            s2  = numpy.zeros ( len ( index ) ) ; s2 [ pos ] = h.sumw2
+            return s , s2
+        a , a2 = _dense ( accepted )
+        r , r2 = _dense ( rejected )
+        total  = a + r
+        good   = total != 0
+        eff    = numpy.zeros ( len ( index ) )
+        var    = numpy.zeros ( len ( index ) )
+        eff [ good ] = a [ good ] / total [ good ]
+        var [ good ] = ( r [ good ] ** 2 * a2 [ good ] + a [ good ] ** 2 * r2 [ good ] ) / total [ good ] ** 4
+        return index , eff , var
+
+    # =========================================================================
+    ## Create an empty THnSparseD with the same binning
+    def empty ( self , name = '' , title = '' ) :
+        """ Create an empty THnSparseD with the same binning
+        """
+        if not name :
+            from ostap.core.core import hID
+            name = hID ()
+        nbins  = array ( 'i' , self.__shape )
+        xmin   = array ( 'd' , [ e [  0 ] for e in self.__edges ] )
+        xmax   = array ( 'd' , [ e [ -1 ] for e in self.__edges ] )
+        histo  = ROOT.THnSparseD ( name , title , self.ndim , nbins , xmin , xmax )
+        for i , e in enumerate ( self.__edges ) :
+            histo.GetAxis ( i ).Set ( len ( e ) - 1 , array ( 'd' , e ) )
+        histo.Sumw2 ()
+        return histo
+
+    ## fill THnSparse from (indices, contents, variances) arrays
+    def _fill_root ( self , histo , index , contents , variances ) :
+        if not len ( index ) : return histo
+        coords = array ( 'i' , [ 0 ] * self.ndim )
+        multi  = numpy.unravel_index ( index , self.__shape )
+        for k in range ( len ( index ) ) :
+            for d in range ( self.ndim ) : coords [ d ] = int ( multi [ d ] [ k ] ) + 1
+            b = histo.GetBin ( coords , True )
+            histo.SetBinContent ( b , float ( contents  [ k ] ) )
+            histo.SetBinError2  ( b , float ( variances [ k ] ) )
+        return histo
+
+    # =========================================================================
+    ## Convert to THnSparseD
+    def THnSparse ( self , name = '' , title = '' ) :
+        """ Convert to THnSparseD
+        """
+        return self._fill_root ( self.empty ( name , title ) , self.__index , self.__sumw , self.__sumw2 )
+
+    def __reduce__ ( self ) :
+        return SparseHisto , ( self.__edges , self.__index , self.__sumw , self.__sumw2 )
+
+    def __repr__ ( self ) : return 'SparseHisto(%s,%d bins filled)' % ( 'x'.join ( '%d' % n for n in self.__shape ) , len ( self ) )
+
+# =============================================================================
+## Fill sparse accepted/rejected histograms for the chain
+#  @param chain     the input chain
+#  @param edges     bin edges for all axes
+#  @param variables axis expressions
+#  @param criterion PID criterion
+#  @param cuts      cuts
+#  @param weight    weight expression
+#  @return (accepted, rejected) pair of sparse histograms
+def fill_sparse ( chain , edges , variables , criterion , cuts = '' , weight = '' ) :
+    """ Fill sparse accepted/rejected histograms for the chain
+    - return (accepted, rejected) pair of sparse histograms
+    """
+    values , accept , weights = read_columns ( chain , variables , criterion , cuts , weight )
+
+    accepted = SparseHisto ( edges )
+    rejected = SparseHisto ( edges )
+    accepted.fill ( [ v [  accept ] for v in values ] , None if weights is None else weights [  accept ] )
+    rejected.fill ( [ v [ ~accept ] for v in values ] , None if weights is None else weights [ ~accept ] )
+    return accepted , rejected
+
+# =============================================================================
+## @class SparseTask
+#  Task for the parallel filling of sparse accepted/rejected histograms
+#  - each item is (tree_path, files) unit
+class SparseTask(Task) :
+    """ Task for the parallel filling of sparse accepted/rejected histograms
+    - each item is (tree_path, files) unit
+    """
+    def __init__ ( self , edges , variables , criterion , cuts = '' , weight = '' , friends = None ) :
+
+        self.__edges     = tuple ( tuple ( e ) for e in edges )
+        self.__variables = tuple ( variables )
+        self.__criterion = criterion
+        self.__cuts      = str ( cuts )
+        self.__weight    = weight
+        self.__friends   = friends
+        self.__partials  = []
+
+    ## local initialization (executed once in parent process)
+    def initialize_local ( self ) :
+        self.__partials = []
+
+    # =========================================================================
+    ## the actual processing of (tree_path, files) unit
+    def process ( self , jobid , item ) :
+        """ The actual processing of (tree_path, files) unit
+        """
+        tree_path , files = item
+        chain = calibration_chain ( tree_path , files , self.__friends )
+        return fill_sparse ( chain , self.__edges , self.__variables , self.__criterion , self.__cuts , self.__weight )
+
+    ## merge results: keep the partials
+    def merge_results ( self , result , jobid = -1 ) :
+        if result : self.__partials.append ( result )
+
+    ## get the results: list of partials
+    def results ( self ) : return self.__partials
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  sweights.py
+#  sWeight friend files for the calibration samples
+#
+#  For the newer calibration samples the sWeights are stored in separate
+#  files (`sweight_dir` in the samples file of `pidcalib2`):
+#  <code>sweight_dir + stem ( calibration file ) + '_sweights.root'</code>
+#  with the same tree paths and the branch `sweight`.
+#
+#  The sWeight trees are attached as friends and read in lockstep with
+#  the calibration trees, only the sWeight baskets are read from
+#  the friend files, no joined data are materialized
+#
+#  - the mapping of calibration files to sWeight files is configurable
+#  - the files with misaligned sWeights (different number of entries or
+#    reordering with `order_index`) are skipped, as in `pidcalib2`
+#  - the entries with NaN sWeights are rejected by the additional cut
+#
+#  @code
+#  friends = SWeightFriends ( sweight_dir = '/eos/.../sweights/' )
+#  chain   = friends.chain ( tree_path , files )
+#  chain.Project ( 'h1' , 'probe_P' , '(%s)*sweight' % friends.cuts )
+#  @endcode
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" sWeight friend files for the calibration samples
+
+For the newer calibration samples the sWeights are stored in separate
+files (`sweight_dir` in the samples file of `pidcalib2`):
+`sweight_dir + stem ( calibration file ) + '_sweights.root'`
+with the same tree paths and the branch `sweight`.
+
+The sWeight trees are attached as friends and read in lockstep with
+the calibration trees, only the sWeight baskets are read from
+the friend files, no joined data are materialized
+
+- the mapping of calibration files to sWeight files is configurable
+- the files with misaligned sWeights (different number of entries or
+  reordering with `order_index`) are skipped, as in `pidcalib2`
+- the entries with NaN sWeights are rejected by the additional cut
+
+>>> friends = SWeightFriends ( sweight_dir = '/eos/.../sweights/' )
+>>> chain   = friends.chain ( tree_path , files )
+>>> chain.Project ( 'h1' , 'probe_P' , '(%s)*sweight' % friends.cuts )
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'SWeightFriends'    , ## sWeight friend files for the calibration samples
+    'calibration_chain' , ## calibration chain with (optional) sWeight friends
+)
+# =============================================================================
+from   pidcalib.partials import signature, file_identity
+import os
+import ROOT
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.sweights')
+# =============================================================================
+## the alias of the friend trees
+ALIAS = 'pidcalib_sw'
+# =============================================================================
+## @class SWeightFriends
+#  sWeight friend files for the calibration samples
+#  @code
+#  friends = SWeightFriends ( sweight_dir = '/eos/.../sweights/' )
+#  chain   = friends.chain ( tree_path , files )
+#  @endcode
+#  - the mapping can be a dictionary { calibration file : sWeight file }
+#    or a function; the functions should be picklable for the parallel processing
+class SWeightFriends(object) :
+    """ sWeight friend files for the calibration samples
+    >>> friends = SWeightFriends ( sweight_dir = '/eos/.../sweights/' )
+    >>> chain   = friends.chain ( tree_path , files )
+    - the mapping can be a dictionary { calibration file : sWeight file }
+      or a function; the functions should be picklable for the parallel processing
+    """
+    def __init__ ( self               ,
+                   sweight_dir = ''   ,
+                   mapping     = None ,
+                   branch      = 'sweight' ,
+                   cache_size  = 10 * 1024 * 1024 ) :
+
+        assert sweight_dir or mapping , "SWeightFriends: `sweight_dir` or `mapping` must be specified!"
+        self.__sweight_dir = str ( sweight_dir ) if sweight_dir else ''
+        self.__mapping     = mapping
+        self.__branch      = branch
+        self.__cache_size  = cache_size
+        self.__aligned     = {}
+
+    @property
+    def sweight_dir ( self ) :
+        """`sweight_dir` : the directory with sWeight files"""
+        return self.__sweight_dir
+
+    @property
+    def branch ( self ) :
+        """`branch` : the sWeight branch in the friend trees"""
+        return self.__branch
+
+    @property
+    def cuts ( self ) :
+        """`cuts` : reject the entries with NaN sWeights"""
+        return '%s==%s' % ( self.__branch , self.__branch )
+
+    # =========================================================================
+    ## The sWeight file for the calibration file
+    #  - the default is <code>sweight_dir + stem + '_sweights.root'</code>, as in `pidcalib2`
+    def friend_file ( self , fname ) :
+        """ The sWeight file for the calibration file
+        - the default is `sweight_dir + stem + '_sweights.root'`, as in `pidcalib2`
+        """
+        if isinstance ( self.__mapping , dict ) : return self.__mapping [ fname ]
+        if self.__mapping                       : return self.__mapping ( fname )
+        stem = os.path.splitext ( os.path.basename ( fname ) ) [ 0 ]
+        return '%s%s_sweights.root' % ( self.__sweight_dir , stem )
+
+    # =========================================================================
+    ## Signature of the sWeight file for the calibration file
+    #  @return (sWeight file, signature) pair
+    #  @see pidcalib.partials.signature
+    def signature ( self , fname , checksum = False ) :
+        """ Signature of the sWeight file for the calibration file
+        - return (sWeight file, signature) pair
+        - see pidcalib.partials.signature
+        """
+        sfile = self.friend_file ( fname )
+        return sfile , signature ( sfile , checksum = checksum )
+
+    ## Identity of the sWeights for the calibration files: branch, sWeight files and
+    #  the signatures of the local sWeight files (remote files are not opened)
+    #  @see pidcalib.partials.file_identity 
+    def identity ( self , files ) :
+        """ Identity of the sWeights for the calibration files: branch, sWeight files and
+        the signatures of the local sWeight files (remote files are not opened)
+        - see pidcalib.partials.file_identity 
+        """
+        return ( 'sweights' , self.__branch , tuple ( file_identity ( self.friend_file ( f ) ) for f in files ) ) 
+
+    # =========================================================================
+    ## Are the sWeights aligned with the calibration tree? (cached)
+    #  - the same number of entries and no reordering with `order_index`
+    def aligned ( self , fname , tree_path ) :
+        """ Are the sWeights aligned with the calibration tree? (cached)
+        - the same number of entries and no reordering with `order_index`
+        """
+        key = fname , tree_path
+        if key in self.__aligned : return self.__aligned [ key ]
+
+        sfile  = self.friend_file ( fname )
+        result = False
+        f1     = ROOT.TFile.Open ( fname , 'READ' )
+        f2     = ROOT.TFile.Open ( sfile , 'READ' )
+        try :
+            t1 = f1.Get ( tree_path ) if f1 and not f1.IsZombie () else None
+            t2 = f2.Get ( tree_path ) if f2 and not f2.IsZombie () else None
+            if not t1 or not t2 :
+                logger.warning ( "Cannot read %s from %s/%s, skip the file" % ( tree_path , fname , sfile ) )
+            elif not t2.GetBranch ( self.__branch ) :
+                logger.warning ( "No `%s` branch in %s, skip the file" % ( self.__branch , sfile ) )
+            elif t2.GetBranch ( 'order_index' ) :
+                logger.warning ( "sWeights in %s are reordered with `order_index`, skip the file" % sfile )
+            elif t1.GetEntries () != t2.GetEntries () :
+                logger.warning ( "sWeight length mismatch for %s: %d != %d, skip the file" % ( fname ,
+                                                                                            t1.GetEntries () ,
+                                                                                            t2.GetEntries () ) )
+            else :
+                result = True
+        finally :
+            if f1 : f1.Close ()
+            if f2 : f2.Close ()
+
+        self.__aligned [ key ] = result
+        return result
+
+    # =========================================================================
+    ## Configure the friend: only the sWeight branch is active and cached
+    def __configure ( self , friend ) :
+        friend.SetBranchStatus ( '*'           , 0 )
+        friend.SetBranchStatus ( self.__branch , 1 )
+        if self.__cache_size :
+            friend.SetCacheSize      ( self.__cache_size )
+            friend.AddBranchToCache  ( self.__branch , True )
+            friend.StopCacheLearningPhase ()
+
+    # =========================================================================
+    ## Create the calibration chain with sWeight friends attached
+    #  - the files with misaligned sWeights are skipped
+    #  @return TChain
+    def chain ( self , tree_path , files ) :
+        """ Create the calibration chain with sWeight friends attached
+        - the files with misaligned sWeights are skipped
+        - return TChain
+        """
+        chain  = ROOT.TChain ( tree_path )
+        friend = ROOT.TChain ( tree_path )
+        for fname in files :
+            if not self.aligned ( fname , tree_path ) : continue
+            chain .Add ( fname )
+            friend.Add ( self.friend_file ( fname ) )
+        self.__configure ( friend )
+        chain.AddFriend ( friend , ALIAS )
+        chain._pidcalib_friend = friend ## keep the friend alive
+        return chain
+
+    # =========================================================================
+    ## Attach sWeight friend to the tree from the calibration file
+    #  @return `True` if attached, `False` for misaligned sWeights
+    def attach ( self , tree , tree_path , fname ) :
+        """ Attach sWeight friend to the tree from the calibration file
+        - return `True` if attached, `False` for misaligned sWeights
+        """
+        if not self.aligned ( fname , tree_path ) : return False
+        friend = ROOT.TChain ( tree_path )
+        friend.Add ( self.friend_file ( fname ) )
+        self.__configure ( friend )
+        tree.AddFriend ( friend , ALIAS )
+        tree._pidcalib_friend = friend ## keep the friend alive
+        return True
+
+    def __getstate__ ( self ) :
+        state = dict ( self.__dict__ )
+        state [ '_SWeightFriends__aligned' ] = {}
+        return state
+
+    def __repr__ ( self ) : return 'SWeightFriends(%s)' % ( self.__sweight_dir if self.__sweight_dir else 'mapping' )
+
+# =============================================================================
+## Create the calibration chain with (optional) sWeight friends
+#  @param tree_path the tree path
+#  @param files     the calibration files
+#  @param friends   the sWeight friends or `None`
+#  @return TChain
+def calibration_chain ( tree_path , files , friends = None ) :
+    """ Create the calibration chain with (optional) sWeight friends
+    - tree_path : the tree path
+    - files     : the calibration files
+    - friends   : the sWeight friends or `None`
+    - return TChain
+    """
+    if friends : return friends.chain ( tree_path , files )
+    chain = ROOT.TChain ( tree_path )
+    for fname in files : chain.Add ( fname )
+    return chain
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
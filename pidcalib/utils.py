@@ -0,0 +1,289 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  utils.py
+#  Some purely technical utilities for PidGen/PidCorr & PidCalib wrappers
+#  - memory estimates and memory-aware scheduling of work units
+#  - light-weight transport of large arrays to the worker processes
+#  - persistent caches and processing statistics 
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2025-07-12
+# =============================================================================
+""" Some purely technical utilities for PidGen/PidCorr & PidCalib wrappers
+- memory estimates and memory-aware scheduling of work units
+- light-weight transport of large arrays to the worker processes
+- persistent caches and processing statistics 
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2025-07-12"
+__all__     = (
+    'MB'           , ## one megabyte
+    'rss'          , ## resident memory of the current process (in bytes)
+    'file_size'    , ## size of the (local) file (in bytes)
+    'SharedArray'  , ## numpy array published once via memory-mapped file 
+    'cache_dir'    , ## local directory for persistent caches
+    'used_branches', ## branches used by the expressions 
+    'read_range'   , ## read the columns for the range of entries 
+    'Throughput'   , ## measured processing throughput, persistent between sessions
+)
+# =============================================================================
+import os, re, json, time, tempfile, numpy 
+# =============================================================================
+## Logging
+# =============================================================================
+from   ostap.logger.logger import getLogger
+logger = getLogger ( 'ostap.pidcalib.utils' )
+# =============================================================================
+## one megabyte
+MB = 1024 * 1024
+# =============================================================================
+## Resident memory of the current process (in bytes)
+#  - use `psutil` if available, otherwise `/proc/self/statm` or `resource`
+def rss () :
+    """ Resident memory of the current process (in bytes)
+    - use `psutil` if available, otherwise `/proc/self/statm` or `resource`
+    """
+    try :
+        import psutil
+        return psutil.Process ( os.getpid () ).memory_info ().rss
+    except ImportError :
+        pass
+    ##
+    try :
+        with open ( '/proc/self/statm' , 'r' ) as f :
+            return int ( f.read().split() [ 1 ] ) * os.sysconf ( 'SC_PAGE_SIZE' )
+    except ( OSError , ValueError , IndexError ) :
+        pass
+    ##
+    import resource, sys
+    peak = resource.getrusage ( resource.RUSAGE_SELF ).ru_maxrss
+    ## kilobytes on Linux, bytes on MacOS
+    return peak if 'darwin' == sys.platform else peak * 1024
+
+# =============================================================================
+## Size of the (local) file in bytes, 0 for non-existing/remote files
+def file_size ( fname ) :
+    """ Size of the (local) file in bytes, 0 for non-existing/remote files
+    """
+    try :
+        return os.path.getsize ( fname ) if os.path.isfile ( fname ) else 0
+    except OSError :
+        return 0
+
+# =============================================================================
+## @class SharedArray
+#  Numpy array, published once via the memory-mapped file
+#  - only the light-weight handle is serialized/pickled
+#  - the array is memory-mapped (read-only) in the worker processes,
+#    the mapping is cached per process 
+#  @code
+#  handle = SharedArray ( array ) 
+#  ... 
+#  data   = handle.array 
+#  @endcode
+class SharedArray(object) :
+    """ Numpy array, published once via the memory-mapped file
+    - only the light-weight handle is serialized/pickled
+    - the array is memory-mapped (read-only) in the worker processes,
+      the mapping is cached per process 
+    >>> handle = SharedArray ( array ) 
+    >>> ... 
+    >>> data   = handle.array 
+    """
+    ## mapped arrays in the current process: { path : array } 
+    __mapped = {}
+    
+    def __init__ ( self , array , directory = None ) :
+        
+        array = numpy.ascontiguousarray ( array )
+        if directory is None : 
+            import ostap.utils.cleanup as CU 
+            directory = CU.CleanUp.tempdir ( prefix = 'ostap-pidcalib-shared-' )
+            
+        fd , path = tempfile.mkstemp ( suffix = '.npy' , dir = directory )
+        os.close ( fd ) 
+        numpy.save ( path , array )
+        
+        self.__path  = path
+        self.__shape = array.shape 
+        self.__dtype = array.dtype.str
+        
+        ## no need to map it in the current process 
+        self.__mapped [ path ] = array
+        
+    @property
+    def path ( self ) :
+        """`path` : the path to the memory-mapped file"""
+        return self.__path
+    
+    @property
+    def shape ( self ) :
+        """`shape` : the shape of the array"""
+        return self.__shape
+
+    @property
+    def array ( self ) :
+        """`array` : get the (memory-mapped) array"""
+        array = self.__mapped.get ( self.__path , None )
+        if array is None :
+            array = numpy.load ( self.__path , mmap_mode = 'r' )
+            self.__mapped [ self.__path ] = array
+        return array
+    
+    def __len__  ( self ) : return self.__shape [ 0 ] if self.__shape else 0
+    def __repr__ ( self ) : return 'SharedArray(%s,%s,%s)' % ( self.__path , self.__shape , self.__dtype ) 
+    
+# =============================================================================
+## Local directory for persistent caches
+#  - `$PIDCALIB_CACHE_DIR` if defined, otherwise `~/.cache/pidcalib`
+#  @param subdir (optional) subdirectory 
+def cache_dir ( subdir = '' ) :
+    """ Local directory for persistent caches
+    - `$PIDCALIB_CACHE_DIR` if defined, otherwise `~/.cache/pidcalib`
+    """
+    top = os.environ.get ( 'PIDCALIB_CACHE_DIR' , '' ) or \
+        os.path.join ( os.path.expanduser ( '~' ) , '.cache' , 'pidcalib' )
+    the_dir = os.path.join ( top , subdir ) if subdir else top
+    os.makedirs ( the_dir , exist_ok = True )
+    return the_dir
+
+# =============================================================================
+## regular expression for the (potential) names in the expressions
+_names_re = re.compile ( r'[A-Za-z_][A-Za-z0-9_\.]*' )
+# =============================================================================
+## Get the branches used by the expressions
+#  @code
+#  names    = tree.branches () 
+#  branches = used_branches ( names , 'log10(probe_P/1000)' , 'probe_ETA>2' )
+#  @endcode 
+#  @param names       known branch names
+#  @param expressions the expressions
+#  @return sorted tuple of used branch names 
+def used_branches ( names , *expressions ) :
+    """ Get the branches used by the expressions
+    >>> names    = tree.branches () 
+    >>> branches = used_branches ( names , 'log10(probe_P/1000)' , 'probe_ETA>2' )
+    """
+    names = set ( names )
+    used  = set ()
+    for expression in expressions :
+        if not expression : continue 
+        for token in _names_re.findall ( str ( expression ) ) :
+            if token in names : used.add ( token )
+    return tuple ( sorted ( used ) )
+
+# =============================================================================
+## Read the columns for the range of entries [first,last)
+#  - only the entries in the range are read (<code>TTree::Draw</code> with 
+#    <code>nentries</code> and <code>firstentry</code>), no full scan of the tree
+#  @code
+#  data = read_range ( tree , [ 'pi_PT' , 'pi_ETA' ] , 100000 , 200000 , cuts = 'pi_PT>500' )
+#  @endcode
+#  @param tree        the tree
+#  @param expressions the expressions to read 
+#  @param first       the first entry
+#  @param last        the last entry (exclusive)
+#  @param cuts        the selection
+#  @return array of shape (number of selected entries, number of expressions)
+def read_range ( tree , expressions , first , last , cuts = '' ) :
+    """ Read the columns for the range of entries [first,last)
+    - only the entries in the range are read (`TTree::Draw` with
+      `nentries` and `firstentry`), no full scan of the tree 
+    >>> data = read_range ( tree , [ 'pi_PT' , 'pi_ETA' ] , 100000 , 200000 , cuts = 'pi_PT>500' )
+    - return array of shape (number of selected entries, number of expressions)
+    """
+    expressions = tuple ( str ( e ) for e in expressions )
+    assert expressions , "read_range: no expressions are specified!"
+    
+    estimate = tree.GetEstimate ()
+    tree.SetEstimate ( max ( last - first , 0 ) + 1 )
+    try :
+        n = tree.Draw ( ':'.join ( expressions ) , str ( cuts ) if cuts else '' , 'goff' , last - first , first )
+        n = max ( n , 0 ) 
+        columns = []
+        for i in range ( len ( expressions ) ) :
+            column = numpy.empty ( 0 )
+            if n :
+                view = tree.GetVal ( i )
+                view.reshape ( ( n , ) )
+                column = numpy.frombuffer ( view , dtype = numpy.float64 , count = n ).copy ()
+            columns.append ( column )
+    finally :
+        tree.SetEstimate ( estimate )
+        
+    return numpy.column_stack ( columns ) 
+
+# =============================================================================
+## @class Throughput
+#  Measured processing throughput (items/second), persistent between sessions
+#  @code
+#  Throughput.update ( 'PidGen' , 100000 , 5.1 ) ## 100000 items in 5.1 seconds
+#  rate = Throughput.rate ( 'PidGen' , default = 10000 ) 
+#  @endcode
+class Throughput(object) :
+    """ Measured processing throughput (items/second), persistent between sessions
+    >>> Throughput.update ( 'PidGen' , 100000 , 5.1 ) ## 100000 items in 5.1 seconds
+    >>> rate = Throughput.rate ( 'PidGen' , default = 10000 ) 
+    """
+    FILENAME = 'throughput.json'
+    
+    @classmethod
+    def filename ( klass ) :
+        """ The file with throughput records """
+        return os.path.join ( cache_dir () , klass.FILENAME )
+    
+    @classmethod
+    def load ( klass ) :
+        """ Load all throughput records """
+        try : 
+            with open ( klass.filename () , 'r' ) as f : return json.load ( f )
+        except ( OSError , ValueError ) :
+            return {}
+
+    @classmethod
+    def update ( klass , key , items , seconds ) :
+        """ Add the measurement: `items` processed in `seconds`
+        - the read-modify-write is serialized with the lock file (if `fcntl` is available)
+        - the failures (e.g. read-only cache directory) are reported, but not propagated 
+        """
+        if items <= 0 or seconds <= 0 : return 
+        try :
+            the_dir = os.path.dirname ( klass.filename () )
+            with open ( klass.filename () + '.lock' , 'a' ) as lock :
+                try :
+                    import fcntl
+                    fcntl.flock ( lock , fcntl.LOCK_EX )
+                except ImportError :
+                    pass 
+                records = klass.load ()
+                record  = records.get ( key , {} )
+                record [ 'items'   ] = record.get ( 'items'   , 0   ) + items
+                record [ 'seconds' ] = record.get ( 'seconds' , 0.0 ) + seconds
+                record [ 'updated' ] = time.time ()
+                records [ key ] = record
+                ## atomic write 
+                fd , tmp = tempfile.mkstemp ( suffix = '.json' , dir = the_dir )
+                with os.fdopen ( fd , 'w' ) as f : json.dump ( records , f )
+                os.replace ( tmp , klass.filename () )
+        except OSError as e :
+            logger.warning ( "Cannot record the throughput for `%s`: %s" % ( key , e ) )
+        
+    @classmethod
+    def rate ( klass , key , default = -1 ) :
+        """ Get the measured throughput (items/second) """
+        record = klass.load ().get ( key , {} )
+        if 0 < record.get ( 'items' , 0 ) and 0 < record.get ( 'seconds' , 0 ) :
+            return record [ 'items' ] / record [ 'seconds' ]
+        return default 
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  vectorized.py
+#  Native NumPy backend for the PIDCalib histogram filling
+#
+#  - only the branches used by the criterion, cuts, axes and sWeight are read,
+#    file-by-file, as NumPy arrays
+#  - the criterion, cuts, axes and weight (TFormula-like expressions) are
+#    translated into vectorized NumPy expressions
+#  - accepted/rejected are filled with weighted <code>numpy.bincount</code>
+#    on the template binning (including underflow/overflow bins)
+#  - the result is converted back into the same TH1/TH2/TH3 histograms
+#
+#  @code
+#  expr = Expression ( 'log10(probe_P/1000)>1 && probe_ETA<4.5' , names )
+#  mask = expr ( arrays )
+#  task = NumpyTask ( histo , variables , criterion , cuts , weight )
+#  @endcode
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Native NumPy backend for the PIDCalib histogram filling
+
+- only the branches used by the criterion, cuts, axes and sWeight are read,
+  file-by-file, as NumPy arrays
+- the criterion, cuts, axes and weight (TFormula-like expressions) are
+  translated into vectorized NumPy expressions
+- accepted/rejected are filled with weighted `numpy.bincount`
+  on the template binning (including underflow/overflow bins)
+- the result is converted back into the same TH1/TH2/TH3 histograms
+
+>>> expr = Expression ( 'log10(probe_P/1000)>1 && probe_ETA<4.5' , names )
+>>> mask = expr ( arrays )
+>>> task = NumpyTask ( histo , variables , criterion , cuts , weight )
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'Expression'   , ## TFormula-like expression as vectorized NumPy expression
+    'vectorizable' , ## can the expressions be translated?
+    'fill_arrays'  , ## fill accepted/rejected arrays for the calibration tree
+    'to_histo'     , ## convert the arrays into the histogram
+    'NumpyTask'    , ## task for the parallel NumPy filling
+)
+# =============================================================================
+from   ostap.parallel.task import Task
+from   pidcalib.fill       import axis_edges
+from   pidcalib.sweights   import calibration_chain
+import re, ast, numpy
+import ROOT
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.vectorized')
+# =============================================================================
+## supported functions
+_FUNCTIONS = {
+    'log10' : numpy.log10   , 'Log10' : numpy.log10   ,
+    'log'   : numpy.log     , 'Log'   : numpy.log     ,
+    'exp'   : numpy.exp     , 'Exp'   : numpy.exp     ,
+    'sqrt'  : numpy.sqrt    , 'Sqrt'  : numpy.sqrt    ,
+    'abs'   : numpy.abs     , 'Abs'   : numpy.abs     , 'fabs' : numpy.abs ,
+    'pow'   : numpy.power   , 'Power' : numpy.power   ,
+    'sin'   : numpy.sin     , 'Sin'   : numpy.sin     ,
+    'cos'   : numpy.cos     , 'Cos'   : numpy.cos     ,
+    'tan'   : numpy.tan     , 'Tan'   : numpy.tan     ,
+    'asin'  : numpy.arcsin  , 'ASin'  : numpy.arcsin  ,
+    'acos'  : numpy.arccos  , 'ACos'  : numpy.arccos  ,
+    'atan'  : numpy.arctan  , 'ATan'  : numpy.arctan  ,
+    'atan2' : numpy.arctan2 , 'ATan2' : numpy.arctan2 ,
+    'sinh'  : numpy.sinh    , 'cosh'  : numpy.cosh    , 'tanh' : numpy.tanh ,
+    'min'   : numpy.minimum , 'Min'   : numpy.minimum ,
+    'max'   : numpy.maximum , 'Max'   : numpy.maximum ,
+    'floor' : numpy.floor   , 'Floor' : numpy.floor   ,
+    'ceil'  : numpy.ceil    , 'Ceil'  : numpy.ceil    ,
+}
+## allowed AST nodes
+_ALLOWED = ( ast.Expression , ast.BinOp , ast.UnaryOp , ast.Compare , ast.Call ,
+             ast.Name , ast.Load , ast.Constant ,
+             ast.Add , ast.Sub , ast.Mult , ast.Div , ast.Mod , ast.Pow ,
+             ast.USub , ast.UAdd ,
+             ast.Lt , ast.LtE , ast.Gt , ast.GtE , ast.Eq , ast.NotEq )
+## the names in the expression (not preceded by digits, dots or names)
+_names_re = re.compile ( r'(?<![\w\.])[A-Za-z_][A-Za-z0-9_\.]*' )
+# =============================================================================
+## @class _Vectorize
+#  Replace boolean operations and chained comparisons by NumPy logical functions
+class _Vectorize(ast.NodeTransformer) :
+    """ Replace boolean operations and chained comparisons by NumPy logical functions
+    """
+    @staticmethod
+    def _call ( func , *args ) :
+        return ast.Call ( func = ast.Name ( id = func , ctx = ast.Load () ) , args = list ( args ) , keywords = [] )
+
+    def visit_BoolOp ( self , node ) :
+        self.generic_visit ( node )
+        func   = 'logical_and' if isinstance ( node.op , ast.And ) else 'logical_or'
+        result = node.values [ 0 ]
+        for v in node.values [ 1 : ] : result = self._call ( func , result , v )
+        return result
+
+    def visit_UnaryOp ( self , node ) :
+        self.generic_visit ( node )
+        ## `!` is translated into `~` to keep its C precedence (it binds to the immediate operand)
+        if isinstance ( node.op , ast.Invert ) : return self._call ( 'logical_not' , node.operand )
+        return node
+
+    def visit_Compare ( self , node ) :
+        self.generic_visit ( node )
+        if 1 == len ( node.ops ) : return node
+        left , parts = node.left , []
+        for op , right in zip ( node.ops , node.comparators ) :
+            parts.append ( ast.Compare ( left = left , ops = [ op ] , comparators = [ right ] ) )
+            left = right
+        result = parts [ 0 ]
+        for p in parts [ 1 : ] : result = self._call ( 'logical_and' , result , p )
+        return result
+
+# =============================================================================
+## @class Expression
+#  TFormula-like expression as vectorized NumPy expression
+#  - <code>&&</code>, <code>||</code>, <code>!</code>, <code>^</code> (power),
+#    <code>TMath::</code> functions and chained comparisons are supported
+#  - <code>!</code> binds to the immediate operand, as in C: <code>!x>1</code> is <code>(!x)>1</code>
+#  - ValueError is raised for unsupported constructions
+#  @code
+#  expr = Expression ( 'log10(probe_P/1000)>1 && probe_ETA<4.5' , names )
+#  mask = expr ( arrays ) ## arrays : { branch : array }
+#  @endcode
+class Expression(object) :
+    """ TFormula-like expression as vectorized NumPy expression
+    - `&&`, `||`, `!`, `^` (power), `TMath::` functions and chained comparisons are supported
+    - `!` binds to the immediate operand, as in C: `!x>1` is `(!x)>1`
+    - ValueError is raised for unsupported constructions
+    >>> expr = Expression ( 'log10(probe_P/1000)>1 && probe_ETA<4.5' , names )
+    >>> mask = expr ( arrays ) ## arrays : { branch : array }
+    """
+    def __init__ ( self , expression , names ) :
+
+        self.__expression = str ( expression ).strip ()
+        names   = set ( names )
+        columns = []
+
+        if '~' in self.__expression :
+            raise ValueError ( "Expression: unsupported operator `~` in `%s`" % self.__expression )
+        
+        expr = self.__expression.replace ( 'TMath::' , '' ).replace ( 'std::' , '' )
+        expr = expr.replace ( '&&' , ' and ' ).replace ( '||' , ' or ' ).replace ( '^' , '**' )
+        expr = re.sub ( r'!(?!=)' , '~' , expr )
+
+        def _replace ( match ) :
+            token = match.group ( 0 )
+            if token in ( 'and' , 'or' ) : return token
+            if token in names :
+                if not token in columns : columns.append ( token )
+                return '_c%d' % columns.index ( token )
+            if token in _FUNCTIONS : return token
+            if token in ( 'true' , 'false' ) : return '1' if 'true' == token else '0'
+            raise ValueError ( "Expression: unknown name `%s` in `%s`" % ( token , self.__expression ) )
+
+        expr = _names_re.sub ( _replace , expr ).strip ()
+        try :
+            tree = ast.parse ( expr , mode = 'eval' )
+        except SyntaxError :
+            raise ValueError ( "Expression: cannot parse `%s`" % self.__expression )
+
+        tree = ast.fix_missing_locations ( _Vectorize ().visit ( tree ) )
+        top  = tree.body 
+        self.__boolean = isinstance ( top , ast.Compare ) or \
+                         ( isinstance ( top , ast.Call     ) and isinstance ( top.func , ast.Name ) and top.func.id.startswith ( 'logical_' ) ) or \
+                         ( isinstance ( top , ast.Constant ) and top.value in ( 0 , 1 ) )
+        for node in ast.walk ( tree ) :
+            if isinstance ( node , ast.Call ) and not ( isinstance ( node.func , ast.Name ) and
+                                                        ( node.func.id in _FUNCTIONS or node.func.id.startswith ( 'logical_' ) ) ) :
+                raise ValueError ( "Expression: unsupported call in `%s`" % self.__expression )
+            if not isinstance ( node , _ALLOWED ) :
+                raise ValueError ( "Expression: unsupported construction `%s` in `%s`" % ( type ( node ).__name__ , self.__expression ) )
+
+        self.__columns = tuple ( columns )
+        self.__code    = compile ( tree , '<%s>' % self.__expression , 'eval' )
+
+    @property
+    def expression ( self ) :
+        """`expression` : the original expression"""
+        return self.__expression
+
+    @property
+    def columns ( self ) :
+        """`columns` : the branches used by the expression"""
+        return self.__columns
+
+    @property
+    def boolean ( self ) :
+        """`boolean` : is the expression a comparison, logical operation or 0/1 constant?"""
+        return self.__boolean
+
+    ## evaluate the expression for the arrays { branch : array } of length n
+    def __call__ ( self , arrays , n = None ) :
+        """ Evaluate the expression for the arrays { branch : array } of length n
+        """
+        env = dict ( _FUNCTIONS )
+        env.update ( logical_and = numpy.logical_and ,
+                     logical_or  = numpy.logical_or  ,
+                     logical_not = numpy.logical_not )
+        for i , c in enumerate ( self.__columns ) : env [ '_c%d' % i ] = arrays [ c ]
+        result = eval ( self.__code , { '__builtins__' : {} } , env )
+        if n is not None and numpy.ndim ( result ) == 0 : result = numpy.full ( n , result )
+        return result
+
+    def __repr__ ( self ) : return 'Expression(%s)' % self.__expression
+
+# =============================================================================
+## The branch names of the tree/chain (including the friends)
+def _branch_names ( tree ) :
+    if isinstance ( tree , ROOT.TChain ) and 0 < tree.GetNtrees () : tree.LoadTree ( 0 )
+    names = set ( b.GetName () for b in tree.GetListOfBranches () ) | \
+            set ( l.GetName () for l in tree.GetListOfLeaves   () )
+    for fe in ( tree.GetListOfFriends () or () ) :
+        friend = fe.GetTree ()
+        if friend : names |= set ( b.GetName () for b in friend.GetListOfBranches () )
+    return names 
+
+## Is the expression a boolean selection for the tree?
+#  - comparisons, logical operations, 0/1 constants and <code>Bool_t</code> branches
+def _boolean ( tree , expression ) :
+    if expression.boolean : return True
+    if 1 != len ( expression.columns ) or expression.columns [ 0 ] != expression.expression : return False
+    leaf = tree.GetLeaf ( expression.expression )
+    return bool ( leaf ) and 'Bool_t' == leaf.GetTypeName ()
+
+## Can the expressions be translated into vectorized NumPy expressions for the tree?
+#  - the selections (criterion & cuts) must be boolean: the ROOT backend uses
+#    a non-boolean selection value as a weight 
+#  @param expressions the expressions (axes & weight)
+#  @param selections  the selections (criterion & cuts) 
+#  @return `None` if all expressions are translated, otherwise the error message
+def vectorizable ( tree , *expressions , selections = () ) :
+    """ Can the expressions be translated into vectorized NumPy expressions for the tree?
+    - the selections (criterion & cuts) must be boolean: the ROOT backend uses
+      a non-boolean selection value as a weight 
+    - expressions : the expressions (axes & weight)
+    - selections  : the selections (criterion & cuts) 
+    - return `None` if all expressions are translated, otherwise the error message
+    """
+    names = _branch_names ( tree )
+    try :
+        for e in expressions :
+            if e and str ( e ).strip () : Expression ( e , names )
+        for e in selections :
+            if e and str ( e ).strip () and not _boolean ( tree , Expression ( e , names ) ) :
+                return "non-boolean selection `%s`" % str ( e ).strip () 
+    except ValueError as e :
+        return str ( e )
+    return None
+
+# =============================================================================
+## ROOT global bin indices (including underflow & overflow) for the values
+def _cells ( values , edges ) :
+    index , stride = 0 , 1
+    for v , e in zip ( values , edges ) :
+        index  = index + stride * numpy.searchsorted ( e , v , side = 'right' )
+        stride = stride * ( len ( e ) + 1 )
+    return index
+
+## bin edges of the template histogram
+def _edges ( histo ) :
+    axes = ( histo.GetXaxis () , histo.GetYaxis () , histo.GetZaxis () ) [ : histo.GetDimension () ]
+    return [ numpy.asarray ( axis_edges ( a ) ) for a in axes ]
+
+# =============================================================================
+## Evaluate the selection as a boolean mask
+#  - ValueError is raised for non-boolean values: the ROOT backend uses them as weights 
+def _mask ( expression , data , n ) :
+    values = numpy.asarray ( expression ( data , n ) )
+    if values.dtype != bool :
+        if not numpy.all ( ( 0 == values ) | ( 1 == values ) ) :
+            raise ValueError ( "fill_arrays: non-boolean selection `%s`" % expression.expression )
+        values = values.astype ( bool ) 
+    return values
+
+## Fill accepted/rejected arrays for the calibration tree
+#  - only the used branches are read
+#  - the criterion and cuts must be boolean, ValueError is raised otherwise
+#  @return (accepted, rejected) arrays of shape (3, number of cells):
+#          sum of weights, sum of squared weights and number of entries
+def fill_arrays ( tree , histo , variables , criterion , cuts = '' , weight = '' ) :
+    """ Fill accepted/rejected arrays for the calibration tree
+    - only the used branches are read
+    - the criterion and cuts must be boolean, ValueError is raised otherwise
+    - return (accepted, rejected) arrays of shape (3, number of cells):
+      sum of weights, sum of squared weights and number of entries
+    """
+    ncells   = histo.GetNcells ()
+    accepted = numpy.zeros ( ( 3 , ncells ) )
+    rejected = numpy.zeros ( ( 3 , ncells ) )
+    if not tree.GetEntries () : return accepted , rejected
+
+    names = _branch_names ( tree )
+    axes  = [ Expression ( v , names ) for v in variables ]
+    crit  = Expression ( criterion , names )
+    cuts  = str ( cuts ).strip () if cuts else ''
+    cut   = Expression ( cuts   , names ) if cuts   else None
+    wexp  = Expression ( weight , names ) if weight else None
+
+    columns = set ( crit.columns )
+    for e in axes + [ cut , wexp ] :
+        if e : columns |= set ( e.columns )
+
+    data  = ROOT.RDataFrame ( tree ).AsNumpy ( sorted ( columns ) )
+    data  = dict ( ( str ( k ) , numpy.asarray ( v ) ) for k , v in data.items () )
+    n     = tree.GetEntries ()
+
+    good  = _mask ( cut  , data , n ) if cut else numpy.ones ( n , dtype = bool )
+    acc   = _mask ( crit , data , n ) 
+    w     = numpy.asarray ( wexp ( data , n ) , dtype = numpy.float64 ) if wexp else numpy.ones ( n )
+    cells = _cells ( [ numpy.asarray ( a ( data , n ) , dtype = numpy.float64 ) for a in axes ] , _edges ( histo ) )
+
+    for mask , target in ( ( good & acc , accepted ) , ( good & ~acc , rejected ) ) :
+        i , x = cells [ mask ] , w [ mask ]
+        target [ 0 ] += numpy.bincount ( i , weights = x     , minlength = ncells )
+        target [ 1 ] += numpy.bincount ( i , weights = x * x , minlength = ncells )
+        target [ 2 ] += numpy.bincount ( i ,                   minlength = ncells )
+    return accepted , rejected
+
+# =============================================================================
+## Convert the (sum of weights, sum of squared weights, entries) array into the histogram
+#  @param histo the template histogram
+#  @param array array of shape (3, number of cells)
+def to_histo ( histo , array ) :
+    """ Convert the (sum of weights, sum of squared weights, entries) array into the histogram
+    - histo : the template histogram
+    - array : array of shape (3, number of cells)
+    """
+    h = histo.clone ()
+    h.Reset ()
+    if not h.GetSumw2N () : h.Sumw2 ()
+    sumw2 = h.GetSumw2 ()
+    for cell in range ( h.GetNcells () ) :
+        h.SetBinContent ( cell , float ( array [ 0 ] [ cell ] ) )
+        sumw2 [ cell ] = float ( array [ 1 ] [ cell ] )
+    h.SetEntries ( float ( array [ 2 ].sum () ) )
+    return h
+
+# =============================================================================
+## @class NumpyTask
+#  Task for the parallel NumPy filling
+#  - each item is (tree_path, files) unit
+#  - the partial results are NumPy arrays, cheap to pickle and to merge
+class NumpyTask(Task) :
+    """ Task for the parallel NumPy filling
+    - each item is (tree_path, files) unit
+    - the partial results are NumPy arrays, cheap to pickle and to merge
+    """
+    def __init__ ( self , histo , variables , criterion , cuts = '' , weight = '' , friends = None ) :
+
+        self.__histo     = histo
+        self.__variables = tuple ( variables )
+        self.__criterion = criterion
+        self.__cuts      = str ( cuts )
+        self.__weight    = weight
+        self.__friends   = friends
+        self.__output    = None
+
+    ## local initialization (executed once in parent process)
+    def initialize_local ( self ) :
+        self.__output = None
+
+    # =========================================================================
+    ## the actual processing of (tree_path, files) unit
+    def process ( self , jobid , item ) :
+        """ The actual processing of (tree_path, files) unit
+        """
+        tree_path , files = item
+        result = None
+        for fname in files :
+            chain = calibration_chain ( tree_path , [ fname ] , self.__friends )
+            a , r = fill_arrays ( chain , self.__histo , self.__variables , self.__criterion , self.__cuts , self.__weight )
+            if result is None : result = [ a , r ]
+            else :
+                result [ 0 ] += a
+                result [ 1 ] += r
+        return result
+
+    ## merge results
+    def merge_results ( self , result , jobid = -1 ) :
+        if result is None : return
+        if self.__output is None : self.__output = result
+        else :
+            self.__output [ 0 ] += result [ 0 ]
+            self.__output [ 1 ] += result [ 1 ]
+
+    ## get the results: (accepted, rejected) arrays or `None`
+    def results ( self ) : return self.__output
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
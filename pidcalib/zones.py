@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file  zones.py
+#  Per-file and per-cluster zone maps (min/max summaries) for calibration data
+#
+#  For the commonly used branches (probe_P, probe_ETA, probe_PT, nTracks, nSPDhits)
+#  the minimal and maximal values are stored per file and per cluster of entries.
+#  The files and clusters that provably cannot contribute to the histogram range
+#  or cannot pass the cuts are skipped.
+#
+#  The constraints are derived conservatively:
+#  - histogram axes with expressions `X`, `X/c`, `log10(X)`, `log10(X/c)`, `log(X)`, `log(X/c)`
+#  - cuts that are pure conjunctions (`&&`) of simple comparisons `X < c`, `c <= X`, ...
+#  All other expressions and cuts do not constrain anything
+#  The entries of the skipped files and clusters are not counted in the under/overflow bins
+#
+#  @code
+#  zmaps       = ZoneMaps ()
+#  constraints = zmaps.constraints ( histo , variables , cuts )
+#  kept , skipped , total = zmaps.select ( tree_path , files , constraints )
+#  @endcode
+#  @author Vanya BELYAEV Ivan.Belyaev@cern.ch
+#  @date   2014-05-10
+# =============================================================================
+""" Per-file and per-cluster zone maps (min/max summaries) for calibration data
+
+For the commonly used branches (probe_P, probe_ETA, probe_PT, nTracks, nSPDhits)
+the minimal and maximal values are stored per file and per cluster of entries.
+The files and clusters that provably cannot contribute to the histogram range
+or cannot pass the cuts are skipped.
+
+The constraints are derived conservatively:
+- histogram axes with expressions `X`, `X/c`, `log10(X)`, `log10(X/c)`, `log(X)`, `log(X/c)`
+- cuts that are pure conjunctions (`&&`) of simple comparisons `X < c`, `c <= X`, ...
+All other expressions and cuts do not constrain anything
+The entries of the skipped files and clusters are not counted in the under/overflow bins
+
+>>> zmaps       = ZoneMaps ()
+>>> constraints = zmaps.constraints ( histo , variables , cuts )
+>>> kept , skipped , total = zmaps.select ( tree_path , files , constraints )
+"""
+# =============================================================================
+__version__ = "$Revision$"
+__author__  = "Vanya BELYAEV Ivan.Belyaev@cern.ch"
+__date__    = "2014-05-10"
+__all__     = (
+    'ZoneMaps'      , ## per-file and per-cluster zone maps
+    'ZONE_BRANCHES' , ## default branches for zone maps
+)
+# =============================================================================
+from   pidcalib.utils    import cache_dir
+from   pidcalib.partials import signature
+import os, re, math, json, hashlib, tempfile, numpy
+import ROOT
+# =============================================================================
+from ostap.logger.logger import getLogger
+logger = getLogger('ostap.pidcalib.zones')
+# =============================================================================
+## default branches for zone maps
+ZONE_BRANCHES = ( 'probe_P' , 'probe_ETA' , 'probe_PT' , 'nTracks' , 'nSPDhits' )
+# =============================================================================
+_name   = r'([A-Za-z_][A-Za-z0-9_]*)'
+_number = r'([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)'
+## axis expressions: X, X/c, log10(X), log10(X/c), log(X), log(X/c)
+_axis_re = re.compile ( r'^\s*(?:(log10|log)\s*\(\s*)?%s\s*(?:/\s*%s\s*)?(\))?\s*$' % ( _name , _number ) )
+## simple comparisons: X op c  or c op X
+_cmp1_re = re.compile ( r'^\s*%s\s*(<=|<|>=|>)\s*%s\s*$' % ( _name   , _number ) )
+_cmp2_re = re.compile ( r'^\s*%s\s*(<=|<|>=|>)\s*%s\s*$' % ( _number , _name   ) )
+# =============================================================================
+## invert the axis expression: the range of the branch for the range of the expression
+def _axis_interval ( expression , low , high ) :
+    m = _axis_re.match ( expression )
+    if not m : return None
+    func , branch , scale , closing = m.groups ()
+    if bool ( func ) != bool ( closing ) : return None
+    scale = float ( scale ) if scale else 1.0
+    if scale <= 0 : return None
+    if   'log10' == func : low , high = 10 ** low        , 10 ** high
+    elif 'log'   == func : low , high = math.exp ( low ) , math.exp ( high )
+    return branch , low * scale , high * scale
+
+# =============================================================================
+## strip the outer parentheses
+def _strip ( term ) :
+    term = term.strip ()
+    while term.startswith ( '(' ) and term.endswith ( ')' ) :
+        depth = 0
+        for i , c in enumerate ( term ) :
+            if   '(' == c : depth += 1
+            elif ')' == c : depth -= 1
+            if 0 == depth and i < len ( term ) - 1 : return term
+        term = term [ 1 : -1 ].strip ()
+    return term
+
+# =============================================================================
+## @class ZoneMaps
+#  Per-file and per-cluster zone maps (min/max summaries) for calibration data
+#  - the maps are stored in the `zones` subdirectory of the local cache directory,
+#    validated with the file signature
+#  @code
+#  zmaps       = ZoneMaps ()
+#  constraints = zmaps.constraints ( histo , variables , cuts )
+#  kept , skipped , total = zmaps.select ( tree_path , files , constraints )
+#  @endcode
+class ZoneMaps(object) :
+    """ Per-file and per-cluster zone maps (min/max summaries) for calibration data
+    - the maps are stored in the `zones` subdirectory of the local cache directory,
+      validated with the file signature
+    >>> zmaps       = ZoneMaps ()
+    >>> constraints = zmaps.constraints ( histo , variables , cuts )
+    >>> kept , skipped , total = zmaps.select ( tree_path , files , constraints )
+    """
+    def __init__ ( self , branches = ZONE_BRANCHES , directory = None ) :
+        self.__branches  = tuple ( branches )
+        self.__directory = directory if directory else cache_dir ( 'zones' )
+        os.makedirs ( self.__directory , exist_ok = True )
+
+    @property
+    def branches ( self ) :
+        """`branches` : branches with zone maps"""
+        return self.__branches
+
+    # =========================================================================
+    ## Derive the constraints { branch : ( low , high ) } from the histogram range and the cuts
+    def constraints ( self , histo , variables , cuts = '' ) :
+        """ Derive the constraints { branch : ( low , high ) } from the histogram range and the cuts
+        """
+        result = {}
+        def _add ( branch , low , high ) :
+            if not branch in self.__branches : return
+            lo , hi = result.get ( branch , ( -math.inf , math.inf ) )
+            result [ branch ] = max ( lo , low ) , min ( hi , high )
+
+        ## (1) histogram axes
+        axes = histo.GetXaxis () , histo.GetYaxis () , histo.GetZaxis ()
+        for axis , expression in zip ( axes , variables ) :
+            interval = _axis_interval ( expression , axis.GetXmin () , axis.GetXmax () )
+            if interval : _add ( *interval )
+
+        ## (2) cuts: only pure conjunctions of simple comparisons
+        cuts = str ( cuts ).strip () if cuts else ''
+        if cuts and not '||' in cuts and not '!' in cuts :
+            for term in cuts.split ( '&&' ) :
+                term = _strip ( term )
+                m1   = _cmp1_re.match ( term )
+                m2   = _cmp2_re.match ( term )
+                if   m1 :
+                    branch , op , value = m1.groups ()
+                elif m2 :
+                    value  , op , branch = m2.groups ()
+                    op = { '<' : '>' , '<=' : '>=' , '>' : '<' , '>=' : '<=' } [ op ]
+                else :
+                    continue
+                value = float ( value )
+                if op in ( '<' , '<=' ) : _add ( branch , -math.inf , value )
+                else                    : _add ( branch , value , math.inf )
+
+        return result
+
+    # =========================================================================
+    ## the cache file for (file, tree_path)
+    def __path ( self , fname , tree_path ) :
+        key = hashlib.sha1 ( repr ( ( fname , tree_path , self.__branches ) ).encode () ).hexdigest ()
+        return os.path.join ( self.__directory , '%s.json' % key )
+
+    # =========================================================================
+    ## Get the zone map for (file, tree_path), build it if needed
+    #  @return dictionary with `entries`, `bytes`, `clusters`, `cbytes` and `ranges`
+    def zones ( self , fname , tree_path ) :
+        """ Get the zone map for (file, tree_path), build it if needed
+        - return dictionary with `entries`, `bytes`, `clusters`, `cbytes` and `ranges`
+        """
+        sig  = signature ( fname )
+        path = self.__path ( fname , tree_path )
+        try :
+            with open ( path , 'r' ) as f : zmap = json.load ( f )
+            if zmap.get ( 'signature' , None ) == repr ( sig ) : return zmap
+        except ( OSError , ValueError ) :
+            pass
+
+        tree = ROOT.TChain ( tree_path )
+        tree.Add ( fname )
+        N    = len ( tree )
+        zipb = tree.GetZipBytes ()
+
+        ## clusters
+        clusters = []
+        if 0 < N :
+            it    = tree.GetClusterIterator ( 0 )
+            start = it ()
+            while start < N :
+                end = it.GetNextEntry ()
+                clusters.append ( ( int ( start ) , int ( min ( end , N ) ) ) )
+                start = it ()
+
+        ## min/max per cluster
+        present  = [ b for b in self.__branches if b in tree ]
+        ranges   = {}
+        if present and clusters :
+            data , _ = tree.slice ( present , '' , structured = False , transpose = True )
+            starts   = numpy.array ( [ c [ 0 ] for c in clusters ] )
+            for i , b in enumerate ( present ) :
+                column = numpy.asarray ( data [ : , i ] , dtype = numpy.float64 )
+                ranges [ b ] = list ( zip ( numpy.fmin.reduceat ( column , starts ).tolist () ,
+                                            numpy.fmax.reduceat ( column , starts ).tolist () ) )
+
+        zmap = { 'signature' : repr ( sig )                                             ,
+                 'entries'   : N                                                        ,
+                 'bytes'     : zipb                                                     ,
+                 'clusters'  : clusters                                                 ,
+                 'cbytes'    : [ zipb * ( e - s ) / max ( N , 1 ) for s , e in clusters ] ,
+                 'ranges'    : ranges                                                   }
+
+        if sig is not None :
+            fd , tmp = tempfile.mkstemp ( suffix = '.json' , dir = self.__directory )
+            with os.fdopen ( fd , 'w' ) as f : json.dump ( zmap , f )
+            os.replace ( tmp , path )
+
+        return zmap
+
+    # =========================================================================
+    ## Select files and entry ranges that can contribute
+    #  @param tree_path   the tree path
+    #  @param files       the files
+    #  @param constraints constraints { branch : ( low , high ) }
+    #  @return list of kept (file, ranges) pairs (`None` for the whole file),
+    #          number of skipped bytes and the total number of bytes
+    def select ( self , tree_path , files , constraints ) :
+        """ Select files and entry ranges that can contribute
+        - return list of kept (file, ranges) pairs (`None` for the whole file),
+          number of skipped bytes and the total number of bytes
+        """
+        if not constraints : return [ ( f , None ) for f in files ] , 0 , 0
+
+        kept , skipped , total = [] , 0 , 0
+        for fname in files :
+            zmap   = self.zones ( fname , tree_path )
+            total += zmap [ 'bytes' ]
+            good   = numpy.ones ( len ( zmap [ 'clusters' ] ) , dtype = bool )
+            for branch , ( low , high ) in constraints.items () :
+                if not branch in zmap [ 'ranges' ] : continue
+                r     = numpy.asarray ( zmap [ 'ranges' ] [ branch ] , dtype = numpy.float64 ).reshape ( -1 , 2 )
+                ## all-NaN clusters have NaN ranges: keep them
+                good &= ~ ( ( r [ : , 1 ] < low ) | ( high < r [ : , 0 ] ) )
+            skipped += sum ( b for b , g in zip ( zmap [ 'cbytes' ] , good ) if not g )
+            if   numpy.all ( good ) : kept.append ( ( fname , None ) )
+            elif numpy.any ( good ) :
+                ranges = [ tuple ( c ) for c , g in zip ( zmap [ 'clusters' ] , good ) if g ]
+                kept.append ( ( fname , ranges ) )
+
+        return kept , skipped , total
+
+    # =========================================================================
+    ## Create the entry list for the kept (file, ranges) pairs
+    @staticmethod
+    def entry_list ( tree_path , kept ) :
+        """ Create the entry list for the kept (file, ranges) pairs
+        """
+        total = ROOT.TEntryList ()
+        total.SetDirectory ( ROOT.nullptr )
+        for fname , ranges in kept :
+            if ranges is None :
+                tree   = ROOT.TChain ( tree_path )
+                tree.Add ( fname )
+                ranges = [ ( 0 , len ( tree ) ) ]
+            sub = ROOT.TEntryList ( '' , '' , tree_path , fname )
+            sub.SetDirectory ( ROOT.nullptr )
+            for first , last in ranges : sub.EnterRange ( first , last )
+            total.Add ( sub )
+        return total
+
+    def __repr__ ( self ) : return 'ZoneMaps(%s)' % ', '.join ( self.__branches )
+
+# =============================================================================
+if '__main__' == __name__ :
+
+    from ostap.utils.docme import docme
+    docme ( __name__ , logger = logger )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,9 @@
+# =============================================================================
+## @file conftest.py
+#  make the `pidcalib` package importable for the tests 
+# =============================================================================
+import os, sys
+sys.path.insert ( 0 , os.path.dirname ( os.path.dirname ( os.path.abspath ( __file__ ) ) ) )
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file test_apply.py
+#  Vectorized lookup in the efficiency maps: edge bins, NaN and `default`
+# =============================================================================
+import pytest
+numpy = pytest.importorskip ( 'numpy' )
+ROOT  = pytest.importorskip ( 'ROOT'  )
+ostap = pytest.importorskip ( 'ostap' )
+from   array          import array
+from   pidcalib.apply import EffMap
+# =============================================================================
+XBINS = array ( 'd' , [ 0. , 1. , 2.5 , 4. ] )
+NAN   = float ( 'nan' )
+
+@pytest.fixture
+def histo () :
+    h = ROOT.TH2D ( 'h_apply' , '' , len ( XBINS ) - 1 , XBINS , 2 , -1 , 1 )
+    h.SetDirectory ( 0 )
+    for i in range ( 1 , 4 ) :
+        for j in range ( 1 , 3 ) :
+            h.SetBinContent ( i , j , 0.1 * i + 0.01 * j )
+    yield h
+
+## inside the range: the same bins as `TH1::FindBin`, the lower edge belongs to the bin
+def test_inside ( histo ) :
+    emap = EffMap ( histo )
+    x    = numpy.array ( [ 0. , 0.5 , 1. , 2.4999 , 2.5 , 3.9999 , 3.2 ] )
+    y    = numpy.array ( [ -1. , 0.  , 0.5 , -0.5 , 0.999 , 0. , -0.0001 ] )
+    expected = [ histo.GetBinContent ( histo.FindBin ( a , b ) ) for a , b in zip ( x , y ) ]
+    assert numpy.allclose ( emap ( [ x , y ] ) , expected )
+
+## outside the range: the edge bins (also for the upper edge of the last bin)
+def test_edge_bins ( histo ) :
+    emap = EffMap ( histo )
+    x    = numpy.array ( [ -5. , 4. , 100. , 1.5 , 1.5 , 1.5  ] )
+    y    = numpy.array ( [ 0.5 , 0.5 , -0.5 , -3. , 1. , 30. ] )
+    expected = [ histo.GetBinContent ( 1 , 2 ) , histo.GetBinContent ( 3 , 2 ) , histo.GetBinContent ( 3 , 1 ) ,
+                 histo.GetBinContent ( 2 , 1 ) , histo.GetBinContent ( 2 , 2 ) , histo.GetBinContent ( 2 , 2 ) ]
+    assert numpy.allclose ( emap ( [ x , y ] ) , expected )
+
+## NaN values get NaN efficiency
+def test_nan ( histo ) :
+    emap   = EffMap ( histo )
+    result = emap ( [ [ NAN , 0.5 , 0.5 , 10. ] , [ 0.5 , NAN , 0.5 , 0.5 ] ] )
+    assert numpy.isnan ( result [ 0 ] ) and numpy.isnan ( result [ 1 ] )
+    assert numpy.allclose ( result [ 2: ] , [ histo.GetBinContent ( 1 , 2 ) , histo.GetBinContent ( 3 , 2 ) ] )
+
+## the `default` value outside the range and for NaN values
+def test_default ( histo ) :
+    emap   = EffMap ( histo , default = -1.0 )
+    result = emap ( [ [ NAN , 0.5 , 4. , -0.1 , 0.5 , 0. ] , [ 0.5 , NAN , 0.5 , 0.5 , 1. , -1. ] ] )
+    assert numpy.array_equal ( result [ :5 ] , [ -1.0 ] * 5 )
+    assert result [ 5 ] == histo.GetBinContent ( 1 , 1 )
+
+## 1D map and the number of axes
+def test_1D () :
+    h = ROOT.TH1D ( 'h_apply1' , '' , 4 , 0 , 4 )
+    h.SetDirectory ( 0 )
+    for i in range ( 1 , 5 ) : h.SetBinContent ( i , 0.2 * i )
+    emap = EffMap ( h )
+    assert numpy.allclose ( emap ( [ [ -1 , 0 , 1.5 , 3.999 , 4 ] ] ) , [ 0.2 , 0.2 , 0.4 , 0.8 , 0.8 ] )
+    with pytest.raises ( AssertionError ) : emap ( [ [ 1 ] , [ 2 ] ] )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file test_bootstrap.py
+#  Bootstrap replicas: reproducibility for the given seed
+# =============================================================================
+import pytest
+numpy = pytest.importorskip ( 'numpy' )
+ROOT  = pytest.importorskip ( 'ROOT'  )
+ostap = pytest.importorskip ( 'ostap' )
+import ostap.histos.histos
+from   pidcalib.bootstrap import Bootstrap
+# =============================================================================
+REPLICAS = 8
+
+@pytest.fixture
+def histo () :
+    h = ROOT.TH2D ( 'h_bootstrap' , '' , 4 , 0 , 4 , 2 , -1 , 1 )
+    h.SetDirectory ( 0 )
+    yield h
+
+## the data: few points on the edges and out of range
+def _data ( seed , n = 500 ) :
+    rng    = numpy.random.default_rng ( seed )
+    x      = rng.uniform ( -0.5 , 4.5 , n )
+    y      = rng.uniform ( -1.2 , 1.2 , n )
+    x [ :4 ] = 0 , 1 , 4 , -1.e-9
+    accept = rng.uniform ( 0 , 1 , n ) < 0.7
+    w      = rng.uniform ( 0.5 , 1.5 , n )
+    return [ x , y ] , accept , w
+
+## the replicas are defined by the seed and the key only
+def test_reproducible ( histo ) :
+    values , accept , w = _data ( 1 )
+    b1 = Bootstrap ( histo , REPLICAS , seed = 42 ).fill ( values , accept , w , key = ( 'T' , 'a.root' ) )
+    b2 = Bootstrap ( histo , REPLICAS , seed = 42 ).fill ( values , accept , w , key = ( 'T' , 'a.root' ) )
+    assert numpy.array_equal ( b1.replica_arrays () , b2.replica_arrays () )
+    ## other seed or other key: other replicas
+    b3 = Bootstrap ( histo , REPLICAS , seed = 43 ).fill ( values , accept , w , key = ( 'T' , 'a.root' ) )
+    b4 = Bootstrap ( histo , REPLICAS , seed = 42 ).fill ( values , accept , w , key = ( 'T' , 'b.root' ) )
+    assert not numpy.array_equal ( b1.replica_arrays () , b3.replica_arrays () )
+    assert not numpy.array_equal ( b1.replica_arrays () , b4.replica_arrays () )
+
+## the replicas do not depend on the order of files (and on the parallelization)
+def test_order ( histo ) :
+    va , aa , wa = _data ( 2 )
+    vb , ab , wb = _data ( 3 , n = 300 )
+    b1 = Bootstrap ( histo , REPLICAS , seed = 7 )
+    b1.fill ( va , aa , wa , key = ( 'T' , 'a.root' ) )
+    b1.fill ( vb , ab , wb , key = ( 'T' , 'b.root' ) )
+    b2 = Bootstrap ( histo , REPLICAS , seed = 7 ).fill ( vb , ab , wb , key = ( 'T' , 'b.root' ) )
+    b2 += Bootstrap ( histo , REPLICAS , seed = 7 ).fill ( va , aa , wa , key = ( 'T' , 'a.root' ) )
+    assert numpy.allclose ( b1.replica_arrays () , b2.replica_arrays () , rtol = 0 , atol = 1.e-12 )
+    assert numpy.allclose ( b1.covariance     () , b2.covariance     () , rtol = 0 , atol = 1.e-12 )
+
+## replicas against the explicit Poisson weights
+def test_replicas ( histo ) :
+    values , accept , w = _data ( 4 )
+    boot = Bootstrap ( histo , REPLICAS , seed = 11 ).fill ( values , accept , w , key = ( 'T' , 'c.root' ) )
+    pois = numpy.random.default_rng ( boot.file_seed ( ( 'T' , 'c.root' ) ) ).poisson ( 1.0 , size = ( REPLICAS , len ( w ) ) )
+    ## the upper edge is the overflow
+    x , y = values
+    edges = ( numpy.linspace ( 0 , 4 , 5 ) , numpy.linspace ( -1 , 1 , 3 ) )
+    keep  = ( x != 4 ) & ( y != 1 )
+    for k in range ( REPLICAS ) :
+        a , _ = numpy.histogramdd ( ( x [ keep &  accept ] , y [ keep &  accept ] ) , bins = edges , weights = ( w * pois [ k ] ) [ keep &  accept ] )
+        r , _ = numpy.histogramdd ( ( x [ keep & ~accept ] , y [ keep & ~accept ] ) , bins = edges , weights = ( w * pois [ k ] ) [ keep & ~accept ] )
+        total = ( a + r ).ravel ()
+        eff   = numpy.divide ( a.ravel () , total , out = numpy.zeros_like ( total ) , where = total != 0 )
+        assert numpy.allclose ( boot.replica_arrays () [ k ] , eff )
+    ## nominal histograms: plain sums of weights
+    _ , accepted , _ = boot.nominal ()
+    a , _ = numpy.histogramdd ( ( x [ keep & accept ] , y [ keep & accept ] ) , bins = edges , weights = w [ keep & accept ] )
+    for i in range ( 4 ) :
+        for j in range ( 2 ) :
+            assert abs ( accepted.GetBinContent ( i + 1 , j + 1 ) - a [ i , j ] ) < 1.e-9
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file test_checkpoint.py
+#  Interrupted & resumed processing gives the same result as the uninterrupted one
+# =============================================================================
+import pytest
+ROOT  = pytest.importorskip ( 'ROOT'      )
+ostap = pytest.importorskip ( 'ostap'     )
+pytest.importorskip ( 'pidcalib2' )
+from   array                import array 
+from   pidcalib.metadata    import Metadata
+import pidcalib.pidcalib    as     PC
+import ostap.stats.statvars as     SV 
+# =============================================================================
+NFILES = 4 
+
+## create small calibration files 
+def _make_files ( tmp_path ) :
+    files = []
+    for i in range ( NFILES ) :
+        fname = str ( tmp_path / ( 'calib_%d.root' % i ) )
+        rfile = ROOT.TFile ( fname , 'RECREATE' )
+        tree  = ROOT.TTree ( 'T' , 'T' )
+        x , pid , sw = array ( 'd' , [ 0 ] ) , array ( 'd' , [ 0 ] ) , array ( 'd' , [ 0 ] )
+        tree.Branch ( 'x'             , x   , 'x/D'             )
+        tree.Branch ( 'pid'           , pid , 'pid/D'           )
+        tree.Branch ( 'probe_sWeight' , sw  , 'probe_sWeight/D' )
+        for j in range ( 1000 ) :
+            x   [ 0 ] = ( 7 * j + 13 * i ) % 100 / 10.0
+            pid [ 0 ] = ( 11 * j + 3 * i ) % 17 
+            sw  [ 0 ] = 0.5 + ( j % 3 ) 
+            tree.Fill ()
+        tree.Write ()
+        rfile.Close ()
+        files.append ( fname )
+    return tuple ( files )
+
+@pytest.fixture 
+def request_1d ( tmp_path , monkeypatch ) :
+    meta = Metadata ( {} , _make_files ( tmp_path ) , () , 'probe_sWeight' , ( 'T' , ) , '' )
+    monkeypatch.setattr ( PC , 'calibration_sample' , lambda *args , **kwargs : meta )
+    histo = ROOT.TH1D ( 'h_ckpt' , '' , 10 , 0 , 10 )
+    return PC.PARTICLE_1D ( 'Pi' , 'pid>8' , 'Test' , 'up' , '' , histo , 'x' )
+
+## interrupt the run, resume it and compare with the uninterrupted run 
+def test_resume ( request_1d , tmp_path , monkeypatch ) :
+
+    _ , acc0 , rej0 = request_1d.process ( silent = True )
+    
+    original = SV.data_efficiency
+    calls    = [ 0 ]
+    def interrupted ( *args , **kwargs ) :
+        calls [ 0 ] += 1
+        if 2 < calls [ 0 ] : raise KeyboardInterrupt ()
+        return original ( *args , **kwargs )
+    
+    ckpt = PC.Checkpoint ( str ( tmp_path / 'test.ckpt' ) , request_1d.identity () , every = 0 ) 
+    monkeypatch.setattr ( SV , 'data_efficiency' , interrupted )
+    with pytest.raises ( KeyboardInterrupt ) :
+        request_1d.process ( resume = ckpt , silent = True )
+    monkeypatch.setattr ( SV , 'data_efficiency' , original )
+
+    ckpt = PC.Checkpoint ( str ( tmp_path / 'test.ckpt' ) , request_1d.identity () , every = 0 ) 
+    assert 2 == ckpt.resumed 
+    _ , acc1 , rej1 = request_1d.process ( resume = ckpt , silent = True )
+    
+    for b in range ( 1 , acc0.GetNbinsX () + 1 ) :
+        assert acc0.GetBinContent ( b ) == pytest.approx ( acc1.GetBinContent ( b ) )
+        assert rej0.GetBinContent ( b ) == pytest.approx ( rej1.GetBinContent ( b ) )
+
+    ## resume once more: all units are taken from the checkpoint 
+    _ , acc2 , rej2 = request_1d.process ( resume = str ( tmp_path / 'test.ckpt' ) , silent = True )
+    for b in range ( 1 , acc0.GetNbinsX () + 1 ) :
+        assert acc0.GetBinContent ( b ) == pytest.approx ( acc2.GetBinContent ( b ) )
+        assert rej0.GetBinContent ( b ) == pytest.approx ( rej2.GetBinContent ( b ) )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
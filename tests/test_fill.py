@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file test_fill.py
+#  Boolean selections for the single-pass (RDataFrame) filling
+# =============================================================================
+import pytest
+ROOT  = pytest.importorskip ( 'ROOT'  )
+ostap = pytest.importorskip ( 'ostap' )
+from   pidcalib.fill import boolean
+# =============================================================================
+## certainly boolean selections
+@pytest.mark.parametrize ( 'expression' , ( 'x>1'   , '(x>1)'      , 'x>1 && y'      , 'a||b'   ,
+                                            '!x'    , '!(x+1)'     , '!abs(x)'       , '!x>1'   ,
+                                            'x^2>1' , 'abs(x)<1'   , '(a) && (b)'    , '1'      , 'true' ) )
+def test_boolean ( expression ) :
+    assert boolean ( expression )
+
+## non-boolean selections: `data_efficiency` uses their values as weights
+@pytest.mark.parametrize ( 'expression' , ( 'x'     , 'x*2'        , '!x*2'          , '(a>1)*(b<2)' ,
+                                            'a&b'   , 'x<<2'       , '(x>1) ? 1 : 2' , '(a)+(b)'     ,
+                                            'abs(x)' , 'probe_sWeight' ) )
+def test_non_boolean ( expression ) :
+    assert not boolean ( expression )
+
+## boolean columns
+def test_columns () :
+    assert     boolean ( 'flag' , lambda name : 'Bool_t'   )
+    assert     boolean ( 'flag' , lambda name : 'bool'     )
+    assert not boolean ( 'flag' , lambda name : 'Double_t' )
+    assert not boolean ( 'flag' , lambda name : None       )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
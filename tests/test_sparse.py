@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file test_sparse.py
+#  Sparse N-dimensional histograms against the dense `numpy.histogramdd`
+# =============================================================================
+import pytest
+numpy = pytest.importorskip ( 'numpy' )
+ROOT  = pytest.importorskip ( 'ROOT'  )
+ostap = pytest.importorskip ( 'ostap' )
+from   pidcalib.sparse import SparseHisto
+# =============================================================================
+EDGES = ( numpy.array ( [ 0. , 1. , 2.5 , 4. ] ) , numpy.array ( [ -1. , 0. , 1. ] ) )
+
+## dense view of the sparse histogram
+def _dense ( histo , values ) :
+    result = numpy.zeros ( histo.shape )
+    result.flat [ histo.index ] = values
+    return result
+
+## random data: bin edges, points inside and outside the range
+def _data ( seed , n = 1000 ) :
+    rng = numpy.random.default_rng ( seed )
+    x   = rng.uniform ( -1.0 , 5.0 , n )
+    y   = rng.uniform ( -1.5 , 1.5 , n )
+    x [ :20 ] = rng.choice ( EDGES [ 0 ] [ :-1 ] , 20 )
+    y [ :20 ] = rng.choice ( EDGES [ 1 ] [ :-1 ] , 20 )
+    w   = rng.uniform ( -0.5 , 2.0 , n )
+    return x , y , w
+
+## reference: `numpy.histogramdd` bins are [low,high) except the last bin,
+#  which includes the upper edge; the sparse histogram (as ROOT) puts
+#  the upper edge into the overflow
+def _reference ( x , y , w ) :
+    keep   = ( x != EDGES [ 0 ] [ -1 ] ) & ( y != EDGES [ 1 ] [ -1 ] )
+    sumw , _ = numpy.histogramdd ( ( x [ keep ] , y [ keep ] ) , bins = EDGES , weights = w [ keep ] )
+    sumw2, _ = numpy.histogramdd ( ( x [ keep ] , y [ keep ] ) , bins = EDGES , weights = w [ keep ] ** 2 )
+    return sumw , sumw2
+
+## fill with weights, including the bin edges and out-of-range values
+def test_fill () :
+    x , y , w  = _data ( 1 )
+    h          = SparseHisto ( EDGES ).fill ( [ x , y ] , w )
+    sumw , sw2 = _reference ( x , y , w )
+    assert numpy.allclose ( _dense ( h , h.sumw  ) , sumw )
+    assert numpy.allclose ( _dense ( h , h.sumw2 ) , sw2  )
+    assert numpy.all ( numpy.diff ( h.index ) > 0 )
+
+## the values on the bin edges
+def test_edges () :
+    h = SparseHisto ( EDGES ).fill ( [ [ 0. , 1. , 2.5 , 4. , -1.e-9 ] , [ -1. , 0. , 0. , 0. , 0. ] ] )
+    counts = _dense ( h , h.sumw )
+    ## the lower edge belongs to the bin, the upper edge of the last bin is the overflow
+    assert counts [ 0 , 0 ] == 1 and counts [ 1 , 1 ] == 1 and counts [ 2 , 1 ] == 1
+    assert 3 == counts.sum ()
+    ## out of range and NaN values are ignored
+    nan = float ( 'nan' )
+    h   = SparseHisto ( EDGES ).fill ( [ [ -5. , 5. , nan , 0.5 ] , [ 0.5 , 0.5 , 0.5 , 7. ] ] )
+    assert 0 == len ( h )
+
+## unweighted fill: the sums of squared weights are the counts
+def test_unweighted () :
+    x , y , _ = _data ( 2 )
+    h         = SparseHisto ( EDGES ).fill ( [ x , y ] )
+    counts, _ = _reference ( x , y , numpy.ones_like ( x ) )
+    assert numpy.array_equal ( _dense ( h , h.sumw  ) , counts )
+    assert numpy.array_equal ( _dense ( h , h.sumw2 ) , counts )
+
+## sparse merge is equivalent to the fill of the concatenated data
+def test_merge () :
+    x1 , y1 , w1 = _data ( 3 )
+    x2 , y2 , w2 = _data ( 4 , n = 10 )
+    h1 = SparseHisto ( EDGES ).fill ( [ x1 , y1 ] , w1 )
+    h2 = SparseHisto ( EDGES ).fill ( [ x2 , y2 ] , w2 )
+    h  = h1 + h2
+    sumw , sw2 = _reference ( numpy.concatenate ( ( x1 , x2 ) ) , numpy.concatenate ( ( y1 , y2 ) ) , numpy.concatenate ( ( w1 , w2 ) ) )
+    assert numpy.allclose ( _dense ( h , h.sumw  ) , sumw )
+    assert numpy.allclose ( _dense ( h , h.sumw2 ) , sw2  )
+    ## in-place merge with the empty histogram
+    h1 += SparseHisto ( EDGES )
+    assert numpy.array_equal ( h1.index , SparseHisto ( EDGES ).fill ( [ x1 , y1 ] , w1 ).index )
+    ## different binnings cannot be merged
+    with pytest.raises ( AssertionError ) : h1 += SparseHisto ( ( EDGES [ 0 ] , [ -1. , 1. ] ) )
+
+## efficiency against the dense calculation
+def test_efficiency () :
+    x , y , w = _data ( 5 )
+    accept    = x * y > 0.5
+    a = SparseHisto ( EDGES ).fill ( [ x [  accept ] , y [  accept ] ] , w [  accept ] )
+    r = SparseHisto ( EDGES ).fill ( [ x [ ~accept ] , y [ ~accept ] ] , w [ ~accept ] )
+    index , eff , var = SparseHisto.efficiency ( a , r )
+    assert numpy.array_equal ( index , numpy.union1d ( a.index , r.index ) )
+
+    sa , sa2 = _reference ( x [  accept ] , y [  accept ] , w [  accept ] )
+    sr , sr2 = _reference ( x [ ~accept ] , y [ ~accept ] , w [ ~accept ] )
+    total    = ( sa + sr ).flat [ index ]
+    expected = numpy.where ( total != 0 , sa.flat [ index ] / numpy.where ( total != 0 , total , 1 ) , 0 )
+    assert numpy.allclose ( eff , expected )
+    variance = ( sr.flat [ index ] ** 2 * sa2.flat [ index ] + sa.flat [ index ] ** 2 * sr2.flat [ index ] )
+    assert numpy.allclose ( var [ total != 0 ] , ( variance / total ** 4 ) [ total != 0 ] )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
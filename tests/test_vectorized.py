@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file test_vectorized.py
+#  Translation of TFormula-like expressions into vectorized NumPy expressions
+# =============================================================================
+import pytest
+numpy = pytest.importorskip ( 'numpy' )
+ROOT  = pytest.importorskip ( 'ROOT'  )
+ostap = pytest.importorskip ( 'ostap' )
+from   array               import array
+from   pidcalib.vectorized import Expression, vectorizable, fill_arrays, to_histo
+# =============================================================================
+NAMES  = ( 'x' , 'y' , 'probe_P' , 'probe_ETA' , 'flag' )
+ARRAYS = { 'x'         : numpy.array ( [ 0.0 ,  0.5 , 2.0 , 3.0 ] ) ,
+           'y'         : numpy.array ( [ 1.0 , -1.0 , 0.0 , 2.0 ] ) ,
+           'probe_P'   : numpy.array ( [ 5.e3 , 2.e4 , 1.e5 , 3.e3 ] ) ,
+           'probe_ETA' : numpy.array ( [ 2.1 ,  4.6 , 3.0 , 4.4 ] ) ,
+           'flag'      : numpy.array ( [ True , False , True , False ] ) }
+
+def _eval ( expression ) :
+    return Expression ( expression , NAMES ) ( ARRAYS , 4 )
+
+## logical operators, TMath functions and power
+def test_operators () :
+    x , y = ARRAYS [ 'x' ] , ARRAYS [ 'y' ]
+    assert numpy.array_equal ( _eval ( 'x>1 && y>0'  ) , ( x > 1 ) & ( y > 0 ) )
+    assert numpy.array_equal ( _eval ( 'x>1 || y>0'  ) , ( x > 1 ) | ( y > 0 ) )
+    assert numpy.allclose    ( _eval ( 'x^2+TMath::Sqrt(x)' ) , x ** 2 + numpy.sqrt ( x ) )
+    assert numpy.allclose    ( _eval ( 'TMath::Log10(probe_P/1000)' ) , numpy.log10 ( ARRAYS [ 'probe_P' ] / 1000 ) )
+    assert numpy.array_equal ( _eval ( '0<x<2.5'     ) , ( 0 < x ) & ( x < 2.5 ) )
+    assert numpy.array_equal ( _eval ( 'x!=0'        ) , x != 0 )
+    assert numpy.array_equal ( _eval ( 'true'        ) , numpy.ones ( 4 ) )
+
+## `!` binds to the immediate operand, as in C
+def test_not_precedence () :
+    x , y = ARRAYS [ 'x' ] , ARRAYS [ 'y' ]
+    assert numpy.array_equal ( _eval ( '!x>1'        ) , numpy.logical_not ( x ) > 1 )
+    assert numpy.array_equal ( _eval ( '!x==0'       ) , numpy.logical_not ( x ) == 0 )
+    assert numpy.array_equal ( _eval ( '!(x>1)'      ) , ~ ( x > 1 ) )
+    assert numpy.array_equal ( _eval ( '!flag && y>0' ) , ~ ARRAYS [ 'flag' ] & ( y > 0 ) )
+    assert numpy.array_equal ( _eval ( '!!flag'      ) , ARRAYS [ 'flag' ] )
+
+## boolean and non-boolean expressions
+def test_boolean () :
+    assert     Expression ( 'x>1'           , NAMES ).boolean
+    assert     Expression ( 'x>1 && y<2'    , NAMES ).boolean
+    assert     Expression ( '!x'            , NAMES ).boolean
+    assert     Expression ( '0<x<1'         , NAMES ).boolean
+    assert     Expression ( '1'             , NAMES ).boolean
+    assert not Expression ( 'x'             , NAMES ).boolean
+    assert not Expression ( 'x*(y>0)'       , NAMES ).boolean
+    assert not Expression ( '2'             , NAMES ).boolean
+
+## used columns
+def test_columns () :
+    expr = Expression ( 'log10(probe_P/1000)>1 && probe_ETA<4.5 && probe_P>1e3' , NAMES )
+    assert expr.columns == ( 'probe_P' , 'probe_ETA' )
+
+## unsupported constructions
+@pytest.mark.parametrize ( 'expression' , ( 'z>1' , 'x>1 &&' , 'x.size' , '~x' , 'x[0]' , 'foo(x)' , '__import__("os")' ) )
+def test_unsupported ( expression ) :
+    with pytest.raises ( ValueError ) : Expression ( expression , NAMES )
+
+## the tree for `vectorizable` & `fill_arrays`
+@pytest.fixture
+def tree () :
+    t = ROOT.TTree ( 'T_vectorized' , '' )
+    t.SetDirectory ( 0 )
+    x , w = array ( 'd' , [ 0 ] ) , array ( 'd' , [ 0 ] )
+    b     = array ( 'b' , [ 0 ] )
+    t.Branch ( 'x'    , x , 'x/D'    )
+    t.Branch ( 'w'    , w , 'w/D'    )
+    t.Branch ( 'flag' , b , 'flag/O' )
+    for i in range ( 100 ) :
+        x [ 0 ] , w [ 0 ] , b [ 0 ] = ( i % 10 ) + 0.5 , 0.5 + ( i % 3 ) , i % 2
+        t.Fill ()
+    yield t
+
+## non-boolean selections are not vectorizable: the ROOT backend uses them as weights
+def test_vectorizable ( tree ) :
+    assert vectorizable ( tree , 'x' , 'w' , selections = ( 'x>2' , 'flag'  ) ) is None
+    assert vectorizable ( tree , 'x' , 'w' , selections = ( 'x>2' , 'w'     ) )
+    assert vectorizable ( tree , 'x' , 'w' , selections = ( 'x*2' , ''      ) )
+    assert vectorizable ( tree , 'z' )
+
+## the number of entries is the number of filled entries, not the sum of weights
+def test_entries ( tree ) :
+    histo = ROOT.TH1D ( 'h_vectorized' , '' , 10 , 0 , 10 )
+    accepted , rejected = fill_arrays ( tree , histo , ( 'x' , ) , 'x>5' , 'flag' , 'w' )
+    acc , rej = to_histo ( histo , accepted ) , to_histo ( histo , rejected )
+    assert acc.GetEntries () + rej.GetEntries () == 50
+    assert abs ( acc.Integral () + rej.Integral () - sum ( 0.5 + ( i % 3 ) for i in range ( 100 ) if i % 2 ) ) < 1.e-9
+    assert 0 == acc.Integral ( 1 , 5 ) and 0 == rej.Integral ( 7 , 10 )
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================
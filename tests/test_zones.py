@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# =============================================================================
+## @file test_zones.py
+#  Constraints of the zone maps: the skipped data must provably not contribute
+# =============================================================================
+import pytest, math
+numpy = pytest.importorskip ( 'numpy' )
+ROOT  = pytest.importorskip ( 'ROOT'  )
+ostap = pytest.importorskip ( 'ostap' )
+from   pidcalib.zones import ZoneMaps, _axis_interval
+# =============================================================================
+## minimal histogram: only the axis ranges are used
+class _Axis(object) :
+    def __init__ ( self , low , high ) : self.low , self.high = low , high
+    def GetXmin  ( self ) : return self.low
+    def GetXmax  ( self ) : return self.high
+class _Histo(object) :
+    def __init__ ( self , *ranges ) :
+        self.axes = [ _Axis ( *r ) for r in ranges ] + [ _Axis ( 0 , 1 ) ] * ( 3 - len ( ranges ) )
+    def GetXaxis ( self ) : return self.axes [ 0 ]
+    def GetYaxis ( self ) : return self.axes [ 1 ]
+    def GetZaxis ( self ) : return self.axes [ 2 ]
+
+@pytest.fixture
+def zmaps ( tmp_path ) :
+    return ZoneMaps ( directory = str ( tmp_path ) )
+
+def _close ( a , b ) :
+    return all ( math.isclose ( x , y , rel_tol = 1.e-12 ) for x , y in zip ( a , b ) )
+
+## inversion of the axis expressions
+def test_axis_interval () :
+    branch , low , high = _axis_interval ( 'log10(probe_P/1000)' , 0.5 , 2 )
+    assert 'probe_P' == branch and _close ( ( low , high ) , ( 1000 * 10 ** 0.5 , 1.e5 ) )
+    branch , low , high = _axis_interval ( 'log(probe_PT)' , 0 , 1 )
+    assert 'probe_PT' == branch and _close ( ( low , high ) , ( 1 , math.e ) )
+    assert _axis_interval ( 'probe_P/1000'  , 1 , 2 ) == ( 'probe_P'   , 1000. , 2000. )
+    assert _axis_interval ( ' probe_ETA '   , 2 , 5 ) == ( 'probe_ETA' , 2.    , 5.    )
+    ## not invertible: no constraint
+    for expression in ( 'log10(probe_P)/1000' , 'probe_P*1000' , 'probe_P/-1' , 'log10(probe_P' ,
+                        'sqrt(probe_P)' , 'probe_P+probe_PT' , 'log10((probe_P))' ) :
+        assert _axis_interval ( expression , 0 , 1 ) is None , expression
+
+## histogram axes and cuts
+def test_constraints ( zmaps ) :
+    histo = _Histo ( ( 0 , 2 ) , ( 1.5 , 5 ) )
+    c = zmaps.constraints ( histo , ( 'log10(probe_P/1000)' , 'probe_ETA' ) , 'probe_ETA<4.5 && 2<=probe_ETA' )
+    assert _close ( c [ 'probe_P'   ] , ( 1000 , 1.e5 ) )
+    assert _close ( c [ 'probe_ETA' ] , ( 2 , 4.5 ) )
+
+## reversed comparisons `c < X`
+def test_reversed ( zmaps ) :
+    histo = _Histo ( ( -100 , 100 ) )
+    c = zmaps.constraints ( histo , ( 'x' , ) , '1000<probe_P && 50>=nTracks' )
+    assert c [ 'probe_P' ] == ( 1000 , math.inf  )
+    assert c [ 'nTracks' ] == ( -math.inf , 50   )
+
+## `||` and `!` disable the cut constraints
+@pytest.mark.parametrize ( 'cuts' , ( 'probe_P>1000 || probe_ETA<4' , 'probe_P>1000 && !(probe_ETA<4)' ,
+                                      'probe_P>1000 && probe_ETA!=3' ) )
+def test_rejected ( zmaps , cuts ) :
+    histo = _Histo ( ( -100 , 100 ) )
+    assert {} == zmaps.constraints ( histo , ( 'x' , ) , cuts )
+
+## parentheses: redundant ones are stripped, the rest is not constraining
+def test_parentheses ( zmaps ) :
+    histo = _Histo ( ( -100 , 100 ) )
+    c = zmaps.constraints ( histo , ( 'x' , ) , '((probe_P>1000)) && ( probe_ETA < 4 )' )
+    assert c == { 'probe_P' : ( 1000 , math.inf ) , 'probe_ETA' : ( -math.inf , 4 ) }
+    c = zmaps.constraints ( histo , ( 'x' , ) , '(probe_P>1000 && probe_ETA<4) && (probe_PT)>100' )
+    assert 'probe_PT' not in c
+    c = zmaps.constraints ( histo , ( 'x' , ) , 'probe_P>1000*2 && unknown<3' )
+    assert {} == c
+
+## minimal zone maps without the files
+class _Zones(ZoneMaps) :
+    def __init__ ( self , zmap , **kwargs ) :
+        ZoneMaps.__init__ ( self , **kwargs )
+        self.zmap = zmap
+    def zones ( self , fname , tree_path ) : return self.zmap
+
+## the clusters with NaN ranges (all-NaN values) are kept
+def test_nan_clusters ( tmp_path ) :
+    nan  = float ( 'nan' )
+    zmap = { 'entries'  : 30 , 'bytes' : 300 ,
+             'clusters' : [ ( 0 , 10 ) , ( 10 , 20 ) , ( 20 , 30 ) ] ,
+             'cbytes'   : [ 100 , 100 , 100 ] ,
+             'ranges'   : { 'probe_P' : [ ( 10 , 20 ) , ( nan , nan ) , ( 5000 , 6000 ) ] } }
+    zmaps = _Zones ( zmap , directory = str ( tmp_path ) )
+    kept , skipped , total = zmaps.select ( 'T' , [ 'f.root' ] , { 'probe_P' : ( 1000 , math.inf ) } )
+    assert kept == [ ( 'f.root' , [ ( 10 , 20 ) , ( 20 , 30 ) ] ) ]
+    assert 100 == skipped and 300 == total
+    ## no cluster passes: the file is skipped
+    kept , skipped , _ = zmaps.select ( 'T' , [ 'f.root' ] , { 'probe_P' : ( 1.e6 , math.inf ) } )
+    assert [ ( 'f.root' , [ ( 10 , 20 ) ] ) ] == kept and 200 == skipped
+    ## the constraint on the absent branch does not skip anything
+    kept , skipped , _ = zmaps.select ( 'T' , [ 'f.root' ] , { 'nTracks' : ( 1.e6 , math.inf ) } )
+    assert [ ( 'f.root' , None ) ] == kept and 0 == skipped
+
+# =============================================================================
+##                                                                      The END
+# =============================================================================